@@ -10,19 +10,191 @@ DB_USER=os.getenv("DB_USER")
 DB_PASSWORD=os.getenv("DB_PASSWORD")
 HOST=os.getenv("HOST")
 
-# DB URL
-DB_CONFIG = f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{HOST}:3306/{DB_NAME}"
+# DB URL, DB_URL / DB_ASYNC_URL override it (e.g. sqlite:///./khetai.db for local runs)
+DB_CONFIG = os.getenv("DB_URL") or f"mysql+mysqlconnector://{DB_USER}:{DB_PASSWORD}@{HOST}:3306/{DB_NAME}"
+DB_ASYNC_CONFIG = os.getenv("DB_ASYNC_URL") or f"mysql+aiomysql://{DB_USER}:{DB_PASSWORD}@{HOST}:3306/{DB_NAME}"
+
+# App
+DEBUG=os.getenv("DEBUG", "false").lower() == "true"
+LOG_LEVEL=os.getenv("LOG_LEVEL", "INFO").upper()
+
+# DB engine tuning
+DB_ASYNC=os.getenv("DB_ASYNC", "false").lower() == "true"
+DB_ECHO=os.getenv("DB_ECHO", "false").lower() == "true"
+DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_TIMEOUT=float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_PRE_PING=os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# Auth, resolved principals are cached per process for AUTH_CACHE_TTL seconds (0 disables the cache)
+AUTH_CACHE_TTL=float(os.getenv("AUTH_CACHE_TTL", 30))
+AUTH_CACHE_SIZE=int(os.getenv("AUTH_CACHE_SIZE", 10000))
 
 # Sparrow SMS Credentials
 SPARROW_API=os.getenv("SPARROW_API")
 SPARROW_TOKEN=os.getenv("SPARROW_TOKEN")
 
+# SMS outbox, "log" only logs the texts (the default when Sparrow is not configured)
+SMS_BACKEND=os.getenv("SMS_BACKEND", "sparrow" if SPARROW_API else "log")
+SMS_SENDERS=int(os.getenv("SMS_SENDERS", 2))
+SMS_MAX_QUEUE=int(os.getenv("SMS_MAX_QUEUE", 1000))
+SMS_MAX_RETRIES=int(os.getenv("SMS_MAX_RETRIES", 3))
+
+# OTP, the memory store is only correct with a single worker
+OTP_STORE=os.getenv("OTP_STORE", "database")
+OTP_TTL=int(os.getenv("OTP_TTL", 300))
+OTP_MAX_ATTEMPTS=int(os.getenv("OTP_MAX_ATTEMPTS", 5))
+OTP_LOCKOUT=int(os.getenv("OTP_LOCKOUT", 900))
+OTP_PHONE_BURST=int(os.getenv("OTP_PHONE_BURST", 3))
+OTP_PHONE_REFILL=float(os.getenv("OTP_PHONE_REFILL", 120))
+OTP_IP_BURST=int(os.getenv("OTP_IP_BURST", 20))
+OTP_IP_REFILL=float(os.getenv("OTP_IP_REFILL", 10))
+OTP_SWEEP_INTERVAL=int(os.getenv("OTP_SWEEP_INTERVAL", 600))
+# Echo the code in the /farmer/request-otp response, for development without an SMS gateway
+OTP_EXPOSE_CODE=os.getenv("OTP_EXPOSE_CODE", str(SMS_BACKEND == "log")).lower() == "true"
+
 # Upload Dir
 BASE_UPLOAD_DIR = Path("uploads")
 PRODUCTS_DIR = BASE_UPLOAD_DIR / "products"
 USERS_DIR = BASE_UPLOAD_DIR / "users"
 VOICES_DIR = BASE_UPLOAD_DIR / "voices"
+DERIVATIVES_DIR = PRODUCTS_DIR / "derivatives"
+TTS_CACHE_DIR = BASE_UPLOAD_DIR / "tts"
 
 # API Keys
 OPENAI_KEY=os.getenv("OPENAI_KEY")
-ASSEMBLYAI_KEY=os.getenv("ASSEMBLYAI_KEY")
\ No newline at end of file
+ASSEMBLYAI_KEY=os.getenv("ASSEMBLYAI_KEY")
+
+# Disease detection inference batching
+INFERENCE_BATCH_SIZE=int(os.getenv("INFERENCE_BATCH_SIZE", 16))
+INFERENCE_MAX_WAIT_MS=float(os.getenv("INFERENCE_MAX_WAIT_MS", 10))
+INFERENCE_WORKERS=int(os.getenv("INFERENCE_WORKERS", 1))
+# "local" runs the model in every API worker, "remote" sends decoded images to dedicated inference
+# server processes (python -m services.inference_server), one per comma-separated Unix socket path
+INFERENCE_MODE=os.getenv("INFERENCE_MODE", "local")
+INFERENCE_SOCKETS=[path for path in os.getenv("INFERENCE_SOCKETS", "data/inference.sock").split(",") if path]
+INFERENCE_TIMEOUT=float(os.getenv("INFERENCE_TIMEOUT", 30))
+
+# Disease detection model runtime: "keras" or "tflite"
+MODEL_BACKEND=os.getenv("MODEL_BACKEND", "keras")
+# Model file to load instead of the backend's default in trained_models/
+MODEL_PATH=os.getenv("MODEL_PATH", "")
+# "lazy" loads on the first request, "background" warms up right after startup
+MODEL_WARMUP=os.getenv("MODEL_WARMUP", "background")
+# Number of ranked classes returned by /diseases-detect
+PREDICTION_TOP_K=int(os.getenv("PREDICTION_TOP_K", 3))
+
+# Disease detection prediction cache, the disk tier is disabled when no dir is set
+PREDICTION_CACHE_SIZE=int(os.getenv("PREDICTION_CACHE_SIZE", 2048))
+PREDICTION_CACHE_TTL=float(os.getenv("PREDICTION_CACHE_TTL", 24 * 60 * 60))
+PREDICTION_CACHE_DIR=os.getenv("PREDICTION_CACHE_DIR") or None
+
+# Uploads are streamed to disk in chunks and rejected once they pass these limits
+UPLOAD_CHUNK_SIZE=int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+UPLOAD_MAX_FILE_SIZE=int(os.getenv("UPLOAD_MAX_FILE_SIZE", 20 * 1024 * 1024))
+UPLOAD_MAX_REQUEST_SIZE=int(os.getenv("UPLOAD_MAX_REQUEST_SIZE", 50 * 1024 * 1024))
+UPLOAD_CONCURRENCY=int(os.getenv("UPLOAD_CONCURRENCY", 4))
+
+# Uploaded files are stored once per content: "local" under STORAGE_DIR, "s3" in S3_BUCKET (needs boto3,
+# S3_ENDPOINT_URL points it at any S3-compatible service, e.g. MinIO)
+STORAGE_BACKEND=os.getenv("STORAGE_BACKEND", "local")
+STORAGE_DIR=Path(os.getenv("STORAGE_DIR", str(BASE_UPLOAD_DIR / "storage")))
+S3_BUCKET=os.getenv("S3_BUCKET")
+S3_PREFIX=os.getenv("S3_PREFIX", "blobs/")
+S3_ENDPOINT_URL=os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION=os.getenv("S3_REGION") or None
+S3_ACCESS_KEY_ID=os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY=os.getenv("S3_SECRET_ACCESS_KEY") or None
+# Seconds a product image is kept once no product uses it (or after the upload if none ever did), and
+# a voice note after the upload. Unreferenced files are deleted every STORAGE_GC_INTERVAL, 0 disables it
+UPLOAD_ORPHAN_TTL=float(os.getenv("UPLOAD_ORPHAN_TTL", 24 * 60 * 60))
+VOICE_UPLOAD_TTL=float(os.getenv("VOICE_UPLOAD_TTL", 24 * 60 * 60))
+STORAGE_GC_INTERVAL=float(os.getenv("STORAGE_GC_INTERVAL", 60 * 60))
+# S3 files are downloaded from presigned URLs valid this many seconds
+STORAGE_URL_EXPIRY=int(os.getenv("STORAGE_URL_EXPIRY", 60 * 60))
+# Internal proxy location serving STORAGE_DIR/blobs, e.g. nginx "location /_blobs/ { internal; alias ...; }",
+# local files are then sent by the proxy with sendfile instead of by the API
+STORAGE_ACCEL_REDIRECT=os.getenv("STORAGE_ACCEL_REDIRECT") or None
+
+# Bulk product import, rows are inserted in chunks of PRODUCT_IMPORT_CHUNK_SIZE, one transaction each
+PRODUCT_IMPORT_CHUNK_SIZE=int(os.getenv("PRODUCT_IMPORT_CHUNK_SIZE", 1000))
+PRODUCT_IMPORT_MAX_ROWS=int(os.getenv("PRODUCT_IMPORT_MAX_ROWS", 100000))
+
+# Nearby product and farmer searches grow their radius up to this many km looking for k results
+NEARBY_MAX_RADIUS_KM=float(os.getenv("NEARBY_MAX_RADIUS_KM", 300))
+
+# Dashboard rollups are corrected against the products table this often, 0 disables it
+ROLLUP_RECONCILE_INTERVAL=float(os.getenv("ROLLUP_RECONCILE_INTERVAL", 6 * 60 * 60))
+DASHBOARD_MAX_DAYS=int(os.getenv("DASHBOARD_MAX_DAYS", 365))
+
+# Product image derivatives (thumb/card/full) are generated on this many threads
+IMAGE_DERIVATIVE_WORKERS=int(os.getenv("IMAGE_DERIVATIVE_WORKERS", 2))
+
+# Product full-text search index, memory-mapped from this file
+SEARCH_INDEX_PATH=Path(os.getenv("SEARCH_INDEX_PATH", "data/product_search.idx"))
+# Seconds between saves of a changed index, what a crash loses is re-indexed from the database on the next start
+SEARCH_INDEX_SAVE_INTERVAL=float(os.getenv("SEARCH_INDEX_SAVE_INTERVAL", 300))
+
+# Background task queue, tasks are stored in TASK_QUEUE_URL (a local SQLite file by default) and survive restarts
+TASK_QUEUE_URL=os.getenv("TASK_QUEUE_URL", "sqlite:///data/tasks.db")
+TASK_ASYNC_WORKERS=int(os.getenv("TASK_ASYNC_WORKERS", 8))
+TASK_THREAD_WORKERS=int(os.getenv("TASK_THREAD_WORKERS", 2))
+TASK_MAX_ATTEMPTS=int(os.getenv("TASK_MAX_ATTEMPTS", 5))
+TASK_RETRY_BACKOFF=float(os.getenv("TASK_RETRY_BACKOFF", 2))
+TASK_LEASE=float(os.getenv("TASK_LEASE", 300))
+TASK_POLL_INTERVAL=float(os.getenv("TASK_POLL_INTERVAL", 1))
+TASK_RETENTION=float(os.getenv("TASK_RETENTION", 7 * 24 * 60 * 60))
+
+# Response compression, br needs the brotli package, bodies under COMPRESSION_MIN_SIZE bytes are sent as is
+COMPRESSION_ENABLED=os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_SIZE=int(os.getenv("COMPRESSION_MIN_SIZE", 500))
+GZIP_LEVEL=int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY=int(os.getenv("BROTLI_QUALITY", 4))
+
+# Read endpoint response cache: "memory" (per process) or "redis" (shared, needs RESPONSE_CACHE_URL)
+RESPONSE_CACHE_BACKEND=os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_URL=os.getenv("RESPONSE_CACHE_URL")
+RESPONSE_CACHE_TTL=float(os.getenv("RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_SIZE=int(os.getenv("RESPONSE_CACHE_SIZE", 10000))
+
+# Speech to text: "assemblyai" or the offline "stub" backend
+TRANSCRIPTION_BACKEND=os.getenv("TRANSCRIPTION_BACKEND", "assemblyai")
+TRANSCRIPTION_LANGUAGE=os.getenv("TRANSCRIPTION_LANGUAGE", "hi")
+TRANSCRIPTION_WORKERS=int(os.getenv("TRANSCRIPTION_WORKERS", 4))
+TRANSCRIPTION_CACHE_SIZE=int(os.getenv("TRANSCRIPTION_CACHE_SIZE", 4096))
+TRANSCRIPTION_CACHE_DIR=os.getenv("TRANSCRIPTION_CACHE_DIR") or None
+
+# Text to speech: "gtts" or the offline "stub" backend, audio is cached on disk up to TTS_CACHE_MAX_BYTES
+TTS_BACKEND=os.getenv("TTS_BACKEND", "gtts")
+TTS_LANGUAGE=os.getenv("TTS_LANGUAGE", "hi")
+TTS_CACHE_MAX_BYTES=int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+TTS_WORKERS=int(os.getenv("TTS_WORKERS", 4))
+TTS_MAX_CHARS=int(os.getenv("TTS_MAX_CHARS", 5000))
+TTS_PREGENERATE=os.getenv("TTS_PREGENERATE", "true").lower() == "true"
+
+# LLM chat gateway: "openai" or the offline "fake" backend
+CHAT_BACKEND=os.getenv("CHAT_BACKEND", "openai")
+CHAT_MODEL=os.getenv("CHAT_MODEL", "gpt-4o-mini")
+CHAT_MAX_CONCURRENCY=int(os.getenv("CHAT_MAX_CONCURRENCY", 16))
+CHAT_PER_USER_CONCURRENCY=int(os.getenv("CHAT_PER_USER_CONCURRENCY", 2))
+CHAT_QUEUE_TIMEOUT=float(os.getenv("CHAT_QUEUE_TIMEOUT", 10))
+CHAT_TIMEOUT=float(os.getenv("CHAT_TIMEOUT", 60))
+CHAT_MAX_RETRIES=int(os.getenv("CHAT_MAX_RETRIES", 2))
+CHAT_MAX_CONNECTIONS=int(os.getenv("CHAT_MAX_CONNECTIONS", 32))
+CHAT_CACHE_SIZE=int(os.getenv("CHAT_CACHE_SIZE", 1024))
+CHAT_CACHE_TTL=float(os.getenv("CHAT_CACHE_TTL", 6 * 60 * 60))
+
+# Kalimati market price ingestion
+PRICE_INGEST_ENABLED=os.getenv("PRICE_INGEST_ENABLED", "true").lower() == "true"
+PRICE_INGEST_INTERVAL=float(os.getenv("PRICE_INGEST_INTERVAL", 60 * 60))
+PRICE_HISTORY_DAYS=int(os.getenv("PRICE_HISTORY_DAYS", 365))
+
+# Slow request profiling (needs pyinstrument), profiles a sample of requests plus any sent with
+# "X-Profile: <PROFILE_HEADER_SECRET>". The header is ignored while the secret is empty
+PROFILE_SLOW_REQUESTS=os.getenv("PROFILE_SLOW_REQUESTS", "false").lower() == "true"
+PROFILE_SLOW_MS=float(os.getenv("PROFILE_SLOW_MS", 500))
+PROFILE_SAMPLE_RATE=float(os.getenv("PROFILE_SAMPLE_RATE", 0.01))
+PROFILE_DIR=Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_HEADER_SECRET=os.getenv("PROFILE_HEADER_SECRET", "")
+PROFILE_MAX_FILES=int(os.getenv("PROFILE_MAX_FILES", 100))
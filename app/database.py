@@ -1,11 +1,45 @@
 from sqlmodel import SQLModel, create_engine, Session
-from config import DB_CONFIG
+from metrics import instrument_engine
+from config import (
+    DB_CONFIG, DB_ASYNC_CONFIG, DB_ASYNC, DB_ECHO,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING,
+)
 
-engine = create_engine(DB_CONFIG, echo=True)
+def engine_options(url: str) -> dict:
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+    if url.startswith("sqlite"):
+        # SQLite (used as a local stand-in) is shared across the threadpool and has no tunable pool
+        options["connect_args"] = {"check_same_thread": False}
+        return options
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+engine = create_engine(DB_CONFIG, **engine_options(DB_CONFIG))
+instrument_engine(engine)
+
+# Optional asyncio engine (aiomysql/aiosqlite), only created when DB_ASYNC is enabled.
+# Imported lazily because sqlalchemy.ext.asyncio requires greenlet.
+async_engine = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    async_engine = create_async_engine(DB_ASYNC_CONFIG, **engine_options(DB_ASYNC_CONFIG))
+    instrument_engine(async_engine.sync_engine)
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+async def get_async_session():
+    if async_engine is None:
+        raise RuntimeError("Async database mode is disabled, set DB_ASYNC=true")
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
@@ -0,0 +1,100 @@
+"""Gunicorn settings for running the API on several uvicorn worker processes.
+
+Run from the app directory:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+With INFERENCE_MODE=remote the master starts one inference server per socket
+in INFERENCE_SOCKETS before forking workers (sockets something else already
+serves, e.g. a systemd unit, are left alone), so the model is loaded once
+instead of once per worker. The master also creates the database and task
+queue tables, workers creating them on a fresh database race each other.
+GUNICORN_PRELOAD=true imports the app in the master so workers share its code
+pages, nothing in it starts threads or opens connections at import time.
+
+WEB_CONCURRENCY defaults to one worker, some state still lives in the process
+that created it and is not seen by the others:
+
+- voice transcription jobs, /voice/jobs/{id} answers 404 from another worker
+- the product search index: writes, imports indexed by the worker that ran
+  the task, and SEARCH_INDEX_PATH, which every worker overwrites at shutdown
+- product responses with RESPONSE_CACHE_BACKEND=memory, an invalidation only
+  clears the worker that handled the write (use redis with several workers)
+
+These are per worker caches or limits, correct with several workers but each
+worker keeps its own: signed-in principals (AUTH_CACHE_TTL bounds staleness),
+disease predictions, chat replies and per-user chat slots, OTP rate limit
+buckets (a client gets up to WEB_CONCURRENCY times the budget), and /metrics.
+"""
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from config import INFERENCE_MODE, INFERENCE_SOCKETS
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+logger = logging.getLogger("gunicorn.error")
+inference_servers = []
+
+
+def _listening(path: str) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def _create_tables():
+    from config import TASK_QUEUE_URL
+    from database import create_db_and_tables, engine
+    from services.task_queue import TaskStore, create_queue_engine
+
+    create_db_and_tables()
+    queue_engine = create_queue_engine(TASK_QUEUE_URL)
+    TaskStore(queue_engine).create()
+    # No pooled connections may be inherited by the forked workers
+    queue_engine.dispose()
+    engine.dispose()
+
+
+def on_starting(server):
+    if server.cfg.workers > 1:
+        logger.warning("Running %d workers: voice jobs and search index updates are only seen by the worker "
+                       "that made them, see gunicorn.conf.py", server.cfg.workers)
+    _create_tables()
+    if INFERENCE_MODE != "remote":
+        return
+    for path in INFERENCE_SOCKETS:
+        if not _listening(path):
+            logger.info("Starting inference server on %s", path)
+            inference_servers.append(subprocess.Popen([sys.executable, "-m", "services.inference_server", "--socket", path]))
+    # The socket appears once the model is loaded
+    deadline = time.monotonic() + int(os.getenv("INFERENCE_START_TIMEOUT", 300))
+    while not all(_listening(path) for path in INFERENCE_SOCKETS):
+        if any(proc.poll() is not None for proc in inference_servers):
+            raise RuntimeError("An inference server exited during startup")
+        if time.monotonic() > deadline:
+            raise RuntimeError("Inference servers did not start in time")
+        time.sleep(0.2)
+
+
+def on_exit(server):
+    for proc in inference_servers:
+        proc.terminate()
+    for proc in inference_servers:
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
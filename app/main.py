@@ -1,30 +1,118 @@
-import random
+import asyncio
+import json
+import logging
+import threading
+from pathlib import Path
 from datetime import datetime, timedelta, timezone
-from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status, UploadFile, File
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
 from sqlmodel import Session, select
-from database import create_db_and_tables, get_session
-from models import Farmer, VerifyOtp, Products, Users
-from schemas import FarmerLogin, FarmerRegister, OTPVerifySchema, ProductCreate, ProductUpdate, UserLogin, UserRegister
-from utils import create_access_token, verify_access_token, get_current_farmer_id
-from typing import List
-
-from gtts import gTTS
-
-from services import voice_to_text_converter
-from services.diseases_detection import predict_image_class
-from services.chatbot import chat_with_openai
-from pydantic import BaseModel
-
-from uploader import ImageUploader, AudioUploader
-from config import PRODUCTS_DIR, USERS_DIR, VOICES_DIR, BASE_UPLOAD_DIR
-
-product_image_uploader = ImageUploader(PRODUCTS_DIR)
-user_image_uploader = ImageUploader(USERS_DIR)
-voice_uploader = AudioUploader(VOICES_DIR)
+from responses import CompressionMiddleware, FastJSONResponse, json_response
+from metrics import MetricsMiddleware, SlowRequestProfiler, render as render_metrics
+from database import create_db_and_tables, get_session, engine
+from models import Farmer, Products, Users
+from schemas import FarmerLogin, FarmerRegister, OTPVerifySchema, ProductCreate, ProductUpdate, UserLogin, UserRegister, ProductPage, ProductSearchResults, ProfileUpdate
+from schemas import NearbyFarmers, NearbyProducts, CategoryStats, FarmerDashboard
+from utils import create_access_token, verify_access_token, etag_matches
+from utils import Principal, principals, get_current_farmer, get_current_farmer_id, get_current_user
+from typing import List, Literal, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+from services import transcription_jobs
+from services.diseases_detection import predict_image_bytes, batcher as inference_batcher, runtime as model_runtime, prediction_cache
+from services.inference_client import InferenceUnavailable
+from services.chatbot import GatewayBusy, gateway as chat_gateway
+from services.otp import OtpError, OtpService, TokenBuckets, create_store as create_otp_store
+from services.sms import SmsGateway, SmsQueueFull, create_backend as create_sms_backend
+from services.market_prices import PriceIngestor, ROLLING_WINDOWS
+from services.tts import COMMON_PHRASES, SpeechCache, TextToSpeechService, create_backend as create_tts_backend
+from services.product_listing import list_products, SUMMARY_COLUMNS
+from services.task_queue import PermanentError, TaskQueue, TaskStore, create_queue_engine
+from services.response_cache import ResponseCache, body_etag, cache_key, version_etag, create_backend as create_response_cache_backend
+from services.product_bulk import MEDIA_TYPES as BULK_MEDIA_TYPES, detect_format, export_products, import_products, imported_rows
+from services.product_search import ProductSearchIndex, SearchIndexSaver
+from services.product_rollups import RollupReconciler, category_stats, listings_per_day
+from services.geo import gazetteer, location_values, nearest, place_values, sync_farmer_products
+from services.image_derivatives import DerivativeGenerator, VARIANTS, FORMATS, IMAGE_ID, negotiate_format
+from services.storage import BLOB_ID, BlobCollector, create_store as create_blob_store
+from pydantic import BaseModel, Field
+
+from uploader import ImageUploader, AudioUploader, read_upload, too_large
+from config import DERIVATIVES_DIR, MODEL_WARMUP, IMAGE_DERIVATIVE_WORKERS, SEARCH_INDEX_PATH, STORAGE_GC_INTERVAL
+from config import SEARCH_INDEX_SAVE_INTERVAL
+from config import (
+    TASK_QUEUE_URL, TASK_ASYNC_WORKERS, TASK_THREAD_WORKERS, TASK_MAX_ATTEMPTS, TASK_RETRY_BACKOFF, TASK_LEASE,
+    TASK_POLL_INTERVAL, TASK_RETENTION,
+)
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, GZIP_LEVEL, BROTLI_QUALITY
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE
+from config import PRODUCT_IMPORT_CHUNK_SIZE, PRODUCT_IMPORT_MAX_ROWS, UPLOAD_MAX_REQUEST_SIZE, NEARBY_MAX_RADIUS_KM
+from config import INFERENCE_MODE
+from config import ROLLUP_RECONCILE_INTERVAL, DASHBOARD_MAX_DAYS
+from config import (
+    DEBUG, LOG_LEVEL, PROFILE_SLOW_REQUESTS, PROFILE_SLOW_MS, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_HEADER_SECRET,
+    PROFILE_MAX_FILES,
+)
+from config import SPARROW_API, SPARROW_TOKEN, SMS_BACKEND, SMS_SENDERS, SMS_MAX_QUEUE, SMS_MAX_RETRIES
+from config import (
+    OTP_STORE, OTP_TTL, OTP_MAX_ATTEMPTS, OTP_LOCKOUT, OTP_PHONE_BURST, OTP_PHONE_REFILL, OTP_IP_BURST, OTP_IP_REFILL,
+    OTP_SWEEP_INTERVAL, OTP_EXPOSE_CODE,
+)
+from config import PRICE_INGEST_ENABLED, PRICE_INGEST_INTERVAL, PRICE_HISTORY_DAYS
+from config import TTS_BACKEND, TTS_LANGUAGE, TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_WORKERS, TTS_MAX_CHARS, TTS_PREGENERATE
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+blob_store = create_blob_store(engine)
+blob_collector = BlobCollector(blob_store, STORAGE_GC_INTERVAL)
+product_image_uploader = ImageUploader(blob_store, "product")
+user_image_uploader = ImageUploader(blob_store, "user")
+voice_uploader = AudioUploader(blob_store, "voice")
+product_image_derivatives = DerivativeGenerator(DERIVATIVES_DIR, workers=IMAGE_DERIVATIVE_WORKERS)
+blob_store.on_delete.append(product_image_derivatives.remove)
+search_index = ProductSearchIndex(SEARCH_INDEX_PATH)
+response_cache = ResponseCache(create_response_cache_backend(
+    RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_URL,
+))
+task_queue = TaskQueue(
+    TaskStore(create_queue_engine(TASK_QUEUE_URL)),
+    async_workers=TASK_ASYNC_WORKERS,
+    thread_workers=TASK_THREAD_WORKERS,
+    max_attempts=TASK_MAX_ATTEMPTS,
+    retry_backoff=TASK_RETRY_BACKOFF,
+    lease=TASK_LEASE,
+    poll_interval=TASK_POLL_INTERVAL,
+    retention=TASK_RETENTION,
+)
+price_ingestor = PriceIngestor(engine, PRICE_INGEST_INTERVAL, PRICE_HISTORY_DAYS)
+rollup_reconciler = RollupReconciler(engine, ROLLUP_RECONCILE_INTERVAL)
+otp_service = OtpService(
+    create_otp_store(OTP_STORE, engine),
+    SmsGateway(
+        create_sms_backend(SMS_BACKEND, api_url=SPARROW_API, token=SPARROW_TOKEN),
+        senders=SMS_SENDERS,
+        max_queue=SMS_MAX_QUEUE,
+        retries=SMS_MAX_RETRIES,
+    ),
+    phone_limiter=TokenBuckets(OTP_PHONE_BURST, OTP_PHONE_REFILL),
+    ip_limiter=TokenBuckets(OTP_IP_BURST, OTP_IP_REFILL),
+    code_ttl=OTP_TTL,
+    max_attempts=OTP_MAX_ATTEMPTS,
+    lockout=OTP_LOCKOUT,
+    sweep_interval=OTP_SWEEP_INTERVAL,
+)
+tts_service = TextToSpeechService(
+    create_tts_backend(TTS_BACKEND),
+    SpeechCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES),
+    workers=TTS_WORKERS,
+)
 
-app = FastAPI(debug=True)
+app = FastAPI(debug=DEBUG, default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,10 +122,178 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        gzip_level=GZIP_LEVEL,
+        brotli_quality=BROTLI_QUALITY,
+    )
+
+# Outermost, so latency includes every other middleware
+app.add_middleware(
+    MetricsMiddleware,
+    profiler=SlowRequestProfiler(
+        PROFILE_DIR, PROFILE_SLOW_MS, PROFILE_SAMPLE_RATE, header_secret=PROFILE_HEADER_SECRET, max_files=PROFILE_MAX_FILES,
+    ) if PROFILE_SLOW_REQUESTS else None,
+)
+
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
 
+@app.on_event("startup")
+async def start_task_queue():
+    await task_queue.start()
+
+# Before the services its handlers use are shut down
+@app.on_event("shutdown")
+async def stop_task_queue():
+    await task_queue.stop()
+
+@app.on_event("startup")
+async def start_inference_batcher():
+    await inference_batcher.start()
+    # In remote mode the inference server owns the model
+    if MODEL_WARMUP == "background" and INFERENCE_MODE == "local":
+        model_runtime.warm_up_in_background()
+
+@app.on_event("shutdown")
+async def stop_inference_batcher():
+    await inference_batcher.stop()
+
+@app.on_event("startup")
+async def start_transcription_jobs():
+    await transcription_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_transcription_jobs():
+    await transcription_jobs.stop()
+
+@app.on_event("startup")
+async def start_otp_service():
+    await otp_service.sms.start()
+    otp_service.start()
+
+@app.on_event("shutdown")
+async def stop_otp_service():
+    await otp_service.stop()
+    await otp_service.sms.stop()
+
+@app.on_event("startup")
+async def pregenerate_common_speech():
+    if TTS_PREGENERATE:
+        app.state.tts_pregenerate = asyncio.create_task(tts_service.pregenerate(COMMON_PHRASES, TTS_LANGUAGE))
+
+@app.on_event("shutdown")
+def stop_tts_service():
+    tts_service.shutdown()
+
+@app.on_event("startup")
+async def start_price_ingestor():
+    await price_ingestor.refresh_snapshot()
+    if PRICE_INGEST_ENABLED:
+        price_ingestor.start()
+
+@app.on_event("shutdown")
+async def stop_price_ingestor():
+    await price_ingestor.stop()
+
+@app.on_event("startup")
+def start_rollup_reconciler():
+    rollup_reconciler.start()
+
+@app.on_event("shutdown")
+async def stop_rollup_reconciler():
+    await rollup_reconciler.stop()
+
+@app.on_event("startup")
+def start_blob_collector():
+    blob_collector.start()
+
+@app.on_event("shutdown")
+async def stop_blob_collector():
+    await blob_collector.stop()
+
+@app.on_event("shutdown")
+def stop_image_derivatives():
+    product_image_derivatives.shutdown()
+
+# Products written up to this long before the saved watermark are re-indexed too, covering
+# clock skew between workers and rows committed a little after their timestamp was taken
+SEARCH_INDEX_CATCH_UP_MARGIN = timedelta(minutes=5)
+SEARCH_INDEX_COLUMNS = (Products.id, Products.title, Products.description, Products.category)
+
+def search_index_watermark() -> Optional[str]:
+    """The newest product change in the database, saved with the index."""
+    with Session(engine) as session:
+        newest = session.exec(select(func.max(func.coalesce(Products.updated_at, Products.created_at)))).one()
+    return newest.isoformat() if newest else None
+
+def rebuild_search_index():
+    watermark = search_index_watermark()
+    with Session(engine) as session:
+        rows = session.exec(select(*SEARCH_INDEX_COLUMNS).execution_options(yield_per=5000))
+        search_index.rebuild(rows, watermark)
+
+def catch_up_search_index():
+    """Re-indexes what changed since the saved index was written, e.g. before a crash lost the delta."""
+    since = datetime.fromisoformat(search_index.watermark) - SEARCH_INDEX_CATCH_UP_MARGIN
+    watermark = search_index_watermark()
+    # Read before the live ids, so a product created in between is not taken for a deleted one
+    indexed = search_index.doc_ids()
+    with Session(engine) as session:
+        changed = session.exec(
+            select(*SEARCH_INDEX_COLUMNS)
+            .where(func.coalesce(Products.updated_at, Products.created_at) >= since)
+            .execution_options(yield_per=5000)
+        )
+        for doc_id, title, description, category in changed:
+            search_index.add(doc_id, title, description, category)
+        live = set(session.exec(select(Products.id)))
+    for doc_id in indexed - live:
+        search_index.remove(doc_id)
+    if search_index.dirty:
+        search_index.save(watermark=watermark)
+
+search_index_saver = SearchIndexSaver(search_index, search_index_watermark, SEARCH_INDEX_SAVE_INTERVAL)
+
+# Background tasks, the payloads are stored as JSON so they only carry ids and paths
+@task_queue.task("images.derivatives")
+async def generate_image_derivatives(image_id: str = None, path: str = None):
+    # Tasks queued before uploads moved to the blob store carry the file's path
+    source = Path(path) if path else await run_in_threadpool(blob_store.local_file, image_id)
+    try:
+        await asyncio.wrap_future(product_image_derivatives.submit(source))
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Stored before uploads were verified, decoding it again will not go any better
+        raise PermanentError(f"Cannot decode image: {e}") from e
+
+@task_queue.task("products.index_import", kind="thread")
+def index_imported_products(import_id: str):
+    for row in imported_rows(engine, import_id):
+        search_index.add(row.id, row.title, row.description, row.category)
+
+@task_queue.task("geo.sync_farmer_products", kind="thread")
+def move_farmer_products(farmer_id: int, latitude: Optional[float], longitude: Optional[float]):
+    for product_id in sync_farmer_products(engine, farmer_id, latitude, longitude):
+        response_cache.invalidate(cache_key("product", id=product_id))
+
+@app.on_event("startup")
+def load_search_index():
+    # The first start indexes the whole catalogue in the background, later starts mmap the saved
+    # index and re-index only the products that changed after it was saved
+    if search_index.watermark is None:
+        threading.Thread(target=rebuild_search_index, name="search-index", daemon=True).start()
+    else:
+        threading.Thread(target=catch_up_search_index, name="search-index", daemon=True).start()
+    search_index_saver.start()
+
+@app.on_event("shutdown")
+async def save_search_index():
+    await search_index_saver.stop()
+    await run_in_threadpool(search_index_saver.save_now)
+
 @app.post("/farmer/login")
 def farmer_login(login_data: FarmerLogin, session: Session = Depends(get_session)):
     farmer = session.exec(select(Farmer).where(Farmer.phone == login_data.phone)).first()
@@ -52,48 +308,45 @@ def register_farmer(data: FarmerRegister, session: Session = Depends(get_session
     existing_farmer = session.exec(select(Farmer).where(Farmer.phone == data.phone)).first()
     if existing_farmer:
         raise HTTPException(status_code=400, detail="Phone number already registered")
-    new_farmer = Farmer(phone=data.phone, name=data.name, location=data.location)
+    new_farmer = Farmer(phone=data.phone, name=data.name, location=data.location, **place_values(data.location))
     session.add(new_farmer)
     session.commit()
     session.refresh(new_farmer)
     return {"message": "Farmer registered successfully", "farmer_id": new_farmer.id}
 
-@app.post("/farmer/request-otp")
-async def request_otp(phone: str, session: Session = Depends(get_session)):
-    otp = str(random.randint(100000, 999999))
-    otp_expiry = datetime.now(timezone.utc) + timedelta(minutes=5)
-    farmer = session.exec(select(Farmer).where(Farmer.phone == phone)).first()
-    if not farmer:
-        farmer = Farmer(phone=phone, verified=False)
-        session.add(farmer)
-        session.commit()
-    otp_entry = session.exec(select(VerifyOtp).where(VerifyOtp.phone == phone)).first()
-    if otp_entry:
-        otp_entry.otp_code = otp
-        otp_entry.otp_expires_at = otp_expiry
-    else:
-        otp_entry = VerifyOtp(phone=phone, otp_code=otp, otp_expires_at=otp_expiry)
-        session.add(otp_entry)
-
-    # await send_otp_to_sparrow(farmer.phone, otp)
-
-    session.commit()
-    return {"message": "OTP sent successfully", "otp": otp}
+def otp_http_error(e: OtpError) -> HTTPException:
+    headers = {"Retry-After": str(int(e.retry_after) + 1)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
 
+# Throttled before the store or the SMS gateway is touched, the SMS is sent in the background
+@app.post("/farmer/request-otp")
+async def request_otp(phone: str, request: Request):
+    try:
+        otp = await otp_service.request_code(phone, request.client.host if request.client else "unknown")
+    except OtpError as e:
+        raise otp_http_error(e)
+    except SmsQueueFull:
+        raise HTTPException(status_code=503, detail="SMS service is busy, try again shortly", headers={"Retry-After": "30"})
+    if OTP_EXPOSE_CODE:
+        return {"message": "OTP sent successfully", "otp": otp}
+    return {"message": "OTP sent successfully"}
+
+# Handlers that use the blocking Session are plain `def` so FastAPI runs them in its threadpool
 @app.post("/farmer/verify-otp")
-def verify_otp(data: OTPVerifySchema, session: Session = Depends(get_session)):
+def verify_otp(data: OTPVerifySchema, request: Request, session: Session = Depends(get_session)):
+    try:
+        otp_service.throttle_verify(request.client.host if request.client else "unknown")
+        otp_service.verify(data.phone, data.otp_code)
+    except OtpError as e:
+        raise otp_http_error(e)
     farmer = session.exec(select(Farmer).where(Farmer.phone == data.phone)).first()
     if not farmer:
         raise HTTPException(status_code=404, detail="Farmer not found")
-    otp_entry = session.exec(select(VerifyOtp).where((VerifyOtp.otp_code == data.otp_code) & (VerifyOtp.phone == data.phone))).first()
-    if not otp_entry:
-        raise HTTPException(status_code=400, detail="Invalid OTP")
-    if datetime.now(timezone.utc) > otp_entry.otp_expires_at.replace(tzinfo=timezone.utc):
-        raise HTTPException(status_code=400, detail="OTP expired")
     farmer.verified = True
-    session.delete(otp_entry)
+    session.add(farmer)
     session.commit()
-    access_token = create_access_token(farmer.id, farmer.phone)
+    principals.invalidate("farmer", farmer.phone)
+    access_token = create_access_token(farmer.id, farmer.phone, role="farmer")
 
     response = JSONResponse({"message": "OTP verified successfully, farmer is now verified"})
     response.set_cookie(
@@ -106,56 +359,214 @@ def verify_otp(data: OTPVerifySchema, session: Session = Depends(get_session)):
 
     return response
 
+# Served from the principal cache, repeat calls within AUTH_CACHE_TTL skip the database
 @app.get("/farmer/me")
-def get_current_farmer(request: Request, session: Session = Depends(get_session)):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Access token missing")
-
-    phone = verify_access_token(token)
-    farmer = session.exec(select(Farmer).where(Farmer.phone == phone)).first()
+async def read_current_farmer(request: Request, farmer: Principal = Depends(get_current_farmer)):
+    body = json.dumps(farmer.to_dict()).encode()
+    return response_cache.conditional(request, body, body_etag(body), "private, no-cache")
+
+@app.put("/farmer/me")
+def update_current_farmer(
+    data: ProfileUpdate,
+    farmer_id: int = Depends(get_current_farmer_id),
+    session: Session = Depends(get_session)
+):
+    farmer = session.get(Farmer, farmer_id)
     if not farmer:
         raise HTTPException(status_code=404, detail="Farmer not found")
+    changes = data.model_dump(exclude_unset=True)
+    if "location" in changes and changes["location"] != farmer.location:
+        changes.update(place_values(changes["location"]))
+    for key, value in changes.items():
+        setattr(farmer, key, value)
+    session.add(farmer)
+    session.commit()
+    principals.invalidate("farmer", farmer.phone)
+    if "latitude" in changes:
+        # Products carry the farmer's coordinates, a farmer with many listings is moved in the background
+        task_queue.enqueue_sync("geo.sync_farmer_products", {
+            "farmer_id": farmer.id, "latitude": farmer.latitude, "longitude": farmer.longitude,
+        })
+    return {"id": farmer.id, "phone": farmer.phone, "name": farmer.name, "location": farmer.location, "verified": farmer.verified}
+
+# Read from the product rollups, no aggregation over the farmer's products
+@app.get("/farmer/dashboard", response_model=FarmerDashboard)
+def farmer_dashboard(
+    days: int = Query(30, ge=1, le=DASHBOARD_MAX_DAYS),
+    farmer_id: int = Depends(get_current_farmer_id),
+    session: Session = Depends(get_session)
+):
+    connection = session.connection()
+    dashboard = category_stats(connection, farmer_id)
+    dashboard["listings_per_day"] = listings_per_day(connection, farmer_id, days)
+    return json_response(dashboard)
 
-    return {
-        "id": farmer.id,
-        "phone": farmer.phone,
-        "name": farmer.name,
-        "location": farmer.location,
-        "verified": farmer.verified
-    }
+@app.get("/farmer/otp/stats")
+async def otp_stats():
+    return otp_service.stats()
 
 @app.post("/products", status_code=status.HTTP_201_CREATED)
 def create_product(
-    request: Request,
     product: ProductCreate,
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_session),
+    farmer: Principal = Depends(get_current_farmer)
 ):
-    token = request.cookies.get("access_token")
-    farmer = session.exec(select(Farmer).where(Farmer.phone == token)).first()
-    if not farmer:
-        raise HTTPException(status_code=404, detail="Farmer not found")
-
     new_product = Products(
         title=product.title,
         description=product.description,
         price=product.price,
-        images=product.image,
-        farmer_id=farmer.id
+        category=product.category,
+        image=product.image,
+        farmer_id=farmer.id,
+        **location_values(farmer.latitude, farmer.longitude)
     )
 
     session.add(new_product)
     session.commit()
     session.refresh(new_product)
+    search_index.add(new_product.id, new_product.title, new_product.description, new_product.category)
 
     return new_product
 
+# CSV or NDJSON with ProductCreate columns, parsed as a stream and inserted in chunks
+@app.post("/products/import")
+def import_products_file(
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "ndjson"]] = None,
+    farmer: Principal = Depends(get_current_farmer)
+):
+    farmer_id = farmer.id
+    if file.size is not None and file.size > UPLOAD_MAX_REQUEST_SIZE:
+        raise too_large(UPLOAD_MAX_REQUEST_SIZE)
+    report = import_products(
+        engine,
+        farmer_id,
+        file.file,
+        format or detect_format(file.filename, file.content_type),
+        chunk_size=PRODUCT_IMPORT_CHUNK_SIZE,
+        max_rows=PRODUCT_IMPORT_MAX_ROWS,
+        location=location_values(farmer.latitude, farmer.longitude),
+    )
+    result = report.to_dict()
+    if report.imported:
+        # Imported products show up in search once this task has run
+        result["index_task_id"] = task_queue.enqueue_sync(
+            "products.index_import", {"import_id": report.import_id},
+        )
+    return result
+
+@app.get("/products/export")
+def export_products_file(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    farmer_id: int = Depends(get_current_farmer_id)
+):
+    return StreamingResponse(
+        export_products(engine, farmer_id, format),
+        media_type=BULK_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
+
+# Declared before /products/{product_id} so "search" is not parsed as an id
+@app.get("/products/search", response_model=ProductSearchResults)
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_session)
+):
+    ranked = search_index.search(q, limit)
+    if not ranked:
+        return json_response({"items": []})
+    # Only a primary key lookup, the text matching never reaches MySQL
+    rows = session.exec(select(*SUMMARY_COLUMNS).where(Products.id.in_([doc_id for doc_id, _ in ranked]))).all()
+    found = {row.id: dict(row._mapping) for row in rows}
+    return json_response({"items": [{**found[doc_id], "score": score} for doc_id, score in ranked if doc_id in found]})
+
+def nearby_origin(lat: Optional[float], lon: Optional[float], location: Optional[str]) -> dict:
+    if lat is not None and lon is not None:
+        return {"latitude": lat, "longitude": lon, "place": None}
+    if not location:
+        raise HTTPException(status_code=400, detail="Pass lat and lon, or a location")
+    place = gazetteer.resolve(location)
+    if place is None:
+        raise HTTPException(status_code=400, detail=f"Unknown location: {location}")
+    return {"latitude": place.latitude, "longitude": place.longitude, "place": place.name}
+
+def nearby_hits(session: Session, model, columns: list, origin: dict, k: int, radius_km: Optional[float],
+                filters: list) -> list:
+    hits = nearest(session, model, columns, origin["latitude"], origin["longitude"], k,
+                   radius_km or NEARBY_MAX_RADIUS_KM, filters)
+    return [{**{column.key: row._mapping[column.key] for column in columns}, "distance_km": round(distance, 2)}
+            for distance, row in hits]
+
+# k nearest products, or the nearest k within radius_km, from a point or a place name like "Bharatpur, Chitwan"
+@app.get("/products/nearby", response_model=NearbyProducts)
+def nearby_products(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    location: Optional[str] = Query(None, max_length=200),
+    radius_km: Optional[float] = Query(None, gt=0, le=NEARBY_MAX_RADIUS_KM),
+    k: int = Query(20, ge=1, le=100),
+    category: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    origin = nearby_origin(lat, lon, location)
+    filters = [Products.category == category] if category else []
+    items = nearby_hits(session, Products, SUMMARY_COLUMNS, origin, k, radius_km, filters)
+    return json_response({"origin": origin, "items": items})
+
+@app.get("/farmers/nearby", response_model=NearbyFarmers)
+def nearby_farmers(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    location: Optional[str] = Query(None, max_length=200),
+    radius_km: Optional[float] = Query(None, gt=0, le=NEARBY_MAX_RADIUS_KM),
+    k: int = Query(20, ge=1, le=100),
+    verified: Optional[bool] = None,
+    session: Session = Depends(get_session)
+):
+    origin = nearby_origin(lat, lon, location)
+    filters = [Farmer.verified == verified] if verified is not None else []
+    columns = [Farmer.id, Farmer.name, Farmer.location, Farmer.verified]
+    return json_response({"origin": origin, "items": nearby_hits(session, Farmer, columns, origin, k, radius_km, filters)})
+
+@app.get("/products", response_model=ProductPage)
+def browse_products(
+    category: Optional[str] = None,
+    farmer_id: Optional[int] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    sort: Literal["-created_at", "created_at", "-price", "price"] = "-created_at",
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    # The rows are selected with ProductSummary's columns, so they are sent without revalidation
+    return json_response(list_products(session, category, farmer_id, min_price, max_price, sort, limit, cursor))
+
+# Market-wide counts and prices per category, from the product rollups
+@app.get("/products/category-stats", response_model=CategoryStats)
+def market_category_stats(session: Session = Depends(get_session)):
+    return json_response(category_stats(session.connection()))
+
+@app.get("/products/category-stats/reconciliation")
+async def rollup_reconciliation_stats():
+    return rollup_reconciler.stats()
+
+@app.get("/products/cache/stats")
+async def product_cache_stats():
+    return response_cache.stats()
+
 @app.get("/products/{product_id}", response_model=Products)
-def read_product(product_id: int, session: Session = Depends(get_session)):
-    product = session.get(Products, product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+async def read_product(product_id: int, request: Request):
+    # Cached already serialized, the ETag changes with updated_at
+    def build():
+        with Session(engine) as session:
+            product = session.get(Products, product_id)
+            if not product:
+                raise HTTPException(status_code=404, detail="Product not found")
+            return product.model_dump_json().encode(), version_etag(product.id, product.updated_at or product.created_at)
+
+    return await response_cache.respond(request, cache_key("product", id=product_id), build)
 
 @app.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_product(
@@ -172,6 +583,8 @@ def delete_product(
 
     session.delete(product)
     session.commit()
+    response_cache.invalidate(cache_key("product", id=product_id))
+    search_index.remove(product_id)
 
     return {"detail": "Product deleted successfully"}
 
@@ -192,10 +605,13 @@ def update_product(
     update_data = product_update.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(product, key, value)
+    product.updated_at = datetime.now(timezone.utc)
 
     session.add(product)
     session.commit()
     session.refresh(product)
+    response_cache.invalidate(cache_key("product", id=product_id))
+    search_index.add(product.id, product.title, product.description, product.category)
 
     return product
 
@@ -203,66 +619,215 @@ def update_product(
 @app.post("/upload/product-image/")
 async def upload_product_image(file: UploadFile = File(...)):
     try:
-        file_path = await product_image_uploader.save_file(file)
-        return {"file_path": str(file_path)}
+        stored = await product_image_uploader.save_file(file)
+        # Resizing runs as a background task, the response does not wait for it. Content that
+        # was already stored already has its derivatives, or gets them on the first request
+        task_id = await task_queue.enqueue("images.derivatives", {"image_id": stored.sha256}) if stored.new else None
+        return {
+            "file_path": stored.url,
+            "file_id": stored.sha256,
+            "task_id": task_id,
+            "variants": {variant: f"/images/products/{stored.sha256}/{variant}" for variant in VARIANTS},
+        }
     except HTTPException as e:
         raise e
 
+@app.get("/images/products/{image_id}/{variant}")
+async def product_image_variant(image_id: str, variant: str, request: Request):
+    if not IMAGE_ID.match(image_id) or variant not in VARIANTS:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    fmt = negotiate_format(request.headers.get("accept"))
+    etag = product_image_derivatives.etag(image_id, variant, fmt)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = product_image_derivatives.path(image_id, variant, fmt)
+    if not path.exists():
+        if await run_in_threadpool(blob_store.get, image_id) is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        source = await run_in_threadpool(blob_store.local_file, image_id)
+        try:
+            path = await product_image_derivatives.ensure(source, variant, fmt)
+        except (UnidentifiedImageError, Image.DecompressionBombError):
+            # Stored under the id, but not in a format Pillow can decode
+            raise HTTPException(status_code=415, detail="Image format not supported")
+
+    return FileResponse(path, media_type=FORMATS[fmt][1], headers=headers)
+
 @app.post("/upload/user-images/")
 async def upload_user_images(files: List[UploadFile] = File(...)):
     try:
-        file_paths = await user_image_uploader.save_files(files)
-        return {"file_paths": [str(path) for path in file_paths]}
+        stored = await user_image_uploader.save_files(files)
+        return {"file_paths": [file.url for file in stored]}
     except HTTPException as e:
         raise e
 
+# Returns a job id right away, pass wait=true to block until the transcript is ready
 @app.post("/upload/voice")
-async def upload_voice(file: UploadFile = File(...)):
+async def upload_voice(file: UploadFile = File(...), wait: bool = False):
     try:
-        await voice_uploader.save_file(file)
-        text = await voice_to_text_converter('uploads/voices/' + file.filename)
-        print(text, "Text voice testing")
-        return {"text": text}
+        stored = await voice_uploader.save_file(file)
+        # Uploads are stored under their SHA-256, which doubles as the transcript cache key
+        file_path = await run_in_threadpool(blob_store.local_file, stored.sha256)
+        job = await transcription_jobs.submit(file_path, stored.sha256)
+        if wait:
+            await job.wait(timeout=120)
+        return job.to_dict()
     except HTTPException as e:
         raise e
 
+@app.get("/files/stats")
+async def stored_file_stats():
+    return {**await run_in_threadpool(blob_store.stats), "collector": blob_collector.stats()}
+
+# Uploaded images by content hash, the suffix is ignored. Voice notes are not served
+@app.get("/files/{name}")
+async def stored_file(name: str, request: Request):
+    sha256 = name[:64]
+    if not BLOB_ID.fullmatch(sha256):
+        raise HTTPException(status_code=404, detail="File not found")
+    blob = await run_in_threadpool(blob_store.get, sha256)
+    if blob is None or blob.kind == "voice":
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "ETag": f'"{sha256}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        # Served with the uploader's content type, which must not be able to run script on this origin
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "default-src 'none'; sandbox",
+    }
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return blob_store.response(blob, headers)
+
+@app.get("/voice/jobs/{job_id}")
+async def voice_job_status(job_id: str):
+    job = transcription_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/voice/jobs/{job_id}/stream")
+async def voice_job_stream(job_id: str):
+    job = transcription_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # Server-sent events, one per status change until the job finishes
+    async def events():
+        yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+        while not job.finished:
+            if await job.wait_for_change(timeout=15):
+                yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/voice/stats")
+async def voice_stats():
+    return transcription_jobs.stats()
+
 # class DiseasesDetection(BaseModel):
 #     file: UploadFile = File(...)
 class TextToSpeech(BaseModel):
-    text: str
+    text: str = Field(..., min_length=1, max_length=TTS_MAX_CHARS)
+    lang: str = TTS_LANGUAGE
+    voice: Optional[str] = None
 
-@app.post("/text-to-speech", response_class=FileResponse)
+@app.post("/text-to-speech", response_class=StreamingResponse)
 async def text_to_speech(req: TextToSpeech):
-    language = 'hi'
-    tts = gTTS(text=req.text, lang=language, slow=False)
-    out_path = BASE_UPLOAD_DIR.cwd() / "response.mp3"
-    tts.save(str(out_path))
-
-    return FileResponse(
-        str(out_path),
-        media_type="audio/mpeg",   
-        filename="audio.mp3"  
+    # Audio is streamed as it is synthesized, cached repeats are served from disk
+    return StreamingResponse(
+        tts_service.stream(req.text, req.lang, req.voice),
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": 'attachment; filename="audio.mp3"'},
     )
-    
+
+@app.get("/text-to-speech/stats")
+async def text_to_speech_stats():
+    return {"backend": tts_service.backend.name, "cache": tts_service.cache.stats()}
+
 @app.post("/diseases-detect")
 async def diseases_detection(file: UploadFile=File(...) ):
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid image file type.")
     try:
-        image_path = await product_image_uploader.save_file(file)
-        prediction = predict_image_class(image_path)
-        print(prediction, "Text voice testing")
-        return {"prediction": prediction}
-    except HTTPException as e:
-        raise e
+        # Decoded straight from the upload, the image never touches the disk
+        prediction = await predict_image_bytes(await read_upload(file))
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Could not decode image.")
+    except InferenceUnavailable as e:
+        logger.warning("%s", e)
+        raise HTTPException(status_code=503, detail="Disease detection is unavailable, try again shortly",
+                            headers={"Retry-After": "5"})
+    logger.debug("Predicted %s", prediction["prediction"])
+    return prediction
+
+@app.get("/diseases-detect/stats")
+async def diseases_detection_stats():
+    return {
+        **inference_batcher.stats_snapshot(),
+        "inference_mode": INFERENCE_MODE,
+        "model_backend": model_runtime.backend_name,
+        "model_loaded": model_runtime.loaded,
+        "cache": prediction_cache.stats(),
+    }
 
 
 class Chat(BaseModel):
     message: str
 
+# Concurrency limits are per signed-in phone number, or per client address otherwise
+def chat_user(request: Request) -> str:
+    token = request.cookies.get("access_token")
+    if token:
+        try:
+            return verify_access_token(token)
+        except HTTPException:
+            pass
+    return request.client.host if request.client else "anonymous"
+
 @app.post("/chat")
-async def ai_chat(message: Chat):
-    res = await chat_with_openai(message)
+async def ai_chat(message: Chat, request: Request):
+    try:
+        res = await chat_gateway.complete(message.message, chat_user(request))
+    except GatewayBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Chat response timed out")
     return {"text": res}
 
+@app.post("/chat/stream")
+async def ai_chat_stream(message: Chat, request: Request):
+    stream = chat_gateway.stream(message.message, chat_user(request))
+
+    # Server-sent events: one "token" event per delta, then "done" (or "error")
+    async def events():
+        try:
+            async for delta in stream:
+                yield f"event: token\ndata: {json.dumps({'text': delta}, ensure_ascii=False)}\n\n"
+        except GatewayBusy as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e), 'status': 429})}\n\n"
+            return
+        except asyncio.TimeoutError:
+            yield f"event: error\ndata: {json.dumps({'detail': 'Chat response timed out', 'status': 504})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/chat/stats")
+async def ai_chat_stats():
+    return chat_gateway.stats()
+
 # User Routes
 @app.post("/user/login")
 def user_login(login_data: UserLogin, session: Session = Depends(get_session)):
@@ -278,31 +843,109 @@ def register_user(data: UserRegister, session: Session = Depends(get_session)):
     existing_user = session.exec(select(Users).where(Users.phone == data.phone)).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Phone number already registered")
-    new_user = Users(phone=data.phone, name=data.name, location=data.location)
+    place = gazetteer.resolve(data.location)
+    new_user = Users(phone=data.phone, name=data.name, location=data.location,
+                     latitude=place.latitude if place else None, longitude=place.longitude if place else None)
     session.add(new_user)
     session.commit()
     session.refresh(new_user)
     return {"message": "User registered successfully", "user_id": new_user.id}
 
 @app.get("/user/me")
-def get_current_user(request: Request, session: Session = Depends(get_session)):
-    token = request.cookies.get("access_token")
-    if not token:
-        raise HTTPException(status_code=401, detail="Access token missing")
-
-    phone = verify_access_token(token)
-    user = session.exec(select(Users).where(user.phone == phone)).first()
-    if not user:
+async def read_current_user(request: Request, user: Principal = Depends(get_current_user)):
+    body = json.dumps(user.to_dict()).encode()
+    return response_cache.conditional(request, body, body_etag(body), "private, no-cache")
+
+@app.put("/user/me")
+def update_current_user(
+    data: ProfileUpdate,
+    user: Principal = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    account = session.get(Users, user.id)
+    if not account:
         raise HTTPException(status_code=404, detail="User not found")
+    changes = data.model_dump(exclude_unset=True)
+    if "location" in changes:
+        place = gazetteer.resolve(changes["location"])
+        changes["latitude"], changes["longitude"] = (place.latitude, place.longitude) if place else (None, None)
+    for key, value in changes.items():
+        setattr(account, key, value)
+    session.add(account)
+    session.commit()
+    principals.invalidate("user", account.phone)
+    return {"id": account.id, "phone": account.phone, "name": account.name, "location": account.location, "verified": account.verified}
 
+# Market prices, served from the in-memory snapshot refreshed after each ingest
+@app.get("/prices/latest")
+async def latest_prices():
+    snapshot = price_ingestor.snapshot
     return {
-        "id": user.id,
-        "phone": user.phone,
-        "name": user.name,
-        "location": user.location,
-        "verified": user.verified
+        "date": snapshot.latest_date,
+        "refreshed_at": snapshot.refreshed_at,
+        "items": [{"commodity": commodity, **entry} for (commodity, _), entry in snapshot.latest.items()],
     }
 
+@app.get("/prices/rolling-averages")
+async def rolling_price_averages(window: int = 7):
+    if window not in ROLLING_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of {list(ROLLING_WINDOWS)}")
+    snapshot = price_ingestor.snapshot
+    return {
+        "window_days": window,
+        "refreshed_at": snapshot.refreshed_at,
+        "items": [
+            {"commodity": commodity, "unit": unit, "avg_price": avg}
+            for (commodity, unit), avg in snapshot.rolling[window].items()
+        ],
+    }
+
+@app.get("/prices/{commodity}/history")
+async def commodity_price_history(commodity: str, unit: Optional[str] = None,
+                                  days: int = Query(30, ge=1, le=PRICE_HISTORY_DAYS)):
+    snapshot = price_ingestor.snapshot
+    units = [unit] if unit else snapshot.units(commodity)
+    keys = [(commodity, name) for name in units if (commodity, name) in snapshot.history]
+    if not keys:
+        raise HTTPException(status_code=404, detail="Commodity not found")
+    # One series per unit, prices per kg and per piece are not comparable
+    series = []
+    for key in keys:
+        entries = snapshot.history[key]
+        since = entries[-1]["date"] - timedelta(days=days - 1)
+        series.append({
+            "unit": key[1],
+            "history": [entry for entry in entries if entry["date"] >= since],
+            "rolling_averages": {f"{window}d": snapshot.rolling[window][key] for window in ROLLING_WINDOWS},
+        })
+    return {"commodity": commodity, "series": series}
+
+@app.get("/ingest/prices/status")
+async def price_ingest_status():
+    return {
+        "enabled": PRICE_INGEST_ENABLED,
+        "last_run": price_ingestor.last_run,
+        "last_status": price_ingestor.last_status,
+        "commodities": len({commodity for commodity, _ in price_ingestor.snapshot.latest}),
+    }
+
+# Status of background tasks, payloads are not returned
+@app.get("/tasks/stats")
+async def task_stats():
+    return await task_queue.stats()
+
+@app.get("/tasks/{task_id}")
+async def task_status(task_id: int):
+    task = await run_in_threadpool(task_queue.get, task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+# Prometheus scrape target
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 async def home():
     return {"message": "Welcome to KethAI!"}
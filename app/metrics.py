@@ -0,0 +1,304 @@
+import hmac
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Metric:
+    """A labelled metric family, rendered in the Prometheus text format.
+
+    Series are keyed by the tuple of label values, so recording a sample only
+    touches a dict entry and a few numbers under the metric's lock.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _format_labels(self, values, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = list(self._series.items())
+        for values, value in series:
+            lines.extend(self._render_series(values, value))
+        return lines
+
+    def _render_series(self, values, value) -> list:
+        return [f"{self.name}{self._format_labels(values)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *values):
+        with self._lock:
+            self._series[values] = self._series.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, *values):
+        with self._lock:
+            self._series[values] = self._series.get(values, 0) + amount
+
+    def dec(self, amount: float = 1, *values):
+        self.inc(-amount, *values)
+
+    def set(self, value: float, *values):
+        with self._lock:
+            self._series[values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *values):
+        # Per-bucket (not cumulative) counts, then the sum and the total count
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *values)
+
+    def _render_series(self, values, series) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), series):
+            cumulative += count
+            le = f'le="{format_value(bound) if bound != "+Inf" else bound}"'
+            lines.append(f"{self.name}_bucket{self._format_labels(values, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._format_labels(values)} {format_value(series[-2])}")
+        lines.append(f"{self.name}_count{self._format_labels(values)} {series[-1]}")
+        return lines
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = []
+
+http_request_duration = Histogram(
+    "khetai_http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge("khetai_http_requests_in_flight", "Requests currently being served.")
+db_queries = Counter("khetai_db_queries_total", "SQL statements executed.")
+db_query_duration = Histogram("khetai_db_query_duration_seconds", "Time spent executing single SQL statements.")
+db_queries_per_request = Histogram(
+    "khetai_db_queries_per_request", "SQL statements executed per request.", ("route",), buckets=COUNT_BUCKETS,
+)
+db_time_per_request = Histogram(
+    "khetai_db_time_per_request_seconds", "Time spent in SQL per request.", ("route",),
+)
+model_inference_duration = Histogram(
+    "khetai_model_inference_seconds", "Time spent in one model forward pass.", ("backend",),
+)
+model_batch_size = Histogram(
+    "khetai_model_batch_size", "Images per model forward pass.", buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+upload_bytes = Counter("khetai_upload_bytes_total", "Bytes received in file uploads.", ("kind",))
+blob_uploads = Counter(
+    "khetai_blob_uploads_total", "Uploaded files by kind, outcome is stored or deduplicated.", ("kind", "outcome"),
+)
+external_call_duration = Histogram(
+    "khetai_external_call_seconds", "Duration of calls to speech, transcription and LLM providers.",
+    ("service", "backend", "outcome"),
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def time_external_call(service: str, backend: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        external_call_duration.observe(time.perf_counter() - started, service, backend, outcome)
+
+
+# [query count, query seconds] of the request being served. Threadpool handlers run in a
+# copy of the request context, so they update the same list.
+_request_db = ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_queries.inc()
+        db_query_duration.observe(elapsed)
+        request_db = _request_db.get()
+        if request_db is not None:
+            request_db[0] += 1
+            request_db[1] += elapsed
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of a fraction of requests with pyinstrument.
+
+    Requests slower than `threshold_ms` are written to `output_dir` as
+    speedscope JSON, which opens as a flame graph at https://www.speedscope.app.
+    Only the newest `max_files` profiles are kept. Only the event loop thread
+    is sampled, time spent in threadpool handlers shows up as a wait.
+
+    A request sent with an `X-Profile` header equal to `header_secret` is
+    always profiled. Without a secret the header is ignored.
+    """
+
+    def __init__(self, output_dir: Path, threshold_ms: float = 500, sample_rate: float = 0.01,
+                 interval: float = 0.001, header_secret: str = "", max_files: int = 100):
+        from pyinstrument import Profiler  # noqa: F401, fail at startup when it is missing
+
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.header_secret = header_secret.encode()
+        self.max_files = max_files
+
+    def requested(self, headers) -> bool:
+        if not self.header_secret:
+            return False
+        value = next((value for name, value in headers if name == b"x-profile"), None)
+        return value is not None and hmac.compare_digest(value, self.header_secret)
+
+    def start(self, force: bool = False):
+        if not force and random.random() >= self.sample_rate:
+            return None
+        from pyinstrument import Profiler
+
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        try:
+            profiler.start()
+        except RuntimeError:
+            # Another request on this thread is already being profiled
+            return None
+        return profiler
+
+    async def finish(self, profiler, route: str, elapsed: float):
+        profiler.stop()
+        if elapsed < self.threshold:
+            return
+        from fastapi.concurrency import run_in_threadpool
+
+        # Rendering a long profile takes a while, it stays off the event loop it was measuring
+        path = await run_in_threadpool(self._write, profiler, route, elapsed)
+        logger.warning("Slow request %s took %.0f ms, profile written to %s", route, elapsed * 1000, path)
+
+    def _write(self, profiler, route: str, elapsed: float) -> Path:
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{int(elapsed * 1000)}ms-{route.strip('/').replace('/', '_') or 'root'}"
+        path = self.output_dir / f"{name}.speedscope.json"
+        path.write_text(profiler.output(renderer=SpeedscopeRenderer()))
+        self._prune()
+        return path
+
+    def _prune(self):
+        def modified(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0.0
+
+        profiles = sorted(self.output_dir.glob("*.speedscope.json"), key=modified)
+        for path in profiles[:max(len(profiles) - self.max_files, 0)]:
+            path.unlink(missing_ok=True)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware that records latency, in-flight requests and per-request SQL."""
+
+    def __init__(self, app, profiler: SlowRequestProfiler = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        profiler = None
+        if self.profiler is not None:
+            profiler = self.profiler.start(force=self.profiler.requested(scope.get("headers", ())))
+
+        request_db = [0, 0.0]
+        token = _request_db.set(request_db)
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            _request_db.reset(token)
+            # The route template keeps label cardinality bounded, unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            http_request_duration.observe(elapsed, scope["method"], route, status[0])
+            db_queries_per_request.observe(request_db[0], route)
+            db_time_per_request.observe(request_db[1], route)
+            if profiler is not None:
+                await self.profiler.finish(profiler, route, elapsed)
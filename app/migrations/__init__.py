@@ -0,0 +1,26 @@
+"""Idempotent schema migrations for tables that already exist.
+
+`create_db_and_tables` only creates missing tables, so indexes and columns
+added to existing models are applied here. Run from the app directory:
+
+    python -m migrations
+"""
+import importlib
+
+from sqlalchemy.engine import Engine
+
+# Applied in order, every migration must be safe to run more than once
+MIGRATIONS = [
+    "m0001_products_listing_indexes",
+    "m0002_verifyotp_attempts",
+    "m0003_geo_coordinates",
+    "m0004_product_rollups",
+    "m0005_blob_storage",
+    "m0006_products_import_id",
+]
+
+def run_migrations(engine: Engine):
+    for name in MIGRATIONS:
+        module = importlib.import_module(f"migrations.{name}")
+        module.upgrade(engine)
+        print(f"Applied {name}")
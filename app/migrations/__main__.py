@@ -0,0 +1,4 @@
+from database import engine
+from migrations import run_migrations
+
+run_migrations(engine)
@@ -0,0 +1,17 @@
+from sqlalchemy.engine import Engine
+
+from models import Products
+
+# Composite indexes for keyset pagination of GET /products
+INDEXES = [
+    "ix_products_created_at_id",
+    "ix_products_price_id",
+    "ix_products_category_created_at_id",
+    "ix_products_category_price_id",
+    "ix_products_farmer_created_at_id",
+]
+
+def upgrade(engine: Engine):
+    indexes = {index.name: index for index in Products.__table__.indexes}
+    for name in INDEXES:
+        indexes[name].create(engine, checkfirst=True)
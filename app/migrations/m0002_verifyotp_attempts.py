@@ -0,0 +1,20 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from models import VerifyOtp
+
+# Attempt counter and lockout for OTP verification, plus the index the expiry sweeper scans
+COLUMNS = {
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "locked_until": "DATETIME NULL",
+}
+
+def upgrade(engine: Engine):
+    existing = {column["name"] for column in inspect(engine).get_columns("verifyotp")}
+    with engine.begin() as connection:
+        for name, definition in COLUMNS.items():
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE verifyotp ADD COLUMN {name} {definition}"))
+    for index in VerifyOtp.__table__.indexes:
+        if index.name == "ix_verifyotp_otp_expires_at":
+            index.create(engine, checkfirst=True)
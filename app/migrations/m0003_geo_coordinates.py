@@ -0,0 +1,28 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from models import Farmer, Products
+from services.geo import backfill_coordinates
+
+# Gazetteer coordinates on accounts and products, the grid indexes nearby searches scan,
+# and a backfill of rows written before them (only rows still without coordinates)
+COLUMNS = {
+    "farmer": {"latitude": "FLOAT NULL", "longitude": "FLOAT NULL", "geocell": "INTEGER NULL"},
+    "users": {"latitude": "FLOAT NULL", "longitude": "FLOAT NULL"},
+    "products": {"latitude": "FLOAT NULL", "longitude": "FLOAT NULL", "geocell": "INTEGER NULL"},
+}
+INDEXES = {"ix_farmer_geocell", "ix_products_geocell", "ix_products_category_geocell"}
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table, columns in COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, definition in columns.items():
+                if name not in existing:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+    for model in (Farmer, Products):
+        for index in model.__table__.indexes:
+            if index.name in INDEXES:
+                index.create(engine, checkfirst=True)
+    print(f"Backfilled coordinates: {backfill_coordinates(engine)}")
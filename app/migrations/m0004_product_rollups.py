@@ -0,0 +1,11 @@
+from sqlalchemy.engine import Engine
+
+from models import FarmerDailyListings, ProductStats
+from services.product_rollups import reconcile
+
+# Rollup tables behind /farmer/dashboard and /products/category-stats, filled from the
+# products written before them (a rerun only corrects rows that drifted)
+def upgrade(engine: Engine):
+    for model in (ProductStats, FarmerDailyListings):
+        model.__table__.create(engine, checkfirst=True)
+    print(f"Backfilled product rollups: {reconcile(engine)} rows")
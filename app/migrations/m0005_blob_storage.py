@@ -0,0 +1,63 @@
+import hashlib
+import mimetypes
+import shutil
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.engine import Engine
+
+from config import PRODUCTS_DIR, USERS_DIR, VOICES_DIR
+from models import Blob, Products
+from services.storage import BLOB_ID, StoredFile, blob_id, create_store
+
+# Uploads made before the blob store, imported with the kind they would be uploaded as now
+LEGACY_DIRS = {"product": PRODUCTS_DIR, "user": USERS_DIR, "voice": VOICES_DIR}
+
+
+def _import_files(store) -> dict:
+    stored = {}
+    for kind, directory in LEGACY_DIRS.items():
+        if not directory.is_dir():
+            continue
+        for path in directory.iterdir():
+            if not path.is_file() or not BLOB_ID.fullmatch(path.stem):
+                continue
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                while chunk := f.read(1024 * 1024):
+                    digest.update(chunk)
+            sha256, size = digest.hexdigest(), path.stat().st_size
+            staged = store.staging_path()
+            shutil.copyfile(path, staged)
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            new = store.add(staged, sha256, size, content_type, kind)
+            stored[path.stem] = StoredFile(sha256, path.suffix, size, new)
+    return stored
+
+
+# Moves the files in uploads/products, users and voices to the blob store, points product
+# images at their /files URL and counts the references. The old files are left in place
+def upgrade(engine: Engine):
+    Blob.__table__.create(engine, checkfirst=True)
+    store = create_store(engine)
+    stored = _import_files(store)
+
+    rows = []
+    with engine.connect() as connection:
+        for product_id, image in connection.execute(
+            select(Products.id, Products.image).where(Products.image.is_not(None)).execution_options(yield_per=5000)
+        ):
+            legacy = blob_id(image)
+            if legacy in stored and not image.startswith("/files/"):
+                rows.append({"product_id": product_id, "new_image": stored[legacy].url})
+    if rows:
+        with engine.begin() as connection:
+            connection.execute(
+                update(Products.__table__).where(Products.__table__.c.id == bindparam("product_id"))
+                .values(image=bindparam("new_image")),
+                rows,
+            )
+    recounted = store.recount()
+    print(f"Stored {sum(file.new for file in stored.values())} of {len(stored)} uploaded files, "
+          f"pointed {len(rows)} product images at them, corrected {recounted} refcounts")
+    if stored:
+        print(f"The originals in {', '.join(str(d) for d in LEGACY_DIRS.values())} can be removed")
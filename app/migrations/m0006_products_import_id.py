@@ -0,0 +1,15 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from models import Products
+
+# Bulk imports tag their rows, the search index task reads them back by this id. Rows
+# imported before it keep NULL, they were indexed (or not) when they were imported
+def upgrade(engine: Engine):
+    existing = {column["name"] for column in inspect(engine).get_columns("products")}
+    if "import_id" not in existing:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE products ADD COLUMN import_id VARCHAR(32) NULL"))
+    for index in Products.__table__.indexes:
+        if index.name == "ix_products_import_id":
+            index.create(engine, checkfirst=True)
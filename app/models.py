@@ -1,13 +1,20 @@
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
-from datetime import datetime, timezone
-from sqlalchemy import Column, JSON
+from datetime import date, datetime, timezone
+from sqlalchemy import Column, JSON, Index, UniqueConstraint
 
 class Farmer(SQLModel, table=True):
+    # Covering index scanned by /farmers/nearby
+    __table_args__ = (Index("ix_farmer_geocell", "geocell", "latitude", "longitude"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     phone: str = Field(unique=True, index=True)
     name: str
     location: str
+    # Gazetteer coordinates of `location`
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    geocell: Optional[int] = None
     verified: bool = Field(default=False)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -17,9 +24,27 @@ class VerifyOtp(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     phone: str = Field(unique=True, index=True)
     otp_code: str
-    otp_expires_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    otp_expires_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), index=True)
+    # Failed verifications of the current code, the phone is locked once it reaches OTP_MAX_ATTEMPTS
+    attempts: int = Field(default=0)
+    locked_until: Optional[datetime] = None
 
 class Products(SQLModel, table=True):
+    # Composite indexes backing the keyset-paginated listing (GET /products)
+    __table_args__ = (
+        Index("ix_products_created_at_id", "created_at", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_category_created_at_id", "category", "created_at", "id"),
+        Index("ix_products_category_price_id", "category", "price", "id"),
+        Index("ix_products_farmer_created_at_id", "farmer_id", "created_at", "id"),
+        # Cell ranges scanned by GET /products/nearby, with and without a category. The
+        # coordinates are included so candidates are ranked without reading the table
+        Index("ix_products_geocell", "geocell", "latitude", "longitude"),
+        Index("ix_products_category_geocell", "category", "geocell", "latitude", "longitude"),
+        # Reads the rows of one bulk import back for the search index
+        Index("ix_products_import_id", "import_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     description: Optional[str] = None
@@ -29,6 +54,12 @@ class Products(SQLModel, table=True):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: Optional[datetime] = None
     farmer_id: int = Field(foreign_key="farmer.id")
+    # Copied from the farmer, so nearby searches need no join
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    geocell: Optional[int] = None
+    # Set on the rows of a bulk import, one id per import
+    import_id: Optional[str] = Field(default=None, max_length=32)
 
     farmer: Optional["Farmer"] = Relationship(back_populates="products")
 
@@ -38,6 +69,56 @@ class Users(SQLModel, table=True):
     phone: str = Field(unique=True, index=True)
     name: str
     location: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     verified: bool = Field(default=False)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     user_type: str = Field(default="user")
+
+# Kalimati market daily prices, one row per commodity, unit and day
+class CommodityPrice(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("commodity", "unit", "price_date", name="uq_commodityprice_commodity_unit_date"),
+        Index("ix_commodityprice_price_date", "price_date"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    commodity: str = Field(max_length=120)
+    unit: str = Field(max_length=16)
+    price_date: date
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    avg_price: float
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+# Product rollups kept current by services/product_rollups.py, one row per farmer and
+# category, farmer_id 0 holds the whole market's
+class ProductStats(SQLModel, table=True):
+    farmer_id: int = Field(primary_key=True)
+    category: str = Field(primary_key=True)
+    product_count: int = 0
+    price_sum: float = 0
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+
+# Listings a farmer created per Nepal calendar day
+class FarmerDailyListings(SQLModel, table=True):
+    farmer_id: int = Field(primary_key=True)
+    day: date = Field(primary_key=True)
+    product_count: int = 0
+
+# An uploaded file, stored once per content by services/storage.py
+class Blob(SQLModel, table=True):
+    # Scanned by the garbage collector
+    __table_args__ = (Index("ix_blob_expires_at", "expires_at"),)
+
+    sha256: str = Field(primary_key=True, max_length=64)
+    size: int
+    content_type: str = Field(max_length=100)
+    # "product", "user" or "voice", the kind of the first upload
+    kind: str = Field(max_length=16)
+    # Products whose image is this blob
+    refcount: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Reclaimed after this while nothing references it, None keeps it
+    expires_at: Optional[datetime] = None
@@ -0,0 +1,167 @@
+import json
+import re
+import zlib
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, Row):
+        return dict(obj._mapping)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return jsonable_encoder(obj)
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        # UTC as "Z", the way pydantic writes it. NON_STR_KEYS also admits str subclasses
+        # such as SQLAlchemy's quoted_name, which Core row mappings use as keys
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON through orjson when it is installed, compact stdlib json otherwise."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(content, status_code: int = 200, headers: dict = None) -> FastJSONResponse:
+    """Serializes trusted content as is, skipping response_model validation.
+
+    For handlers whose rows already have the response model's shape, e.g. a
+    select of SUMMARY_COLUMNS. The route keeps `response_model` for the docs.
+    """
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+COMPRESSIBLE_TYPES = re.compile(r"^(text/(?!event-stream)|application/(json|x-ndjson|javascript|xml)|image/svg\+xml)")
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """Picks br or gzip from an Accept-Encoding header, None when neither is acceptable."""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    wildcard = accepted.get("*", 0.0)
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+class _Compressor:
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int):
+        if coding == "br":
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+            self._zlib = None
+        else:
+            self._brotli = None
+            # wbits 31 writes the gzip header and trailer
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, more: bool) -> bytes:
+        if self._brotli is not None:
+            out = self._brotli.process(data)
+            return out + (self._brotli.flush() if more else self._brotli.finish())
+        # A sync flush per chunk lets streamed exports reach the client as they are produced
+        out = self._zlib.compress(data)
+        return out + self._zlib.flush(zlib.Z_SYNC_FLUSH if more else zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Compresses text and JSON responses with br or gzip, as the client's Accept-Encoding allows.
+
+    Bodies under `minimum_size` go out as they are, as do media types that
+    are already compressed (images, audio), server-sent events, partial
+    content and responses that already carry a Content-Encoding.
+    """
+
+    def __init__(self, app, minimum_size: int = 500, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                headers = Headers(raw=message["headers"])
+                passthrough = (
+                    message["status"] in (204, 206, 304)
+                    or "content-encoding" in headers
+                    or "content-range" in headers
+                    or not COMPRESSIBLE_TYPES.match(headers.get("content-type", ""))
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if compressor is None:
+                # The start message is held back until the first body chunk shows whether compressing pays off
+                if not more and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(coding, self.gzip_level, self.brotli_quality)
+                headers = MutableHeaders(raw=start["headers"])
+                headers["Content-Encoding"] = coding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if not more:
+                    data = compressor.compress(body, more=False)
+                    headers["Content-Length"] = str(len(data))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": data})
+                    return
+                await send(start)
+            await send({"type": "http.response.body", "body": compressor.compress(body, more), "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
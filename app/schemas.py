@@ -1,3 +1,4 @@
+from datetime import date, datetime
 from typing import Optional, List
 from pydantic import BaseModel
 
@@ -17,6 +18,10 @@ class UserRegister(BaseModel):
 class UserLogin(BaseModel):
     phone: str
 
+class ProfileUpdate(BaseModel):
+    name: Optional[str] = None
+    location: Optional[str] = None
+
 class OTPVerifySchema(BaseModel):
     phone: str
     otp_code: str
@@ -25,12 +30,76 @@ class ProductCreate(BaseModel):
     title: str
     description: Optional[str] = None
     price: float
+    category: str = 'Fruits'
     image: str = None
 
 class ProductUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
     price: Optional[float] = None
+    category: Optional[str] = None
     images: Optional[list[str]] = None
 
-    
\ No newline at end of file
+# Listing projection, leaves out the description
+class ProductSummary(BaseModel):
+    id: int
+    title: str
+    price: float
+    category: str
+    image: Optional[str] = None
+    farmer_id: int
+    created_at: datetime
+
+class ProductPage(BaseModel):
+    items: List[ProductSummary]
+    next_cursor: Optional[str] = None
+
+class ProductSearchHit(ProductSummary):
+    score: float
+
+class ProductSearchResults(BaseModel):
+    items: List[ProductSearchHit]
+
+class NearbyOrigin(BaseModel):
+    latitude: float
+    longitude: float
+    # Gazetteer place the `location` parameter resolved to
+    place: Optional[str] = None
+
+class ProductNearbyHit(ProductSummary):
+    distance_km: float
+
+class NearbyProducts(BaseModel):
+    origin: NearbyOrigin
+    items: List[ProductNearbyHit]
+
+class FarmerNearbyHit(BaseModel):
+    id: int
+    name: str
+    location: str
+    verified: bool
+    distance_km: float
+
+class NearbyFarmers(BaseModel):
+    origin: NearbyOrigin
+    items: List[FarmerNearbyHit]
+
+class PriceSummary(BaseModel):
+    products: int
+    avg_price: Optional[float] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+
+class CategorySummary(PriceSummary):
+    category: str
+
+class CategoryStats(BaseModel):
+    totals: PriceSummary
+    categories: List[CategorySummary]
+
+class DailyListings(BaseModel):
+    day: date
+    products: int
+
+class FarmerDashboard(CategoryStats):
+    listings_per_day: List[DailyListings]
@@ -1,28 +1,153 @@
+import re
+import sys
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Optional
+
 import httpx
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 URL = "https://kalimatimarket.gov.np/"
 
-def scrap_price():
-    html = httpx.get(URL).content
-    soup = BeautifulSoup(html, 'html.parser')
+try:
+    import lxml  # noqa: F401
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# Only the daily price table is handed to the tree builder, the rest of the page is skipped
+PRICE_TABLE = SoupStrainer("div", id="commodityPricesDailyTable")
+
+DEVANAGARI_DIGITS = str.maketrans("०१२३४५६७८९", "0123456789")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+# Weekday named at the end of the table title, Monday is 0 as in date.weekday()
+WEEKDAYS = {
+    "सोमबार": 0, "monday": 0,
+    "मंगलबार": 1, "मङ्गलबार": 1, "tuesday": 1,
+    "बुधबार": 2, "wednesday": 2,
+    "बिहीबार": 3, "बिहिबार": 3, "thursday": 3,
+    "शुक्रबार": 4, "friday": 4,
+    "शनिबार": 5, "saturday": 5,
+    "आइतबार": 6, "sunday": 6,
+}
+
+UNITS = {
+    "kg": "kg", "के.जी.": "kg", "केजी": "kg", "के.जी": "kg", "किलो": "kg",
+    "dozen": "dozen", "दर्जन": "dozen", "दर्जन.": "dozen",
+    "piece": "piece", "गोटा": "piece", "प्रति गोटा": "piece", "पीस": "piece",
+    "bundle": "bundle", "मुठा": "bundle", "प्रति मुठा": "bundle",
+}
+
+
+@dataclass
+class PriceRow:
+    commodity: str
+    unit: str
+    min_price: Optional[float]
+    max_price: Optional[float]
+    avg_price: Optional[float]
+
+
+@dataclass
+class PriceTable:
+    title: str
+    headings: list
+    rows: list = field(default_factory=list)
+
+    @property
+    def weekday(self) -> Optional[int]:
+        """The market day's weekday from the title, e.g. "... २०८१ असोज २०, आइतबार" is Sunday (6)."""
+        title = unicodedata.normalize("NFC", self.title).lower()
+        for name, weekday in WEEKDAYS.items():
+            if name in title:
+                return weekday
+        return None
+
 
-    main_div = soup.find('div', id='commodityPricesDailyTable')
+# Conditional request validators from the previous fetch
+@dataclass
+class Validators:
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
 
-    title = main_div.find('h5').text
-    headings = main_div.select('table > thead > tr > th')
-    headings_list = []
+    def headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
 
-    for heading in headings:
-        headings_list.append(heading.text)
 
-    listings_detail_trs = main_div.select("table#commodityDailyPrice > tbody > tr")
-    rows_listing = []
+def normalize_commodity(name: str) -> str:
+    name = unicodedata.normalize("NFC", name)
+    # "गोलभेडा ठूलो(भारतीय)" and "गोलभेडा ठूलो (भारतीय)" are the same commodity
+    name = re.sub(r"\s*\(\s*", " (", name)
+    name = re.sub(r"\s*\)", ")", name)
+    return " ".join(name.split())
 
-    for row in listings_detail_trs:
-        columns = [item.text for item in row.select('td')]
-        rows_listing.append(columns)
 
-    print(title, headings_list, rows_listing)
+def normalize_unit(unit: str) -> str:
+    unit = " ".join(unicodedata.normalize("NFC", unit).split())
+    return UNITS.get(unit.lower(), unit.lower())
+
+
+def parse_price(text: str) -> Optional[float]:
+    text = text.translate(DEVANAGARI_DIGITS).replace(",", "")
+    match = NUMBER.search(text)
+    return float(match.group()) if match else None
+
+
+def parse_prices(html) -> PriceTable:
+    soup = BeautifulSoup(html, PARSER, parse_only=PRICE_TABLE)
+    main_div = soup.find("div", id="commodityPricesDailyTable")
+    if main_div is None:
+        raise ValueError("Daily price table not found")
+
+    title = main_div.find("h5").get_text(strip=True)
+    headings = [th.get_text(strip=True) for th in main_div.select("table > thead > tr > th")]
+    table = PriceTable(title=title, headings=headings)
+
+    for tr in main_div.select("table#commodityDailyPrice > tbody > tr"):
+        columns = [td.get_text(strip=True) for td in tr.find_all("td", recursive=False)]
+        if len(columns) < 5:
+            continue
+        commodity, unit, min_price, max_price, avg_price = columns[:5]
+        table.rows.append(PriceRow(
+            commodity=normalize_commodity(commodity),
+            unit=normalize_unit(unit),
+            min_price=parse_price(min_price),
+            max_price=parse_price(max_price),
+            avg_price=parse_price(avg_price),
+        ))
+    return table
+
+
+async def fetch_prices_html(client: httpx.AsyncClient, validators: Validators):
+    """Returns (html, validators), html is None when the page is unchanged since the last fetch."""
+    response = await client.get(URL, headers=validators.headers())
+    if response.status_code == 304:
+        return None, validators
+    response.raise_for_status()
+    return response.content, Validators(
+        etag=response.headers.get("etag"),
+        last_modified=response.headers.get("last-modified"),
+    )
+
+
+def scrap_price() -> PriceTable:
+    html = httpx.get(URL).content
+    return parse_prices(html)
+
 
-scrap_price()
+if __name__ == "__main__":
+    # python -m scrappers.price_listing_scraping [saved.html]
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            table = parse_prices(f.read())
+    else:
+        table = scrap_price()
+    print(table.title, table.headings)
+    for row in table.rows:
+        print(row)
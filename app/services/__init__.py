@@ -1,16 +1,19 @@
 from pathlib import Path
-import assemblyai as aai
-from config import ASSEMBLYAI_KEY, BASE_UPLOAD_DIR
+from config import (
+    ASSEMBLYAI_KEY, TRANSCRIPTION_BACKEND, TRANSCRIPTION_LANGUAGE, TRANSCRIPTION_WORKERS,
+    TRANSCRIPTION_CACHE_SIZE, TRANSCRIPTION_CACHE_DIR,
+)
+from services.prediction_cache import PredictionCache
+from services.transcription import TranscriptionJobs, create_backend
 
 UPLOAD_DIRECTORY = Path("uploads")
 UPLOAD_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
-aai.settings.api_key = ASSEMBLYAI_KEY
-config = aai.TranscriptionConfig(language_code='hi')
+transcriber = create_backend(TRANSCRIPTION_BACKEND, api_key=ASSEMBLYAI_KEY, language_code=TRANSCRIPTION_LANGUAGE)
 
-transcriber = aai.Transcriber(config=config)
-
-async def voice_to_text_converter(audio_file):
-    full_path = BASE_UPLOAD_DIR.cwd() / audio_file
-    transcript = transcriber.transcribe(str(full_path))
-    return transcript.text
+# Transcripts are cached for a week, clips are keyed by their content hash
+transcription_jobs = TranscriptionJobs(
+    transcriber,
+    workers=TRANSCRIPTION_WORKERS,
+    cache=PredictionCache(TRANSCRIPTION_CACHE_SIZE, ttl_seconds=7 * 24 * 60 * 60, disk_dir=TRANSCRIPTION_CACHE_DIR),
+)
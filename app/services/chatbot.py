@@ -1,16 +1,249 @@
-from openai import OpenAI
-from config import OPENAI_KEY
+import asyncio
+import re
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator
 
-client = OpenAI( api_key = OPENAI_KEY )
+from config import (
+    OPENAI_KEY, CHAT_BACKEND, CHAT_MODEL, CHAT_MAX_CONCURRENCY, CHAT_PER_USER_CONCURRENCY,
+    CHAT_QUEUE_TIMEOUT, CHAT_TIMEOUT, CHAT_MAX_RETRIES, CHAT_MAX_CONNECTIONS, CHAT_CACHE_SIZE, CHAT_CACHE_TTL,
+)
+from metrics import time_external_call
+from services.prediction_cache import PredictionCache, content_hash
 
-async def chat_with_openai(message: str) -> str:
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are an expert in agricultural economics with precise knowledge of farming expenses. Based on the farm size, location, and type of crops or livestock provided, generate a highly detailed and structured breakdown of expected agricultural costs. Your response should be formatted clearly, use specific numbers, and include all major expense categories. Adjust the cost estimates based on regional market conditions and farming methods and response in nepali"},
-            {"role": "user", "content": f"{message}"}
-        ]
-    )
+SYSTEM_PROMPT = "You are an expert in agricultural economics with precise knowledge of farming expenses. Based on the farm size, location, and type of crops or livestock provided, generate a highly detailed and structured breakdown of expected agricultural costs. Your response should be formatted clearly, use specific numbers, and include all major expense categories. Adjust the cost estimates based on regional market conditions and farming methods and response in nepali"
 
-    return completion.choices[0].message.content
+DEVANAGARI_DIGITS = str.maketrans("०१२३४५६७८९", "0123456789")
+PUNCTUATION = re.compile(r"[^\w\s\u0900-\u0963\u0966-\u097f]")
 
+
+class GatewayBusy(Exception):
+    pass
+
+
+class ChatBackend(ABC):
+    """Streams the assistant reply as text deltas."""
+
+    name = "base"
+
+    @abstractmethod
+    def stream(self, messages: list) -> AsyncIterator[str]:
+        """An async generator of reply deltas for the OpenAI-style `messages`."""
+
+    def retryable(self, error: Exception) -> bool:
+        """Whether `error` is transient, so the request may be sent again."""
+        return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class OpenAIBackend(ChatBackend):
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str, timeout: float, max_connections: int):
+        import httpx
+        from openai import AsyncOpenAI
+
+        self.model = model
+        # One pooled HTTP client for the whole process instead of a connection per request
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+        )
+        # ChatGateway owns the retries, the client retrying as well would multiply the attempts
+        self.client = AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=0, http_client=http_client)
+
+    async def stream(self, messages: list):
+        response = await self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def retryable(self, error: Exception) -> bool:
+        import httpx
+        import openai
+
+        # Connection failures, timeouts and 5xx; a 4xx (bad request, auth, rate limit) fails the same way again
+        if isinstance(error, (openai.APIConnectionError, openai.InternalServerError, httpx.TransportError)):
+            return True
+        return super().retryable(error)
+
+
+class FakeBackend(ChatBackend):
+    """Offline backend for tests, echoes the prompt word by word."""
+
+    name = "fake"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    async def stream(self, messages: list):
+        for word in f"Estimated costs for: {messages[-1]['content']}".split():
+            await asyncio.sleep(self.delay)
+            yield word + " "
+
+
+def create_backend(name: str) -> ChatBackend:
+    if name == "openai":
+        return OpenAIBackend(OPENAI_KEY, CHAT_MODEL, CHAT_TIMEOUT, CHAT_MAX_CONNECTIONS)
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Unknown chat backend '{name}'")
+
+
+# Prompts that only differ in case, spacing, punctuation or digit script share a cache entry
+def normalize_prompt(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).casefold().translate(DEVANAGARI_DIGITS)
+    return " ".join(PUNCTUATION.sub(" ", text).split())
+
+
+class ChatGateway:
+    """Caches, queues and times LLM completions.
+
+    At most `max_concurrency` completions run at once, and at most
+    `per_user_concurrency` per user. Callers queue for a slot for up to
+    `queue_timeout` seconds before `GatewayBusy` is raised.
+    """
+
+    def __init__(self, backend: ChatBackend, cache: PredictionCache, max_concurrency: int = 16,
+                 per_user_concurrency: int = 2, queue_timeout: float = 10, timeout: float = 60, retries: int = 2):
+        self.backend = backend
+        self.cache = cache
+        self.per_user_concurrency = per_user_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._user_slots = {}
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.failures = 0
+        self.ttft = deque(maxlen=1024)
+        self.tokens_per_second = deque(maxlen=1024)
+
+    async def stream(self, message: str, user: str):
+        key = f"{self.backend.name}:{content_hash(normalize_prompt(message).encode())}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        self.cache.record_miss()
+
+        async with self._slot(user):
+            messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": message}]
+            parts = []
+            started = time.perf_counter()
+            first_token_at = None
+            for attempt in range(self.retries + 1):
+                try:
+                    deltas = self._with_deadline(self.backend.stream(messages), started + self.timeout)
+                    with time_external_call("llm", self.backend.name):
+                        async with aclosing(deltas):
+                            async for delta in deltas:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    self.ttft.append(first_token_at - started)
+                                parts.append(delta)
+                                yield delta
+                    break
+                except asyncio.TimeoutError:
+                    self.failures += 1
+                    raise
+                except Exception as error:
+                    self.failures += 1
+                    # Retrying is only safe while nothing has been sent to the client
+                    if first_token_at is not None or attempt == self.retries or not self.backend.retryable(error):
+                        raise
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+
+            if first_token_at is not None:
+                elapsed = time.perf_counter() - first_token_at
+                # Stream deltas are roughly one token each
+                self.tokens_per_second.append(len(parts) / elapsed if elapsed > 0 else 0.0)
+            self.cache.put(key, "".join(parts))
+
+    async def complete(self, message: str, user: str) -> str:
+        return "".join([delta async for delta in self.stream(message, user)])
+
+    def stats(self) -> dict:
+        def mean(values):
+            return sum(values) / len(values) if values else 0.0
+
+        ttft = sorted(self.ttft)
+        return {
+            "backend": self.backend.name,
+            "active": self.active,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "ttft_avg_ms": mean(ttft) * 1000,
+            "ttft_p95_ms": ttft[int(len(ttft) * 0.95)] * 1000 if ttft else 0.0,
+            "tokens_per_second_avg": mean(self.tokens_per_second),
+            "cache": self.cache.stats(),
+        }
+
+    @asynccontextmanager
+    async def _slot(self, user: str):
+        entry = self._user_slots.setdefault(user, [asyncio.Semaphore(self.per_user_concurrency), 0])
+        entry[1] += 1
+        holds_user_slot = holds_slot = False
+        try:
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                await asyncio.wait_for(entry[0].acquire(), self.queue_timeout)
+                holds_user_slot = True
+                await asyncio.wait_for(self._slots.acquire(), max(deadline - time.monotonic(), 0.01))
+                holds_slot = True
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise GatewayBusy("Chat is busy, try again shortly")
+            finally:
+                self.queued -= 1
+
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+        finally:
+            if holds_slot:
+                self._slots.release()
+            if holds_user_slot:
+                entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._user_slots.pop(user, None)
+
+    @staticmethod
+    async def _with_deadline(stream, deadline: float):
+        iterator = stream.__aiter__()
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(iterator.__anext__(), max(deadline - time.perf_counter(), 0))
+                except StopAsyncIteration:
+                    return
+                yield delta
+        finally:
+            # Closes the backend response on timeouts, errors and clients that stop reading
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+
+gateway = ChatGateway(
+    create_backend(CHAT_BACKEND),
+    PredictionCache(CHAT_CACHE_SIZE, ttl_seconds=CHAT_CACHE_TTL),
+    max_concurrency=CHAT_MAX_CONCURRENCY,
+    per_user_concurrency=CHAT_PER_USER_CONCURRENCY,
+    queue_timeout=CHAT_QUEUE_TIMEOUT,
+    timeout=CHAT_TIMEOUT,
+    retries=CHAT_MAX_RETRIES,
+)
+
+async def chat_with_openai(message: str, user: str = "anonymous") -> str:
+    return await gateway.complete(message, user)
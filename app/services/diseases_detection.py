@@ -1,35 +1,88 @@
 import os
 import json
-from PIL import Image
+import threading
 
-import numpy as np  
-import tensorflow as tf
+from fastapi.concurrency import run_in_threadpool
+
+from config import (
+    INFERENCE_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_WORKERS, INFERENCE_MODE, INFERENCE_SOCKETS, INFERENCE_TIMEOUT,
+    MODEL_BACKEND, MODEL_PATH, PREDICTION_TOP_K,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_DIR,
+)
+from services.image_preprocessing import BatchBuffer, decode_image, top_k
+from services.inference_batcher import InferenceBatcher
+from services.inference_client import InferenceClient
+from services.model_runtime import ModelRuntime
+from services.prediction_cache import PredictionCache
+from metrics import model_batch_size, model_inference_duration
 
 working_dir = os.path.dirname(os.path.abspath(__file__))
-model_path = f"{working_dir}/../trained_models/plant_disease_prediction_model.keras"
 
-# Model the pretrain model
-model = tf.keras.models.load_model(model_path)
+# The model is loaded on first use (or by the startup warm-up), not on import
+runtime = ModelRuntime(MODEL_BACKEND, MODEL_PATH or None)
 
 # lading the class names
 class_indices = json.load(open(f"{working_dir}/../class_indices.json"))
 
+# Every inference thread normalizes into its own reusable batch buffer
+_buffers = threading.local()
+
+def _batch_buffer():
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _buffers.buffer = BatchBuffer(INFERENCE_BATCH_SIZE)
+    return buffer
+
 # Function to load and preprocess the image using pillow 
 def load_and_preprocess_image(image_path, target_size=(224, 224)):
-    img = Image.open(image_path)
-    img = img.resize(target_size)
-    
-    img_array = np.array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = img_array.astype('float32') / 255. 
-    
-    return img_array
+    with open(image_path, "rb") as f:
+        image = decode_image(f.read(), target_size)
+    return BatchBuffer(1, target_size).fill([image])
+
+# Runs a list of decoded (224, 224, 3) images through the model in one call
+def predict_batch(images, runtime = runtime):
+    batch = _batch_buffer().fill(images)
+    model_batch_size.observe(len(images))
+    with model_inference_duration.time(runtime.backend_name):
+        return runtime.predict(batch)
+
+def decode_prediction(predictions, k = PREDICTION_TOP_K, class_indices = class_indices):
+    ranked = top_k(predictions, k)
+    return {
+        "prediction": class_indices[str(ranked[0][0])],
+        "top_k": [{"class": class_indices[str(i)], "probability": p} for i, p in ranked],
+    }
 
 # Function to predict the class of an image 
-def predict_image_class(image_path, model = model, class_indices = class_indices):
+def predict_image_class(image_path, runtime = runtime, class_indices = class_indices):
     preprocessed_image = load_and_preprocess_image(image_path)
-    predictions = model.predict(preprocessed_image)
-    
-    predict_class_index = np.argmax(predictions, axis=1)[0]
-    predict_class_name = class_indices[str(predict_class_index)]
-    return predict_class_name
+    predictions = runtime.predict(preprocessed_image)
+    return decode_prediction(predictions[0], 1, class_indices)["prediction"]
+
+# In remote mode the model stays in the inference server processes, this worker never loads it
+if INFERENCE_MODE == "remote":
+    batcher = InferenceClient(INFERENCE_SOCKETS, timeout=INFERENCE_TIMEOUT)
+else:
+    batcher = InferenceBatcher(
+        predict_batch,
+        max_batch_size=INFERENCE_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        workers=INFERENCE_WORKERS,
+    )
+
+prediction_cache = PredictionCache(
+    max_entries=PREDICTION_CACHE_SIZE,
+    ttl_seconds=PREDICTION_CACHE_TTL,
+    disk_dir=PREDICTION_CACHE_DIR,
+)
+
+# Non-blocking variant used by the API, decodes the upload in memory and batches inference.
+# Re-uploads of the same photo are answered from the cache.
+async def predict_image_bytes(data: bytes, k = PREDICTION_TOP_K):
+    async def compute():
+        image = await run_in_threadpool(decode_image, data)
+        predictions = await batcher.submit(image)
+        return decode_prediction(predictions, k)
+
+    key = PredictionCache.key(data, f"{runtime.version}:top{k}")
+    return await prediction_cache.get_or_compute(key, compute)
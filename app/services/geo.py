@@ -0,0 +1,276 @@
+import csv
+import difflib
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.engine import Engine
+
+from models import Farmer, Products, Users
+
+GAZETTEER_PATH = Path(__file__).resolve().parent.parent / "gazetteer_np.csv"
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# geocell is a Z-order (geohash-like) key of a 2^15 x 2^15 grid over the globe, cells are
+# about 600 m in Nepal. Any coarser cell is a contiguous range of keys, so a circle is
+# covered by a few BETWEEN ranges on an ordinary B-tree index.
+GRID_BITS = 15
+# Coarsest covering uses at most this many cells per axis
+COVER_CELLS = 4
+
+# Words that say what kind of place a location is, not which one
+NOISE_WORDS = {
+    "metropolitan", "metropolitian", "sub", "submetropolitan", "municipality", "rural", "city", "district",
+    "province", "nagarpalika", "gaunpalika", "mahanagarpalika", "upamahanagarpalika", "jilla", "nepal", "ward",
+    "no", "pradesh",
+}
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    kind: str
+    district: str
+    province: str
+    latitude: float
+    longitude: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    # Only ASCII punctuation is dropped, Devanagari vowel signs are not word characters to `re`
+    words = re.sub(r"[-_.:#'\"0-9]", " ", text).split()
+    return " ".join(word for word in words if word not in NOISE_WORDS)
+
+
+class Gazetteer:
+    """Offline lookup of Nepali districts and municipalities, from gazetteer_np.csv.
+
+    Districts point at their headquarters. Free-text locations are split on
+    commas and the most specific part that names a known place wins, so
+    "Baneshwor-10, Kathmandu" resolves to Kathmandu. Misspellings fall back
+    to a close match.
+    """
+
+    def __init__(self, path: Path = GAZETTEER_PATH, cache_size: int = 10000):
+        self.places = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                place = Place(row["name"], row["kind"], row["district"], row["province"],
+                              float(row["latitude"]), float(row["longitude"]))
+                for name in [row["name"], *filter(None, row["aliases"].split("|"))]:
+                    key = normalize(name)
+                    # A municipality is more precise than the district it shares a name with
+                    if key not in self.places or place.kind == "municipality":
+                        self.places[key] = place
+        self._names = list(self.places)
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, text: Optional[str]) -> Optional[Place]:
+        if not text:
+            return None
+        parts = [part for part in (normalize(part) for part in re.split(r"[,;/|()]", text)) if part]
+        for part in parts:
+            place = self._match(part)
+            if place:
+                return place
+        for part in parts:
+            close = difflib.get_close_matches(part, self._names, n=1, cutoff=0.85)
+            if close:
+                return self.places[close[0]]
+        return None
+
+    def _match(self, part: str) -> Optional[Place]:
+        words = part.split()
+        # Longest run of words first, so "madhyapur thimi" beats "thimi"
+        for size in range(len(words), 0, -1):
+            for start in range(len(words) - size + 1):
+                place = self.places.get(" ".join(words[start:start + size]))
+                if place:
+                    return place
+        return None
+
+
+gazetteer = Gazetteer()
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _spread(v: int) -> int:
+    v &= 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    return (v | (v << 1)) & 0x55555555
+
+
+def _grid(lat: float, lon: float, bits: int) -> tuple:
+    size = 1 << bits
+    x = min(size - 1, max(0, int((lon + 180) / 360 * size)))
+    y = min(size - 1, max(0, int((lat + 90) / 180 * size)))
+    return x, y
+
+
+def geocell(lat: float, lon: float) -> int:
+    x, y = _grid(lat, lon, GRID_BITS)
+    return _spread(x) | (_spread(y) << 1)
+
+
+def cell_ranges(lat: float, lon: float, radius_km: float) -> list:
+    """Inclusive geocell ranges whose cells cover the circle's bounding box."""
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    bits = GRID_BITS
+    while bits > 1 and (2 * dlat > COVER_CELLS * 180 / (1 << bits) or 2 * dlon > COVER_CELLS * 360 / (1 << bits)):
+        bits -= 1
+    x0, y0 = _grid(lat - dlat, lon - dlon, bits)
+    x1, y1 = _grid(lat + dlat, lon + dlon, bits)
+    shift = 2 * (GRID_BITS - bits)
+    prefixes = sorted(_spread(x) | (_spread(y) << 1) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+
+    ranges = []
+    for prefix in prefixes:
+        lo, hi = prefix << shift, ((prefix + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 == lo:
+            ranges[-1] = (ranges[-1][0], hi)
+        else:
+            ranges.append((lo, hi))
+    return ranges
+
+
+def location_values(latitude: Optional[float], longitude: Optional[float]) -> dict:
+    """Column values for a row at these coordinates, all None when they are unknown."""
+    if latitude is None or longitude is None:
+        return {"latitude": None, "longitude": None, "geocell": None}
+    return {"latitude": latitude, "longitude": longitude, "geocell": geocell(latitude, longitude)}
+
+
+def place_values(location: Optional[str]) -> dict:
+    place = gazetteer.resolve(location)
+    return location_values(place.latitude, place.longitude) if place else location_values(None, None)
+
+
+def within(session, model, columns: list, lat: float, lon: float, radius_km: float, limit: int,
+           filters: list = ()) -> list:
+    """Up to `limit` rows of `model` within `radius_km`, nearest first, as (distance_km, row) pairs.
+
+    The nearest ids are picked from the covering (geocell, latitude, longitude)
+    index alone, only those rows are then read with `columns`.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    coslat = math.cos(math.radians(lat))
+    dlon = dlat / max(coslat, 0.01)
+    # Squared equirectangular distance in degrees of latitude, it orders like the true distance at this scale
+    d2 = ((model.latitude - lat) * (model.latitude - lat)
+          + (model.longitude - lon) * coslat * (model.longitude - lon) * coslat)
+    # The filters are repeated in every range, so each one is a single index range scan
+    # (category, geocell) instead of a scan of the whole category
+    ranges = [and_(*filters, model.geocell.between(lo, hi)) for lo, hi in cell_ranges(lat, lon, radius_km)]
+    nearest_ids = session.exec(
+        select(model.id, model.latitude, model.longitude)
+        .where(
+            or_(*ranges),
+            model.latitude.between(lat - dlat, lat + dlat),
+            model.longitude.between(lon - dlon, lon + dlon),
+            d2 <= dlat * dlat,
+        )
+        .order_by(d2, model.id.desc())
+        .limit(limit)
+    ).all()
+    distances = {}
+    for row in nearest_ids:
+        distance = haversine_km(lat, lon, row.latitude, row.longitude)
+        if distance <= radius_km:
+            distances[row.id] = distance
+    if not distances:
+        return []
+    rows = {row.id: row for row in session.exec(select(*columns).where(model.id.in_(list(distances)))).all()}
+    return [(distance, rows[row_id]) for row_id, distance in distances.items() if row_id in rows]
+
+
+def nearest(session, model, columns: list, lat: float, lon: float, k: int, max_radius_km: float,
+            filters: list = (), start_radius_km: float = 1) -> list:
+    """The k nearest rows within `max_radius_km`, searching circles that double in radius until k rows are found.
+
+    Once a circle holds k rows they are the k nearest overall, since any row
+    outside it is farther than all of them. Starting small keeps dense areas
+    from sorting thousands of candidates, empty circles cost an index probe.
+    """
+    radius = min(start_radius_km, max_radius_km)
+    while True:
+        hits = within(session, model, columns, lat, lon, radius, k, filters)
+        if len(hits) >= k or radius >= max_radius_km:
+            return hits
+        radius = min(radius * 2, max_radius_km)
+
+
+def sync_farmer_products(engine: Engine, farmer_id: int, latitude: Optional[float], longitude: Optional[float]) -> list:
+    """Moves a farmer's products to the farmer's coordinates and returns the ids of the moved products."""
+    with engine.begin() as connection:
+        connection.execute(
+            update(Products)
+            .where(Products.farmer_id == farmer_id)
+            .values(**location_values(latitude, longitude), updated_at=datetime.now(timezone.utc))
+        )
+        return connection.execute(select(Products.id).where(Products.farmer_id == farmer_id)).scalars().all()
+
+
+def backfill_coordinates(engine: Engine, chunk_size: int = 1000) -> dict:
+    """Geocodes accounts that have no coordinates yet, then copies farmers' coordinates to their products.
+
+    Each distinct location string is resolved once and written with one
+    UPDATE, so the cost follows the number of places, not the number of rows.
+    """
+    counts = {}
+    for model, has_cell in ((Farmer, True), (Users, False)):
+        resolved = unresolved = 0
+        with engine.connect() as connection:
+            locations = connection.execute(
+                select(model.location).where(model.latitude.is_(None)).distinct()
+            ).scalars().all()
+        with engine.begin() as connection:
+            for location in locations:
+                values = place_values(location)
+                if values["latitude"] is None:
+                    unresolved += 1
+                    continue
+                if not has_cell:
+                    del values["geocell"]
+                connection.execute(
+                    update(model).where(model.location == location, model.latitude.is_(None)).values(**values)
+                )
+                resolved += 1
+        counts[model.__tablename__] = {"resolved_locations": resolved, "unresolved_locations": unresolved}
+
+    farmers_at = defaultdict(list)
+    with engine.connect() as connection:
+        for farmer_id, latitude, longitude in connection.execute(
+            select(Farmer.id, Farmer.latitude, Farmer.longitude).where(Farmer.latitude.is_not(None))
+        ):
+            farmers_at[(latitude, longitude)].append(farmer_id)
+    updated = 0
+    for (latitude, longitude), farmer_ids in farmers_at.items():
+        for start in range(0, len(farmer_ids), chunk_size):
+            with engine.begin() as connection:
+                updated += connection.execute(
+                    update(Products)
+                    .where(Products.farmer_id.in_(farmer_ids[start:start + chunk_size]), Products.latitude.is_(None))
+                    .values(**location_values(latitude, longitude))
+                ).rowcount
+    counts["products"] = {"updated": updated}
+    return counts
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import re
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+# Longest edge in pixels for each derivative, generated largest first
+VARIANTS = {"full": 1280, "card": 480, "thumb": 160}
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+QUALITY = {"webp": 80, "jpeg": 82}
+
+# Bump when variant sizes or encoder settings change so cached ETags are invalidated
+DERIVATIVES_VERSION = "1"
+
+IMAGE_ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _save_atomic(img: Image.Image, path: Path, fmt: str):
+    tmp_path = path.with_name(f".{uuid.uuid4().hex}.part")
+    pillow_format, _ = FORMATS[fmt]
+    # Nothing is passed through from the source, so EXIF/GPS metadata is dropped
+    img.save(tmp_path, format=pillow_format, quality=QUALITY[fmt], optimize=fmt == "jpeg")
+    os.replace(tmp_path, path)
+
+
+class DerivativeGenerator:
+    """Generates resized, metadata-free WebP/JPEG copies of uploaded product images."""
+
+    def __init__(self, output_dir: Path, workers: int = 2):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="derivatives")
+        self._pending = {}
+
+    def path(self, image_id: str, variant: str, fmt: str) -> Path:
+        return self.output_dir / image_id / f"{variant}.{fmt}"
+
+    def etag(self, image_id: str, variant: str, fmt: str) -> str:
+        # Derivatives are a pure function of the content-addressed original
+        return f'"{image_id}-{variant}-{DERIVATIVES_VERSION}.{fmt}"'
+
+    def generate(self, source: Path) -> Path:
+        image_id = source.stem
+        target_dir = self.output_dir / image_id
+        target_dir.mkdir(exist_ok=True)
+        with Image.open(source) as img:
+            img.draft("RGB", (VARIANTS["full"], VARIANTS["full"]))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            for variant, max_edge in VARIANTS.items():
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=3.0)
+                for fmt in FORMATS:
+                    _save_atomic(img, self.path(image_id, variant, fmt), fmt)
+        return target_dir
+
+    # Schedules generation on the worker pool, returns immediately
+    def submit(self, source: Path):
+        image_id = source.stem
+        future = self._pending.get(image_id)
+        if future is None:
+            future = self._executor.submit(self.generate, source)
+            self._pending[image_id] = future
+            future.add_done_callback(lambda _: self._pending.pop(image_id, None))
+        return future
+
+    # Waits for a derivative, generating it on demand if it was never scheduled
+    async def ensure(self, source: Path, variant: str, fmt: str) -> Path:
+        path = self.path(source.stem, variant, fmt)
+        if not path.exists():
+            await asyncio.wrap_future(self.submit(source))
+        return path
+
+    # Drops the derivatives of an original that was deleted
+    def remove(self, image_id: str):
+        shutil.rmtree(self.output_dir / image_id, ignore_errors=True)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def negotiate_format(accept: str) -> str:
+    return "webp" if "image/webp" in (accept or "") else "jpeg"
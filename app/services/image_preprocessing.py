@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+TARGET_SIZE = (224, 224)
+
+# The classifier was trained on pixels scaled to [0, 1]
+CHANNEL_MEAN = (0.0, 0.0, 0.0)
+CHANNEL_STD = (255.0, 255.0, 255.0)
+
+
+# Decodes an uploaded image straight from memory into a (H, W, 3) uint8 array
+def decode_image(data: bytes, target_size=TARGET_SIZE) -> np.ndarray:
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying above 2x the target,
+        # a 12MP phone photo then never gets fully decoded
+        img.draft("RGB", (target_size[0] * 2, target_size[1] * 2))
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if img.size != target_size:
+        img = img.resize(target_size, Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(img, dtype=np.uint8)
+
+
+class BatchBuffer:
+    """Preallocated float32 batch that decoded images are normalized into.
+
+    Not thread-safe, keep one buffer per inference thread.
+    """
+
+    def __init__(self, capacity: int, target_size=TARGET_SIZE, mean=CHANNEL_MEAN, std=CHANNEL_STD):
+        self.target_size = target_size
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = 1.0 / np.asarray(std, dtype=np.float32)
+        self.array = self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> np.ndarray:
+        width, height = self.target_size
+        return np.empty((capacity, height, width, 3), dtype=np.float32)
+
+    def fill(self, images) -> np.ndarray:
+        if len(images) > len(self.array):
+            self.array = self._allocate(len(images))
+        for i, image in enumerate(images):
+            out = self.array[i]
+            np.subtract(image, self.mean, out=out)
+            np.multiply(out, self.scale, out=out)
+        return self.array[:len(images)]
+
+
+def top_k(probabilities: np.ndarray, k: int) -> list:
+    k = min(k, probabilities.shape[-1])
+    indices = np.argpartition(probabilities, -k)[-k:]
+    indices = indices[np.argsort(probabilities[indices])[::-1]]
+    return [(int(i), float(probabilities[i])) for i in indices]
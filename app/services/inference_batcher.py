@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class BatchStats:
+    def __init__(self, window: int = 1024):
+        self.batches = 0
+        self.items = 0
+        self.latencies = deque(maxlen=window)
+        self.fill_ratios = deque(maxlen=window)
+
+    def record(self, size: int, max_size: int, latency: float):
+        self.batches += 1
+        self.items += size
+        self.latencies.append(latency)
+        self.fill_ratios.append(size / max_size)
+
+    def snapshot(self) -> dict:
+        latencies = np.fromiter(self.latencies, dtype=np.float64) * 1000
+        fill_ratios = np.fromiter(self.fill_ratios, dtype=np.float64)
+        stats = {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "avg_fill_ratio": float(fill_ratios.mean()) if fill_ratios.size else 0.0,
+        }
+        for p in (50, 95, 99):
+            stats[f"latency_p{p}_ms"] = float(np.percentile(latencies, p)) if latencies.size else 0.0
+        return stats
+
+
+class InferenceBatcher:
+    """Collects single-image requests into batches and runs them on worker threads.
+
+    `predict_fn` receives the list of submitted items and returns one result row
+    per item, in order.
+
+    A batch is dispatched once it holds `max_batch_size` items or the oldest item
+    has waited `max_wait_ms`. At most `workers` batches run at the same time, so
+    requests arriving while every worker is busy pile up into larger batches.
+    """
+
+    def __init__(self, predict_fn, max_batch_size: int = 16, max_wait_ms: float = 10, workers: int = 1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.stats = BatchStats()
+        self._queue: asyncio.Queue | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._collector: asyncio.Task | None = None
+        self._running = set()
+
+    async def start(self):
+        if self._collector is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is None:
+            return
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        pending = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        self._fail_stopped(pending)
+        self._executor.shutdown(wait=True)
+        self._collector = None
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        if self._collector is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    def stats_snapshot(self) -> dict:
+        snapshot = self.stats.snapshot()
+        snapshot.update({
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+        })
+        return snapshot
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                await self._slots.acquire()
+                batch = [await self._queue.get()]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                task = asyncio.create_task(self._dispatch(batch))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                batch = []
+        except asyncio.CancelledError:
+            # Items already taken off the queue are not in it for stop() to fail
+            self._fail_stopped(batch)
+            raise
+
+    @staticmethod
+    def _fail_stopped(batch):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    async def _dispatch(self, batch):
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._run, items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        self.stats.record(len(batch), self.max_batch_size, time.perf_counter() - started)
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _run(self, items):
+        return self.predict_fn(items)
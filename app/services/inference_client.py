@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import logging
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Wire format on the inference server's Unix socket. A request is its header followed by
+# the decoded (height, width, 3) uint8 image, a response is its header followed by the
+# float32 class probabilities, or a UTF-8 message when status is not OK.
+REQUEST = struct.Struct("!IHH")   # request id, height, width
+RESPONSE = struct.Struct("!IBI")  # request id, status, payload length
+STATUS_OK = 0
+STATUS_ERROR = 1
+# A server that refused a connection is skipped for this long while others are up
+RETRY_DELAY = 1.0
+
+
+class InferenceUnavailable(Exception):
+    """The inference server could not be reached or did not answer in time."""
+
+
+class _Connection:
+    """One multiplexed connection, responses are matched to requests by id."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pending = {}
+        self._ids = itertools.count(1)
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._connecting = asyncio.Lock()
+        self._writing = asyncio.Lock()
+        self.retry_at = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def request(self, image: np.ndarray) -> np.ndarray:
+        if not self.connected:
+            async with self._connecting:
+                if not self.connected:
+                    await self._connect()
+        request_id = next(self._ids) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            height, width = image.shape[:2]
+            # One write per request, so concurrent requests never interleave on the socket. Waiting
+            # for the buffer to drain keeps a stalled server from piling up images in memory
+            async with self._writing:
+                self._writer.write(REQUEST.pack(request_id, height, width) + np.ascontiguousarray(image, np.uint8).tobytes())
+                try:
+                    await self._writer.drain()
+                except ConnectionError as e:
+                    raise InferenceUnavailable(f"Inference server at {self.path} went away") from e
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        self._reader_task = self._writer = None
+
+    async def _connect(self):
+        try:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        except OSError as e:
+            self.retry_at = time.monotonic() + RETRY_DELAY
+            raise InferenceUnavailable(f"Inference server at {self.path} is not reachable: {e}") from e
+        self._reader_task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                request_id, status, length = RESPONSE.unpack(await self._reader.readexactly(RESPONSE.size))
+                payload = await self._reader.readexactly(length)
+                future = self.pending.get(request_id)
+                if future is None or future.done():
+                    continue
+                if status == STATUS_OK:
+                    future.set_result(np.frombuffer(payload, dtype=np.float32))
+                else:
+                    future.set_exception(RuntimeError(payload.decode()))
+        except (asyncio.IncompleteReadError, OSError) as e:
+            logger.warning("Lost connection to inference server at %s: %s", self.path, e)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(InferenceUnavailable(f"Inference server at {self.path} went away"))
+
+
+class InferenceClient:
+    """Sends decoded images to one or more inference servers (see inference_server.py).
+
+    Same interface as InferenceBatcher, the servers do the batching. Each
+    request goes to the connection with the fewest requests in flight, a
+    lost connection is reopened by the next request.
+    """
+
+    def __init__(self, socket_paths: list, timeout: float = 30):
+        self.connections = [_Connection(path) for path in socket_paths]
+        self.timeout = timeout
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=1024)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        now = time.monotonic()
+        candidates = [c for c in self.connections if c.retry_at <= now] or self.connections
+        connection = min(candidates, key=lambda c: len(c.pending))
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(connection.request(item), self.timeout)
+        except asyncio.TimeoutError:
+            self.errors += 1
+            raise InferenceUnavailable(f"Inference server at {connection.path} did not answer in {self.timeout}s")
+        except InferenceUnavailable:
+            self.errors += 1
+            raise
+        self.requests += 1
+        self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def stats_snapshot(self) -> dict:
+        latencies = np.fromiter(self.latencies, dtype=np.float64) * 1000
+        snapshot = {
+            "mode": "remote",
+            "requests": self.requests,
+            "errors": self.errors,
+            "servers": [
+                {"socket": c.path, "connected": c.connected, "in_flight": len(c.pending)} for c in self.connections
+            ],
+        }
+        for p in (50, 95, 99):
+            snapshot[f"latency_p{p}_ms"] = float(np.percentile(latencies, p)) if latencies.size else 0.0
+        return snapshot
@@ -0,0 +1,149 @@
+"""Dedicated disease detection inference process.
+
+API workers running with INFERENCE_MODE=remote send decoded images here over a
+Unix socket instead of loading the model themselves, so the model is held in
+memory once however many workers there are, and inference never competes with
+request handling. Requests from all workers are batched together. Run from the
+app directory, one process per socket in INFERENCE_SOCKETS:
+
+    python -m services.inference_server --socket data/inference.sock
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+from pathlib import Path
+
+import numpy as np
+
+from config import INFERENCE_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_WORKERS, INFERENCE_SOCKETS, LOG_LEVEL
+from services.diseases_detection import predict_batch, runtime
+from services.image_preprocessing import TARGET_SIZE
+from services.inference_batcher import InferenceBatcher
+from services.inference_client import REQUEST, RESPONSE, STATUS_ERROR, STATUS_OK
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceServer:
+    def __init__(self, path: Path, batcher: InferenceBatcher):
+        self.path = Path(path)
+        self.batcher = batcher
+        self._server = None
+        self._connections = {}
+        self._answers = set()
+
+    async def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            if _accepts_connections(self.path):
+                raise RuntimeError(f"Another inference server is already listening on {self.path}")
+            # Left behind by a server that was killed
+            self.path.unlink()
+        await self.batcher.start()
+        self._server = await asyncio.start_unix_server(self._handle, str(self.path))
+
+    async def stop(self, timeout: float = 10):
+        # Stop accepting, let requests already received finish, then hang up
+        self._server.close()
+        if self._answers:
+            await asyncio.wait(self._answers, timeout=timeout)
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.batcher.stop()
+        self.path.unlink(missing_ok=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handler = asyncio.current_task()
+        self._connections[handler] = writer
+        answers = set()
+        writing = asyncio.Lock()
+        try:
+            while True:
+                request_id, height, width = REQUEST.unpack(await reader.readexactly(REQUEST.size))
+                if (height, width) != TARGET_SIZE:
+                    # Rejected before its pixels are read, the header alone could ask for gigabytes.
+                    # Without reading them the stream is out of step, so the connection is closed
+                    message = f"ValueError: Expected a {TARGET_SIZE} image, got {(height, width)}".encode()
+                    await self._reply(writer, writing, request_id, STATUS_ERROR, message)
+                    logger.warning("Closing a connection that sent a %dx%d image", height, width)
+                    break
+                data = await reader.readexactly(height * width * 3)
+                image = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                # Answered as they complete, a slow batch does not hold up the connection
+                task = asyncio.create_task(self._answer(writer, writing, request_id, image))
+                answers.add(task)
+                self._answers.add(task)
+                task.add_done_callback(answers.discard)
+                task.add_done_callback(self._answers.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in answers:
+                task.cancel()
+            writer.close()
+            self._connections.pop(handler, None)
+
+    async def _answer(self, writer: asyncio.StreamWriter, writing: asyncio.Lock, request_id: int, image: np.ndarray):
+        try:
+            payload = np.asarray(await self.batcher.submit(image), dtype=np.float32).tobytes()
+            status = STATUS_OK
+        except Exception as e:
+            logger.exception("Inference failed")
+            payload = f"{e.__class__.__name__}: {e}".encode()
+            status = STATUS_ERROR
+        await self._reply(writer, writing, request_id, status, payload)
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, writing: asyncio.Lock, request_id: int, status: int, payload: bytes):
+        # Drained under the connection's lock, so a client that stops reading holds up its own answers only
+        async with writing:
+            if writer.is_closing():
+                return
+            writer.write(RESPONSE.pack(request_id, status, len(payload)) + payload)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+
+def _accepts_connections(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+async def serve(path: Path):
+    # Loaded before the socket exists, so workers never wait on a cold model
+    runtime.warm_up()
+    server = InferenceServer(path, InferenceBatcher(
+        predict_batch,
+        max_batch_size=INFERENCE_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        workers=INFERENCE_WORKERS,
+    ))
+    await server.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    logger.info("Serving %s inference on %s", runtime.backend_name, path)
+    await stopping.wait()
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", type=Path, default=Path(INFERENCE_SOCKETS[0]))
+    args = parser.parse_args()
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(serve(args.socket))
+
+
+if __name__ == "__main__":
+    main()
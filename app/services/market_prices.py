@@ -0,0 +1,170 @@
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from models import CommodityPrice
+from scrappers.price_listing_scraping import PriceTable, Validators, fetch_prices_html, parse_prices
+
+NEPAL_TZ = timezone(timedelta(hours=5, minutes=45))
+ROLLING_WINDOWS = (7, 30)
+
+
+def nepal_today() -> date:
+    return datetime.now(NEPAL_TZ).date()
+
+
+def market_day(table: PriceTable, today: date) -> Optional[date]:
+    """The date of the table's prices, None when its title names no weekday.
+
+    The title gives the date in Bikram Sambat, its weekday is enough: the page
+    shows the latest market day, the last date up to today on that weekday.
+    Right for any table less than a week old, e.g. yesterday's still shown
+    after midnight.
+    """
+    weekday = table.weekday
+    if weekday is None:
+        return None
+    return today - timedelta(days=(today.weekday() - weekday) % 7)
+
+
+# Inserts or refreshes a whole day of prices in a single multi-row statement
+def upsert_prices(engine: Engine, rows, price_date: date) -> int:
+    now = datetime.now(timezone.utc)
+    values = [
+        {
+            "commodity": row.commodity,
+            "unit": row.unit,
+            "price_date": price_date,
+            "min_price": row.min_price,
+            "max_price": row.max_price,
+            "avg_price": row.avg_price,
+            "updated_at": now,
+        }
+        for row in rows
+        if row.avg_price is not None
+    ]
+    if not values:
+        return 0
+
+    table = CommodityPrice.__table__
+    updated = ("min_price", "max_price", "avg_price", "updated_at")
+    if engine.dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(values)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in updated})
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=["commodity", "unit", "price_date"],
+            set_={column: statement.excluded[column] for column in updated},
+        )
+    with engine.begin() as connection:
+        connection.execute(statement)
+    return len(values)
+
+
+class PriceSnapshot:
+    """Read-only view of recent prices, rebuilt after every ingest and swapped in whole.
+
+    Series are keyed by (commodity, unit): the same commodity can be quoted
+    per kg and per piece, and those prices must not be mixed.
+    """
+
+    def __init__(self, history: dict = None, refreshed_at: datetime = None):
+        self.history = history or {}
+        self.refreshed_at = refreshed_at
+        self.latest = {key: entries[-1] for key, entries in self.history.items()}
+        self.latest_date = max((entry["date"] for entry in self.latest.values()), default=None)
+        self.rolling = {window: self._rolling_averages(window) for window in ROLLING_WINDOWS}
+
+    @classmethod
+    def load(cls, engine: Engine, days: int) -> "PriceSnapshot":
+        since = nepal_today() - timedelta(days=days)
+        history = defaultdict(list)
+        with Session(engine) as session:
+            rows = session.exec(
+                select(CommodityPrice)
+                .where(CommodityPrice.price_date >= since)
+                .order_by(CommodityPrice.commodity, CommodityPrice.unit, CommodityPrice.price_date)
+            )
+            for row in rows:
+                history[(row.commodity, row.unit)].append({
+                    "date": row.price_date,
+                    "unit": row.unit,
+                    "min_price": row.min_price,
+                    "max_price": row.max_price,
+                    "avg_price": row.avg_price,
+                })
+        return cls(dict(history), datetime.now(timezone.utc))
+
+    def units(self, commodity: str) -> list:
+        return [unit for name, unit in self.history if name == commodity]
+
+    def _rolling_averages(self, window: int) -> dict:
+        averages = {}
+        for key, entries in self.history.items():
+            since = entries[-1]["date"] - timedelta(days=window - 1)
+            recent = [entry["avg_price"] for entry in entries if entry["date"] >= since]
+            averages[key] = round(sum(recent) / len(recent), 2)
+        return averages
+
+
+class PriceIngestor:
+    """Periodically pulls the Kalimati daily price table into the price history table."""
+
+    def __init__(self, engine: Engine, interval: float, history_days: int, timeout: float = 30):
+        self.engine = engine
+        self.interval = interval
+        self.history_days = history_days
+        self.timeout = timeout
+        self.snapshot = PriceSnapshot()
+        self.validators = Validators()
+        self.last_run = None
+        self.last_status = None
+        self._task = None
+
+    async def refresh_snapshot(self):
+        self.snapshot = await run_in_threadpool(PriceSnapshot.load, self.engine, self.history_days)
+
+    async def ingest_once(self, client: httpx.AsyncClient) -> int:
+        html, self.validators = await fetch_prices_html(client, self.validators)
+        self.last_run = datetime.now(timezone.utc)
+        if html is None:
+            self.last_status = "not-modified"
+            return 0
+        table = await run_in_threadpool(parse_prices, html)
+        price_date = market_day(table, nepal_today())
+        if price_date is None:
+            # Better no prices than prices stored under the wrong day
+            self.last_status = f"skipped: no weekday in title {table.title!r}"
+            return 0
+        count = await run_in_threadpool(upsert_prices, self.engine, table.rows, price_date)
+        await self.refresh_snapshot()
+        self.last_status = f"ingested {count} rows for {price_date}"
+        return count
+
+    async def run_forever(self):
+        async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+            while True:
+                try:
+                    await self.ingest_once(client)
+                except Exception as e:
+                    self.last_status = f"failed: {e}"
+                await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
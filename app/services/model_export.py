@@ -0,0 +1,45 @@
+"""Convert the Keras disease classifier to a quantized TFLite model.
+
+Run from the app directory:
+
+    python -m services.model_export --quantize dynamic
+"""
+import argparse
+from pathlib import Path
+
+from services.model_runtime import KERAS_MODEL_PATH, TFLITE_MODEL_PATH
+
+QUANTIZATION_MODES = ("none", "dynamic", "float16")
+
+
+def convert_to_tflite(source: Path, output: Path, quantize: str = "dynamic") -> Path:
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(source)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ("dynamic", "float16"):
+        # Dynamic range quantization stores weights as int8, float16 halves them
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_bytes(converter.convert())
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", type=Path, default=KERAS_MODEL_PATH)
+    parser.add_argument("--output", type=Path, default=TFLITE_MODEL_PATH)
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="dynamic")
+    args = parser.parse_args(argv)
+
+    output = convert_to_tflite(args.source, args.output, args.quantize)
+    source_mb = args.source.stat().st_size / 1e6
+    output_mb = output.stat().st_size / 1e6
+    print(f"Wrote {output} ({output_mb:.1f} MB, source {source_mb:.1f} MB, quantize={args.quantize})")
+
+
+if __name__ == "__main__":
+    main()
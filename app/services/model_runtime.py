@@ -0,0 +1,142 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+
+working_dir = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = Path(working_dir).parent / "trained_models"
+KERAS_MODEL_PATH = MODELS_DIR / "plant_disease_prediction_model.keras"
+TFLITE_MODEL_PATH = MODELS_DIR / "plant_disease_prediction_model.tflite"
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+class ModelBackend(ABC):
+    """Loads a classifier and runs (N, 224, 224, 3) float32 batches through it."""
+
+    name = "base"
+
+    def __init__(self, model_path: Path):
+        self.model_path = Path(model_path)
+
+    @abstractmethod
+    def load(self):
+        """Reads the model from `model_path`, called once before the first prediction."""
+
+    @abstractmethod
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Class probabilities, one row per image in the batch."""
+
+    @property
+    def version(self) -> str:
+        stat = self.model_path.stat()
+        return f"{self.name}:{self.model_path.name}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+class KerasBackend(ModelBackend):
+    name = "keras"
+
+    def load(self):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(self.model_path)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend(ModelBackend):
+    """Runs the converted, weight-quantized model through the TFLite interpreter.
+
+    Uses the standalone `tflite_runtime` package when installed so the worker
+    never has to import TensorFlow itself.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path: Path, num_threads: int = None):
+        super().__init__(model_path)
+        self.num_threads = num_threads or os.cpu_count()
+
+    def load(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=str(self.model_path), num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self._input_index = self.interpreter.get_input_details()[0]["index"]
+        self._output_index = self.interpreter.get_output_details()[0]["index"]
+        self._batch_size = 1
+        # An interpreter instance is not safe to invoke from several threads
+        self._lock = threading.Lock()
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input_index, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input_index, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output_index).copy()
+
+
+BACKENDS = {
+    "keras": (KerasBackend, KERAS_MODEL_PATH),
+    "tflite": (TFLiteBackend, TFLITE_MODEL_PATH),
+}
+
+
+def create_backend(name: str, model_path: Path = None) -> ModelBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{name}', expected one of {sorted(BACKENDS)}")
+    backend_cls, default_path = BACKENDS[name]
+    return backend_cls(model_path or default_path)
+
+
+class ModelRuntime:
+    """Defers loading the model until the first prediction or an explicit warm-up."""
+
+    def __init__(self, backend_name: str, model_path: Path = None):
+        self.backend_name = backend_name
+        self.model_path = model_path
+        self._backend = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+        self._version = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    def get(self) -> ModelBackend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    backend = create_backend(self.backend_name, self.model_path)
+                    backend.load()
+                    self._backend = backend
+        return self._backend
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.get().predict(batch)
+
+    def warm_up(self):
+        # The first call also triggers graph tracing, pay for it before real traffic does
+        self.predict(np.zeros((1, *INPUT_SHAPE), dtype=np.float32))
+
+    def warm_up_in_background(self) -> threading.Thread:
+        if self._warmup_thread is None:
+            self._warmup_thread = threading.Thread(target=self.warm_up, name="model-warmup", daemon=True)
+            self._warmup_thread.start()
+        return self._warmup_thread
+
+    @property
+    def version(self) -> str:
+        # Only needs the model file, so this does not force a load
+        if self._version is None:
+            self._version = (self._backend or create_backend(self.backend_name, self.model_path)).version
+        return self._version
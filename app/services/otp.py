@@ -0,0 +1,364 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, delete, or_, select, update
+from sqlalchemy.engine import Engine
+
+from models import VerifyOtp
+from services.sms import SmsGateway
+
+logger = logging.getLogger(__name__)
+
+
+class OtpError(Exception):
+    status_code = 400
+
+    def __init__(self, detail: str, retry_after: float = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class OtpInvalid(OtpError):
+    pass
+
+
+class OtpRateLimited(OtpError):
+    status_code = 429
+
+
+class OtpLocked(OtpError):
+    status_code = 429
+
+
+def generate_code(digits: int = 6) -> str:
+    return f"{secrets.randbelow(10 ** digits):0{digits}d}"
+
+
+# Times are epoch seconds, converted at the database boundary
+@dataclass
+class OtpEntry:
+    code: str
+    expires_at: float
+    attempts: int = 0
+    locked_until: Optional[float] = None
+
+
+class OtpStore(ABC):
+    """Where issued codes live until they are used or expire."""
+
+    # Blocking stores are called from the threadpool
+    blocking = False
+
+    @abstractmethod
+    def issue(self, phone: str, code: str, expires_at: float):
+        """Replaces the phone's code and resets its attempts, an active lock is kept."""
+
+    @abstractmethod
+    def get(self, phone: str) -> Optional[OtpEntry]:
+        """A copy of the phone's entry, or None."""
+
+    @abstractmethod
+    def record_failure(self, phone: str, max_attempts: int, lock_until: float):
+        """Counts one failed attempt, locking the phone when it reaches max_attempts."""
+
+    @abstractmethod
+    def delete(self, phone: str):
+        """Drops the phone's entry once its code was used."""
+
+    @abstractmethod
+    def purge(self, now: float) -> int:
+        """Deletes entries that expired and are not locked, returns how many."""
+
+
+class MemoryOtpStore(OtpStore):
+    """Per-process TTL map, only correct when a single worker serves the API."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def issue(self, phone: str, code: str, expires_at: float):
+        with self._lock:
+            previous = self._entries.get(phone)
+            locked_until = previous.locked_until if previous else None
+            self._entries[phone] = OtpEntry(code, max(expires_at, locked_until or 0), 0, locked_until)
+
+    def get(self, phone: str) -> Optional[OtpEntry]:
+        entry = self._entries.get(phone)
+        return OtpEntry(entry.code, entry.expires_at, entry.attempts, entry.locked_until) if entry else None
+
+    def record_failure(self, phone: str, max_attempts: int, lock_until: float):
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None:
+                return
+            entry.attempts += 1
+            if entry.attempts >= max_attempts:
+                entry.locked_until = lock_until
+                entry.expires_at = max(entry.expires_at, lock_until)
+
+    def delete(self, phone: str):
+        with self._lock:
+            self._entries.pop(phone, None)
+
+    def purge(self, now: float) -> int:
+        with self._lock:
+            expired = [phone for phone, entry in self._entries.items()
+                       if entry.expires_at < now and (entry.locked_until or 0) < now]
+            for phone in expired:
+                del self._entries[phone]
+        return len(expired)
+
+
+def _to_datetime(timestamp: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+
+def _to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    # MySQL and SQLite hand back naive UTC
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class DatabaseOtpStore(OtpStore):
+    """The VerifyOtp table, shared by every worker. Each operation is a single statement."""
+
+    blocking = True
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.table = VerifyOtp.__table__
+
+    def issue(self, phone: str, code: str, expires_at: float):
+        values = {"phone": phone, "otp_code": code, "otp_expires_at": _to_datetime(expires_at), "attempts": 0}
+        if self.engine.dialect.name == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(self.table).values(values)
+            statement = statement.on_duplicate_key_update(
+                otp_code=statement.inserted.otp_code,
+                otp_expires_at=statement.inserted.otp_expires_at,
+                attempts=0,
+            )
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            statement = insert(self.table).values(values)
+            statement = statement.on_conflict_do_update(
+                index_elements=["phone"],
+                set_={"otp_code": statement.excluded.otp_code, "otp_expires_at": statement.excluded.otp_expires_at,
+                      "attempts": 0},
+            )
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+
+    def get(self, phone: str) -> Optional[OtpEntry]:
+        table = self.table
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select(table.c.otp_code, table.c.otp_expires_at, table.c.attempts, table.c.locked_until)
+                .where(table.c.phone == phone)
+            ).first()
+        if row is None:
+            return None
+        return OtpEntry(row.otp_code, _to_timestamp(row.otp_expires_at), row.attempts or 0,
+                        _to_timestamp(row.locked_until))
+
+    def record_failure(self, phone: str, max_attempts: int, lock_until: float):
+        table = self.table
+        lock_until = _to_datetime(lock_until)
+        # locked_until is assigned first so it sees the old attempts on MySQL too,
+        # which evaluates SET assignments left to right
+        statement = (
+            update(table)
+            .where(table.c.phone == phone)
+            .ordered_values(
+                (table.c.locked_until, case((table.c.attempts + 1 >= max_attempts, lock_until),
+                                            else_=table.c.locked_until)),
+                (table.c.otp_expires_at, case((table.c.attempts + 1 >= max_attempts, lock_until),
+                                              else_=table.c.otp_expires_at)),
+                (table.c.attempts, table.c.attempts + 1),
+            )
+        )
+        with self.engine.begin() as connection:
+            connection.execute(statement)
+
+    def delete(self, phone: str):
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.phone == phone))
+
+    def purge(self, now: float) -> int:
+        table = self.table
+        now = _to_datetime(now)
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                delete(table).where(
+                    table.c.otp_expires_at < now,
+                    or_(table.c.locked_until.is_(None), table.c.locked_until < now),
+                )
+            )
+        return result.rowcount
+
+
+def create_store(name: str, engine: Engine = None) -> OtpStore:
+    if name == "memory":
+        return MemoryOtpStore()
+    if name == "database":
+        return DatabaseOtpStore(engine)
+    raise ValueError(f"Unknown OTP store '{name}'")
+
+
+class TokenBuckets:
+    """Per-key token buckets holding up to `capacity` tokens, one added every `refill_seconds`.
+
+    Keys are kept in LRU order and the least recently used are dropped past
+    `max_keys`, so a flood of distinct keys cannot grow memory without bound.
+    """
+
+    def __init__(self, capacity: int, refill_seconds: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Takes a token, returns 0 when allowed or the seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) / self.refill_seconds)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                return (1 - tokens) * self.refill_seconds
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0
+
+
+class OtpService:
+    """Issues and verifies one-time codes.
+
+    Requests are throttled per phone and per client address before anything
+    reaches the store or the SMS outbox. A phone is locked for `lockout`
+    seconds after `max_attempts` wrong codes, and expired codes are purged by
+    a background sweeper.
+    """
+
+    def __init__(self, store: OtpStore, sms: SmsGateway, phone_limiter: TokenBuckets, ip_limiter: TokenBuckets,
+                 code_ttl: float = 300, max_attempts: int = 5, lockout: float = 900,
+                 sweep_interval: float = 600):
+        self.store = store
+        self.sms = sms
+        self.phone_limiter = phone_limiter
+        self.ip_limiter = ip_limiter
+        self.code_ttl = code_ttl
+        self.max_attempts = max_attempts
+        self.lockout = lockout
+        self.sweep_interval = sweep_interval
+        # Locks seen by this process, so a locked phone gets no SMS without a store lookup
+        self._locked = {}
+        self._sweeper = None
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self.purged = 0
+
+    async def request_code(self, phone: str, client: str) -> str:
+        self._throttle(client, phone)
+        locked_until = self._locked.get(phone, 0)
+        if locked_until > time.time():
+            self.rejected += 1
+            raise OtpLocked("Too many wrong codes, try again later", locked_until - time.time())
+
+        code = generate_code()
+        await self._call(self.store.issue, phone, code, time.time() + self.code_ttl)
+        await self.sms.enqueue(phone, f"Here is your otp: {code}")
+        self.issued += 1
+        return code
+
+    def throttle_verify(self, client: str):
+        self._throttle(client)
+
+    # Blocking with a database store, call it from the threadpool
+    def verify(self, phone: str, code: str):
+        now = time.time()
+        entry = self.store.get(phone)
+        if entry is not None and entry.locked_until and entry.locked_until > now:
+            self.rejected += 1
+            raise OtpLocked("Too many wrong codes, try again later", entry.locked_until - now)
+        if entry is None:
+            raise OtpInvalid("Invalid OTP")
+        if entry.expires_at < now:
+            raise OtpInvalid("OTP expired")
+        if hmac.compare_digest(entry.code, code):
+            self.store.delete(phone)
+            self.verified += 1
+            return
+
+        self.store.record_failure(phone, self.max_attempts, now + self.lockout)
+        if entry.attempts + 1 >= self.max_attempts:
+            self._locked[phone] = now + self.lockout
+            raise OtpLocked("Too many wrong codes, try again later", self.lockout)
+        raise OtpInvalid("Invalid OTP")
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def sweep(self) -> int:
+        now = time.time()
+        purged = await self._call(self.store.purge, now)
+        self._locked = {phone: until for phone, until in self._locked.items() if until > now}
+        self.purged += purged
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            "store": type(self.store).__name__,
+            "issued": self.issued,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "purged": self.purged,
+            "locked_phones": len(self._locked),
+            "sms": self.sms.stats(),
+        }
+
+    def _throttle(self, client: str, phone: str = None):
+        # The client bucket is checked first so one address cannot drain other people's phone buckets
+        wait = self.ip_limiter.take(client) or (self.phone_limiter.take(phone) if phone else 0)
+        if wait:
+            self.rejected += 1
+            raise OtpRateLimited("Too many OTP requests, slow down", wait)
+
+    async def _call(self, fn, *args):
+        return await run_in_threadpool(fn, *args) if self.store.blocking else fn(*args)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                purged = await self.sweep()
+                if purged:
+                    logger.info("Purged %d expired OTP codes", purged)
+            except Exception:
+                logger.exception("OTP sweep failed")
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from fastapi.concurrency import run_in_threadpool
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """Two-tier cache of prediction results keyed by content hash and model version.
+
+    The memory tier is an LRU bounded by entry count and TTL. The optional disk
+    tier keeps one JSON file per key so results survive restarts. Concurrent
+    lookups of a key that is still being computed wait for that computation
+    instead of starting their own. The memory tier is locked, since it is used
+    both from the event loop and from threadpool handlers.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 3600, disk_dir: Path = None):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(data: bytes, model_version: str) -> str:
+        return f"{content_hash(model_version.encode())[:16]}-{content_hash(data)}"
+
+    # Memory-tier lookup that never starts a computation
+    def get(self, key: str):
+        value = self._get_memory(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        self._set_memory(key, value)
+
+    # For callers that pair `get` and `put` around their own computation instead of `get_or_compute`
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            self._disk_path(key).unlink(missing_ok=True)
+
+    async def get_or_compute(self, key: str, compute):
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Owned by the cache rather than the first caller, so a caller that is cancelled
+            # (a client going away) does not cancel the result the others are waiting for
+            task = asyncio.create_task(self._compute(key, compute))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str, compute):
+        value = await run_in_threadpool(self._read_disk, key) if self.disk_dir else None
+        if value is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            value = await compute()
+            if self.disk_dir:
+                await run_in_threadpool(self._write_disk, key, value)
+        self._set_memory(key, value)
+        return value
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every caller was cancelled before it was raised
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+    def _get_memory(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set_memory(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[-2:] / f"{key}.json"
+
+    def _read_disk(self, key: str):
+        path = self._disk_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, value):
+        path = self._disk_path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(value))
+        os.replace(tmp_path, path)
@@ -0,0 +1,235 @@
+import csv
+import io
+import json
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlmodel import Session, select
+
+from models import Products
+from schemas import ProductCreate
+from services.product_rollups import RollupDelta, apply as apply_rollups
+from services.storage import adjust_references, blob_id
+
+EXPORT_COLUMNS = ("id", "title", "description", "price", "category", "image", "created_at", "updated_at")
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def detect_format(filename: str = None, content_type: str = None) -> str:
+    name = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    return "csv"
+
+
+INVALID_UTF8 = "Not valid UTF-8"
+
+
+def _valid_text(*values) -> bool:
+    # Undecodable bytes come through surrogateescape as lone surrogates, which do not encode back
+    try:
+        for value in values:
+            if isinstance(value, str):
+                value.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+# Yields (line number, raw row or None, parse error or None) without reading the whole file. Bytes
+# that are not UTF-8 and malformed CSV fail the rows they are in, not the import
+def read_rows(stream, fmt: str):
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="surrogateescape", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            while True:
+                # Where the record starts, line_num is not advanced past a line that fails to parse
+                start = reader.line_num + 1
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    break
+                except csv.Error as e:
+                    # The reader has consumed the bad line and carries on with the next one
+                    yield start, None, f"Invalid CSV: {e}"
+                    continue
+                if not _valid_text(*row.keys(), *row.values()):
+                    yield reader.line_num, None, INVALID_UTF8
+                    continue
+                # Blank cells are treated as missing so optional columns fall back to their defaults
+                yield reader.line_num, {k: v for k, v in row.items() if k and v not in ("", None)}, None
+        else:
+            for number, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                if not _valid_text(line):
+                    yield number, None, INVALID_UTF8
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, None, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(row, dict):
+                    yield number, None, "Expected a JSON object"
+                    continue
+                yield number, row, None
+    finally:
+        # Leave the upload's file open for FastAPI to clean up
+        text.detach()
+
+
+def _error_messages(e: ValidationError) -> list:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+
+
+class ImportReport:
+    def __init__(self, import_id: str, created_at: datetime, max_errors: int):
+        self.import_id = import_id
+        self.created_at = created_at
+        self.max_errors = max_errors
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line: int, messages: list):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": messages})
+
+    def to_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def import_products(engine: Engine, farmer_id: int, stream, fmt: str, chunk_size: int = 1000,
+                    max_rows: int = 100000, max_errors: int = 1000, location: Optional[dict] = None) -> ImportReport:
+    """Validates rows against ProductCreate and inserts them in chunks, one transaction per chunk.
+
+    A chunk with rows that the database rejects is split in halves and
+    retried until only those rows fail. Database errors do not stop the
+    import. `location` holds the farmer's coordinate columns, which every
+    imported product takes.
+    """
+    # Every row is tagged with the import's id, so they can be read back for the search index
+    import_id = uuid.uuid4().hex
+    created_at = datetime.now(timezone.utc)
+    report = ImportReport(import_id, created_at, max_errors)
+    chunk = []
+
+    def write(entries):
+        rows = [values for _, values in entries]
+        # A Core insert, the session events that keep the rollups and image refcounts current do not see it
+        delta = RollupDelta()
+        for values in rows:
+            delta.add(values["farmer_id"], values["category"], values["price"], values["created_at"])
+        images = Counter(blob_id(values["image"]) for values in rows)
+        try:
+            with engine.begin() as connection:
+                # Compiled to multi-row INSERTs by SQLAlchemy's insertmanyvalues
+                connection.execute(insert(Products), rows)
+                apply_rollups(connection, delta)
+                adjust_references(connection, images)
+        except (IntegrityError, DataError) as e:
+            if len(entries) == 1:
+                report.fail(entries[0][0], [f"Database error: {e.__class__.__name__}"])
+                return
+            # Halves until the rejected rows are on their own, the rest of the chunk still goes in
+            middle = len(entries) // 2
+            write(entries[:middle])
+            write(entries[middle:])
+        except Exception as e:
+            # Not down to a row, e.g. a lost connection, retrying the halves would only fail again
+            for line, _ in entries:
+                report.fail(line, [f"Database error: {e.__class__.__name__}"])
+        else:
+            report.imported += len(entries)
+
+    def flush():
+        write(chunk)
+        chunk.clear()
+
+    rows = 0
+    for line, row, error in read_rows(stream, fmt):
+        rows += 1
+        if rows > max_rows:
+            report.fail(line, [f"Import is limited to {max_rows} rows"])
+            break
+        if error:
+            report.fail(line, [error])
+            continue
+        try:
+            product = ProductCreate.model_validate(row)
+        except ValidationError as e:
+            report.fail(line, _error_messages(e))
+            continue
+        chunk.append((line, {
+            "title": product.title,
+            "description": product.description,
+            "price": product.price,
+            "category": product.category,
+            "image": product.image or "",
+            "farmer_id": farmer_id,
+            "created_at": created_at,
+            "import_id": import_id,
+            **(location or {}),
+        }))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return report
+
+
+# The rows of one import, read back in primary key batches for the search index
+def imported_rows(engine: Engine, import_id: str):
+    with Session(engine) as session:
+        yield from session.exec(
+            select(Products.id, Products.title, Products.description, Products.category)
+            .where(Products.import_id == import_id)
+            .execution_options(yield_per=5000)
+        )
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_products(engine: Engine, farmer_id: int, fmt: str, batch_size: int = 1000):
+    """Streams a farmer's catalogue in `batch_size` row pieces through a server-side cursor."""
+    columns = [getattr(Products, name) for name in EXPORT_COLUMNS]
+    with Session(engine) as session:
+        result = session.exec(
+            select(*columns)
+            .where(Products.farmer_id == farmer_id)
+            .order_by(Products.id)
+            .execution_options(stream_results=True, yield_per=batch_size)
+        )
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            for partition in result.partitions():
+                writer.writerows([_format_value(value) for value in row] for row in partition)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for partition in result.partitions():
+                yield "".join(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, map(_format_value, row))), ensure_ascii=False) + "\n"
+                    for row in partition
+                )
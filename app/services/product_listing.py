@@ -0,0 +1,95 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+from models import Products
+
+SORTS = {
+    "-created_at": (Products.created_at, True),
+    "created_at": (Products.created_at, False),
+    "-price": (Products.price, True),
+    "price": (Products.price, False),
+}
+
+# Columns returned by the listing, description is left out
+SUMMARY_COLUMNS = (
+    Products.id,
+    Products.title,
+    Products.price,
+    Products.category,
+    Products.image,
+    Products.farmer_id,
+    Products.created_at,
+)
+
+
+def encode_cursor(sort: str, value, last_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, last_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, last_id = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError("cursor was issued for a different sort")
+        if sort.endswith("created_at"):
+            value = datetime.fromisoformat(value)
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# Keyset pagination: each page continues strictly after the (sort value, id) of the previous one,
+# so deep pages cost the same as the first one instead of scanning OFFSET rows
+def list_products(
+    session: Session,
+    category: Optional[str] = None,
+    farmer_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: str = "-created_at",
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> dict:
+    sort_column, descending = SORTS[sort]
+    statement = select(*SUMMARY_COLUMNS)
+
+    if category is not None:
+        statement = statement.where(Products.category == category)
+    if farmer_id is not None:
+        statement = statement.where(Products.farmer_id == farmer_id)
+    if min_price is not None:
+        statement = statement.where(Products.price >= min_price)
+    if max_price is not None:
+        statement = statement.where(Products.price <= max_price)
+
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        if descending:
+            after = or_(sort_column < value, and_(sort_column == value, Products.id < last_id))
+        else:
+            after = or_(sort_column > value, and_(sort_column == value, Products.id > last_id))
+        statement = statement.where(after)
+
+    if descending:
+        statement = statement.order_by(sort_column.desc(), Products.id.desc())
+    else:
+        statement = statement.order_by(sort_column.asc(), Products.id.asc())
+
+    rows = session.exec(statement.limit(limit + 1)).all()
+    items = [dict(row._mapping) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(sort, last[sort.lstrip("-")], last["id"])
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,366 @@
+"""Product aggregates kept current as products are written, for dashboards.
+
+ProductStats holds the count, price sum, min and max of every (farmer, category)
+and of every category market-wide, FarmerDailyListings the listings a farmer
+created per day. Both are updated in the transaction that writes the products:
+ORM writes through the session flush events below, Core bulk inserts by calling
+`apply` themselves. Reads are a primary key range scan of the rollups instead
+of a GROUP BY over products.
+
+Writes these miss (raw SQL, an attribute set while it was not loaded) are
+corrected by `reconcile`, which RollupReconciler runs periodically.
+"""
+import asyncio
+import logging
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, event, func, inspect, literal, select, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from models import FarmerDailyListings, ProductStats, Products
+from services.market_prices import NEPAL_TZ, nepal_today
+
+logger = logging.getLogger(__name__)
+
+# farmer_id of the market-wide rows
+MARKET = 0
+# Columns the rollups are computed from, a product update touching none of them changes nothing
+TRACKED = ("farmer_id", "category", "price", "created_at")
+SESSION_KEY = "product_rollups"
+
+
+def listing_day(created_at: datetime) -> date:
+    # SQLite gives timestamps back naive, they are stored in UTC
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(NEPAL_TZ).date()
+
+
+@dataclass
+class _Change:
+    count: int = 0
+    price_sum: float = 0.0
+    added_min: Optional[float] = None
+    added_max: Optional[float] = None
+    removed_min: Optional[float] = None
+    removed_max: Optional[float] = None
+
+
+class RollupDelta:
+    """What a set of product writes adds to and removes from the rollups."""
+
+    def __init__(self):
+        self.stats = defaultdict(_Change)
+        self.days = defaultdict(int)
+
+    def __bool__(self) -> bool:
+        return bool(self.stats or self.days)
+
+    def add(self, farmer_id: int, category: str, price: float, created_at: datetime, sign: int = 1):
+        self.days[(farmer_id, listing_day(created_at))] += sign
+        for key in ((farmer_id, category), (MARKET, category)):
+            change = self.stats[key]
+            change.count += sign
+            change.price_sum += sign * price
+            if sign > 0:
+                change.added_min = price if change.added_min is None else min(change.added_min, price)
+                change.added_max = price if change.added_max is None else max(change.added_max, price)
+            else:
+                change.removed_min = price if change.removed_min is None else min(change.removed_min, price)
+                change.removed_max = price if change.removed_max is None else max(change.removed_max, price)
+
+
+def _bound(dialect: str, fn: str, current, added):
+    # Two-argument min()/max() in SQLite, LEAST()/GREATEST() in MySQL, both NULL if either side is
+    name = {"min": "least", "max": "greatest"}[fn] if dialect == "mysql" else fn
+    return getattr(func, name)(func.coalesce(current, added), func.coalesce(added, current))
+
+
+def _add_stats(new, dialect: str) -> dict:
+    stats = ProductStats.__table__
+    return {
+        "product_count": stats.c.product_count + new.product_count,
+        "price_sum": stats.c.price_sum + new.price_sum,
+        "price_min": _bound(dialect, "min", stats.c.price_min, new.price_min),
+        "price_max": _bound(dialect, "max", stats.c.price_max, new.price_max),
+    }
+
+
+def _add_days(new, dialect: str) -> dict:
+    return {"product_count": FarmerDailyListings.__table__.c.product_count + new.product_count}
+
+
+def _replace_stats(new, dialect: str) -> dict:
+    return {name: getattr(new, name) for name in ("product_count", "price_sum", "price_min", "price_max")}
+
+
+def _replace_days(new, dialect: str) -> dict:
+    return {"product_count": new.product_count}
+
+
+UPSERTS = {
+    "add_stats": (ProductStats.__table__, ["farmer_id", "category"], _add_stats),
+    "add_days": (FarmerDailyListings.__table__, ["farmer_id", "day"], _add_days),
+    "replace_stats": (ProductStats.__table__, ["farmer_id", "category"], _replace_stats),
+    "replace_days": (FarmerDailyListings.__table__, ["farmer_id", "day"], _replace_days),
+}
+_upsert_statements = {}
+
+
+def _upsert(connection: Connection, name: str, rows: list):
+    """Inserts `rows`, a row whose key exists is updated with UPSERTS[name]'s assignments."""
+    dialect = connection.dialect.name
+    statement = _upsert_statements.get((name, dialect))
+    if statement is None:
+        # Built once, constructing the statement costs more than running it
+        table, keys, assignments = UPSERTS[name]
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(table)
+            statement = statement.on_duplicate_key_update(assignments(statement.inserted, dialect))
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=keys, set_=assignments(statement.excluded, dialect),
+            )
+        _upsert_statements[(name, dialect)] = statement
+    # Rows as executemany parameters, so one compiled statement serves any number of them
+    connection.execute(statement, rows)
+
+
+def _group_prices(farmer_id: int, category: str):
+    filters = [Products.category == category]
+    if farmer_id != MARKET:
+        filters.append(Products.farmer_id == farmer_id)
+    return filters
+
+
+def apply(connection: Connection, delta: RollupDelta):
+    """Applies `delta` in the transaction that wrote the products, after the write."""
+    if not delta:
+        return
+    stats = ProductStats.__table__
+    days = FarmerDailyListings.__table__
+    if delta.stats:
+        _upsert(connection, "add_stats", [
+            {
+                "farmer_id": farmer_id, "category": category, "product_count": change.count,
+                "price_sum": change.price_sum, "price_min": change.added_min, "price_max": change.added_max,
+            }
+            for (farmer_id, category), change in delta.stats.items()
+        ])
+    for (farmer_id, category), change in delta.stats.items():
+        key = (stats.c.farmer_id == farmer_id, stats.c.category == category)
+        # A removed price can only have been the bound if it equals it, only then is the bound read
+        # again from the products, through the category's price index
+        if change.removed_min is not None:
+            connection.execute(
+                update(stats).where(*key, stats.c.price_min >= change.removed_min).values(
+                    price_min=select(func.min(Products.price)).where(*_group_prices(farmer_id, category))
+                    .scalar_subquery(),
+                )
+            )
+            connection.execute(
+                update(stats).where(*key, stats.c.price_max <= change.removed_max).values(
+                    price_max=select(func.max(Products.price)).where(*_group_prices(farmer_id, category))
+                    .scalar_subquery(),
+                )
+            )
+        if change.count < 0:
+            connection.execute(delete(stats).where(*key, stats.c.product_count <= 0))
+    if delta.days:
+        _upsert(connection, "add_days", [
+            {"farmer_id": farmer_id, "day": day, "product_count": count}
+            for (farmer_id, day), count in delta.days.items()
+        ])
+    for (farmer_id, day), count in delta.days.items():
+        if count < 0:
+            connection.execute(
+                delete(days).where(days.c.farmer_id == farmer_id, days.c.day == day, days.c.product_count <= 0)
+            )
+
+
+def _committed(product: Products, name: str):
+    history = inspect(product).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(product, name)
+
+
+# The delta is taken before the flush, while deleted rows can still be loaded, and applied
+# after it, so the bounds read again from the products already see the write
+@event.listens_for(Session, "before_flush")
+def _collect_product_writes(session: Session, flush_context, instances):
+    delta = RollupDelta()
+    for product in session.new:
+        if isinstance(product, Products):
+            delta.add(*(getattr(product, name) for name in TRACKED))
+    for product in session.deleted:
+        if isinstance(product, Products):
+            delta.add(*(_committed(product, name) for name in TRACKED), sign=-1)
+    for product in session.dirty:
+        if isinstance(product, Products) and any(inspect(product).attrs[name].history.has_changes() for name in TRACKED):
+            delta.add(*(_committed(product, name) for name in TRACKED), sign=-1)
+            delta.add(*(getattr(product, name) for name in TRACKED))
+    # Replaces what a failed flush left behind
+    session.info[SESSION_KEY] = delta
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_product_writes(session: Session, flush_context):
+    delta = session.info.pop(SESSION_KEY, None)
+    if delta:
+        apply(session.connection(), delta)
+
+
+def _listing_day_sql(dialect: str):
+    minutes = int(NEPAL_TZ.utcoffset(None).total_seconds() // 60)
+    if dialect == "mysql":
+        return func.date(func.date_add(Products.created_at, text(f"INTERVAL {minutes} MINUTE")))
+    return func.date(Products.created_at, f"+{minutes} minutes")
+
+
+def _same_stats(expected: tuple, current) -> bool:
+    count, price_sum, price_min, price_max = expected
+    return (
+        current is not None
+        and current.product_count == count
+        and math.isclose(current.price_sum, price_sum, rel_tol=1e-9, abs_tol=1e-6)
+        and current.price_min == price_min
+        and current.price_max == price_max
+    )
+
+
+def reconcile(engine: Engine) -> int:
+    """Recomputes the rollups from the products table and corrects the rows that drifted, returns how many.
+
+    A full GROUP BY over products, for a periodic job. A product written while
+    it runs can leave its group stale until the next run.
+    """
+    stats = ProductStats.__table__
+    days = FarmerDailyListings.__table__
+    aggregates = (func.count(), func.sum(Products.price), func.min(Products.price), func.max(Products.price))
+    day = _listing_day_sql(engine.dialect.name)
+    fixed = 0
+    with engine.begin() as connection:
+        expected = {}
+        for scope, group in ((Products.farmer_id, [Products.farmer_id]), (literal(MARKET), [])):
+            for row in connection.execute(select(scope, Products.category, *aggregates).group_by(*group, Products.category)):
+                expected[(row[0], row[1])] = tuple(row[2:])
+        current = {(row.farmer_id, row.category): row for row in connection.execute(select(stats))}
+        rows = [
+            {"farmer_id": farmer_id, "category": category, "product_count": count, "price_sum": price_sum,
+             "price_min": price_min, "price_max": price_max}
+            for (farmer_id, category), (count, price_sum, price_min, price_max) in expected.items()
+            if not _same_stats((count, price_sum, price_min, price_max), current.get((farmer_id, category)))
+        ]
+        if rows:
+            _upsert(connection, "replace_stats", rows)
+        for farmer_id, category in current.keys() - expected.keys():
+            connection.execute(delete(stats).where(stats.c.farmer_id == farmer_id, stats.c.category == category))
+        fixed += len(rows) + len(current.keys() - expected.keys())
+
+        expected = {
+            (farmer_id, date.fromisoformat(str(listed_on))): count
+            for farmer_id, listed_on, count in connection.execute(
+                select(Products.farmer_id, day, func.count()).group_by(Products.farmer_id, day)
+            )
+        }
+        current = {(row.farmer_id, row.day): row.product_count for row in connection.execute(select(days))}
+        rows = [
+            {"farmer_id": farmer_id, "day": listed_on, "product_count": count}
+            for (farmer_id, listed_on), count in expected.items() if current.get((farmer_id, listed_on)) != count
+        ]
+        if rows:
+            _upsert(connection, "replace_days", rows)
+        for farmer_id, listed_on in current.keys() - expected.keys():
+            connection.execute(delete(days).where(days.c.farmer_id == farmer_id, days.c.day == listed_on))
+        fixed += len(rows) + len(current.keys() - expected.keys())
+    return fixed
+
+
+def _summary(count: int, price_sum: float, price_min: Optional[float], price_max: Optional[float]) -> dict:
+    return {
+        "products": count,
+        "avg_price": round(price_sum / count, 2) if count else None,
+        "min_price": price_min,
+        "max_price": price_max,
+    }
+
+
+def category_stats(connection: Connection, farmer_id: int = MARKET) -> dict:
+    """Totals and per category figures of one farmer's products, or the market's."""
+    rows = connection.execute(
+        select(ProductStats.category, ProductStats.product_count, ProductStats.price_sum, ProductStats.price_min,
+               ProductStats.price_max)
+        .where(ProductStats.farmer_id == farmer_id)
+        .order_by(ProductStats.category)
+    ).all()
+    return {
+        "totals": _summary(
+            sum(row.product_count for row in rows),
+            sum(row.price_sum for row in rows),
+            min((row.price_min for row in rows if row.price_min is not None), default=None),
+            max((row.price_max for row in rows if row.price_max is not None), default=None),
+        ),
+        "categories": [
+            {"category": row.category, **_summary(row.product_count, row.price_sum, row.price_min, row.price_max)}
+            for row in rows
+        ],
+    }
+
+
+def listings_per_day(connection: Connection, farmer_id: int, days: int) -> list:
+    """The farmer's listings on each of the last `days` days, days without any included."""
+    since = nepal_today() - timedelta(days=days - 1)
+    counts = dict(connection.execute(
+        select(FarmerDailyListings.day, FarmerDailyListings.product_count)
+        .where(FarmerDailyListings.farmer_id == farmer_id, FarmerDailyListings.day >= since)
+    ).all())
+    return [{"day": since + timedelta(days=n), "products": counts.get(since + timedelta(days=n), 0)} for n in range(days)]
+
+
+class RollupReconciler:
+    """Runs `reconcile` every `interval` seconds, the first run is one interval after start."""
+
+    def __init__(self, engine: Engine, interval: float):
+        self.engine = engine
+        self.interval = interval
+        self.last_run = None
+        self.last_status = None
+        self._task = None
+
+    async def reconcile_once(self) -> int:
+        fixed = await run_in_threadpool(reconcile, self.engine)
+        self.last_run = datetime.now(timezone.utc)
+        self.last_status = f"fixed {fixed} rows"
+        if fixed:
+            logger.warning("Reconciliation fixed %d product rollup rows", fixed)
+        return fixed
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile_once()
+            except Exception as e:
+                logger.exception("Product rollup reconciliation failed")
+                self.last_status = f"failed: {e}"
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "last_run": self.last_run, "last_status": self.last_status}
@@ -0,0 +1,487 @@
+import asyncio
+import bisect
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
+from operator import itemgetter
+from pathlib import Path
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Matches in the title count more than in the category, which count more than in the description
+FIELD_WEIGHTS = (("title", 3.0), ("category", 2.0), ("description", 1.0))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Score multipliers for terms that only match a query token by prefix or with a typo
+PREFIX_WEIGHT = 0.6
+FUZZY_WEIGHT = 0.4
+MAX_PREFIX_EXPANSIONS = 32
+MIN_FUZZY_LENGTH = 4
+
+# Bumped when the segment layout changes, an index in an older layout is rebuilt
+MAGIC = b"KHSRCH02"
+
+DEVANAGARI_DIGITS = str.maketrans("०१२३४५६७८९", "0123456789")
+# Zero-width joiners and the nukta are dropped so spelling variants index the same
+IGNORED_CHARS = dict.fromkeys(map(ord, "\u200c\u200d\u093c"))
+TOKEN = re.compile(r"(?:[^\W_]|[\u0900-\u0963\u0966-\u097f])+")
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFD", text).casefold().translate(IGNORED_CHARS)
+    # Chandrabindu and anusvara are used interchangeably in typed Nepali
+    text = text.replace("\u0901", "\u0902").translate(DEVANAGARI_DIGITS)
+    return unicodedata.normalize("NFC", text)
+
+
+def tokenize(text: str) -> list:
+    return TOKEN.findall(normalize(text)) if text else []
+
+
+def document_terms(title: str, description: str, category: str):
+    fields = {"title": title, "description": description, "category": category}
+    frequencies = defaultdict(float)
+    length = 0
+    for field, weight in FIELD_WEIGHTS:
+        tokens = tokenize(fields[field])
+        length += len(tokens)
+        for token in tokens:
+            frequencies[token] += weight
+    return frequencies, length
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        # Adjacent transposition, e.g. "tomaot" for "tomato"
+        return len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+def deletions(term: str):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+class _Segment:
+    """Immutable, memory-mapped snapshot of the index written by `ProductSearchIndex.save`.
+
+    Layout: magic, header length, JSON header (terms, counts, watermark), then the arrays
+    offsets (uint64, one per term + 1), doc_ids (uint32, sorted), doc_lengths
+    (float32, one per doc id) and the postings columns doc (uint32), tf
+    (float32) and doc length (float32).
+    """
+
+    def __init__(self, path: Path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != MAGIC:
+            raise ValueError(f"{path} is not a product search index")
+        header_length = int.from_bytes(self._mmap[8:16], "little")
+        header = json.loads(self._mmap[16:16 + header_length])
+        self.terms = header["terms"]
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        self.n_docs = header["n_docs"]
+        self.total_length = header["total_length"]
+        # Opaque to the index, set by whoever saved it to say how far the data source was indexed
+        self.watermark = header.get("watermark")
+
+        view = memoryview(self._mmap)
+        position = _align(16 + header_length)
+        n_postings = header["n_postings"]
+        self.offsets, position = _column(view, position, "Q", len(self.terms) + 1)
+        self.doc_ids, position = _column(view, position, "I", self.n_docs)
+        self.doc_lengths, position = _column(view, position, "f", self.n_docs)
+        self.post_docs, position = _column(view, position, "I", n_postings)
+        self.post_tfs, position = _column(view, position, "f", n_postings)
+        self.post_lengths, position = _column(view, position, "f", n_postings)
+
+    def contains(self, doc_id: int) -> bool:
+        return self.length(doc_id) is not None
+
+    def length(self, doc_id: int):
+        """The document's length, None when it is not in the segment."""
+        i = bisect.bisect_left(self.doc_ids, doc_id)
+        return self.doc_lengths[i] if i < len(self.doc_ids) and self.doc_ids[i] == doc_id else None
+
+    def document_frequency(self, term: str) -> int:
+        i = self.term_index.get(term)
+        return 0 if i is None else self.offsets[i + 1] - self.offsets[i]
+
+    def postings(self, term: str):
+        i = self.term_index.get(term)
+        if i is None:
+            return ()
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return zip(self.post_docs[start:end], self.post_tfs[start:end], self.post_lengths[start:end])
+
+    def close(self):
+        for column in (self.offsets, self.doc_ids, self.doc_lengths, self.post_docs, self.post_tfs, self.post_lengths):
+            column.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def _align(position: int) -> int:
+    return (position + 7) & ~7
+
+
+def _column(view: memoryview, position: int, typecode: str, count: int):
+    size = array(typecode).itemsize * count
+    return view[position:position + size].cast(typecode), _align(position + size)
+
+
+class ProductSearchIndex:
+    """Inverted index over product title, description and category ranked with BM25.
+
+    The bulk of the index is a memory-mapped segment on disk. Products added,
+    updated or removed since the last `save` live in an in-memory delta, and
+    superseded segment entries are hidden by tombstones until the next save.
+    The delta is lost when the process dies, so the segment records the
+    watermark it was saved with for the caller to re-index what came after.
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = Path(path) if path else None
+        self._lock = threading.RLock()
+        self._segment = None
+        # Changes made while `rebuild` reads the catalogue, replayed onto the rebuilt index
+        self._rebuild_changes = None
+        self._reset_delta()
+        if self.path and self.path.exists():
+            try:
+                self._segment = _Segment(self.path)
+            except ValueError as e:
+                # Left unloaded, so the app rebuilds it from the products
+                logger.warning("Ignoring the saved search index: %s", e)
+
+    def _reset_delta(self):
+        self._delta_postings = defaultdict(dict)
+        self._delta_docs = {}
+        self._delta_length = 0
+        self._delta_vocabulary = None
+        self._tombstones = set()
+        # Length of the tombstoned segment documents, still counted in the segment's total_length
+        self._tombstone_length = 0
+        self._deletes = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._segment is not None or bool(self._delta_docs)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._delta_docs or self._tombstones)
+
+    @property
+    def watermark(self) -> Optional[str]:
+        """The watermark passed to the last `save` or `rebuild`, None before the first one."""
+        return self._segment.watermark if self._segment else None
+
+    def __len__(self) -> int:
+        base = self._segment.n_docs if self._segment else 0
+        return base - len(self._tombstones) + len(self._delta_docs)
+
+    def doc_ids(self) -> set:
+        with self._lock:
+            ids = set(self._delta_docs)
+            if self._segment is not None:
+                ids.update(doc_id for doc_id in self._segment.doc_ids if doc_id not in self._tombstones)
+            return ids
+
+    # Indexes a product, replacing any earlier version of it
+    def add(self, doc_id: int, title: str, description: str = None, category: str = None):
+        frequencies, length = document_terms(title, description, category)
+        with self._lock:
+            if self._rebuild_changes is not None:
+                self._rebuild_changes.append((doc_id, (title, description, category)))
+            self._remove(doc_id)
+            for term, tf in frequencies.items():
+                if term not in self._delta_postings:
+                    self._delta_vocabulary = None
+                    if self._deletes is not None:
+                        self._index_deletions(term)
+                self._delta_postings[term][doc_id] = tf
+            self._delta_docs[doc_id] = (length, list(frequencies))
+            self._delta_length += length
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            if self._rebuild_changes is not None:
+                self._rebuild_changes.append((doc_id, None))
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: int):
+        previous = self._delta_docs.pop(doc_id, None)
+        if previous is not None:
+            length, terms = previous
+            self._delta_length -= length
+            for term in terms:
+                postings = self._delta_postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._delta_postings[term]
+                    self._delta_vocabulary = None
+        if self._segment is not None and doc_id not in self._tombstones:
+            length = self._segment.length(doc_id)
+            if length is not None:
+                self._tombstones.add(doc_id)
+                self._tombstone_length += length
+
+    def rebuild(self, rows, watermark: str = None):
+        """Replaces the whole index with `(id, title, description, category)` rows and saves it.
+
+        The rows are indexed into a separate instance, so searches and writes
+        carry on against the current index until the new one is swapped in.
+        """
+        with self._lock:
+            self._rebuild_changes = []
+        try:
+            fresh = ProductSearchIndex()
+            for doc_id, title, description, category in rows:
+                fresh.add(doc_id, title, description, category)
+            if self.path:
+                fresh.save(self.path, watermark)
+        except BaseException:
+            with self._lock:
+                self._rebuild_changes = None
+            raise
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+            self._segment, self._delta_docs, self._delta_postings = fresh._segment, fresh._delta_docs, fresh._delta_postings
+            self._delta_length = fresh._delta_length
+            self._delta_vocabulary = self._deletes = None
+            self._tombstones, self._tombstone_length = set(), 0
+            changes, self._rebuild_changes = self._rebuild_changes, None
+            # Left in the delta, they are newer than the watermark and saved with the next save
+            for doc_id, fields in changes:
+                if fields is None:
+                    self._remove(doc_id)
+                else:
+                    self.add(doc_id, *fields)
+
+    def search(self, query: str, limit: int = 20) -> list:
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = max(len(self), 1)
+            base_length = self._segment.total_length - self._tombstone_length if self._segment else 0
+            average_length = max((base_length + self._delta_length) / n_docs, 1.0)
+
+            scores = defaultdict(float)
+            for token in tokens:
+                # A product matched through several expansions of one token only counts the best one
+                token_scores = {}
+                for term, weight in self._expand(token).items():
+                    df = self._document_frequency(term)
+                    if not df:
+                        continue
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for doc_id, tf, length in self._postings(term):
+                        score = weight * idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+                        if score > token_scores.get(doc_id, 0.0):
+                            token_scores[doc_id] = score
+                for doc_id, score in token_scores.items():
+                    scores[doc_id] += score
+            return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    def _document_frequency(self, term: str) -> int:
+        base = self._segment.document_frequency(term) if self._segment else 0
+        return base + len(self._delta_postings.get(term, ()))
+
+    def _postings(self, term: str):
+        if self._segment is not None:
+            tombstones = self._tombstones
+            for doc_id, tf, length in self._segment.postings(term):
+                if doc_id not in tombstones:
+                    yield doc_id, tf, length
+        for doc_id, tf in self._delta_postings.get(term, {}).items():
+            yield doc_id, tf, self._delta_docs[doc_id][0]
+
+    def _has_term(self, term: str) -> bool:
+        return term in self._delta_postings or (self._segment is not None and term in self._segment.term_index)
+
+    def _expand(self, token: str) -> dict:
+        expansions = {}
+        if self._has_term(token):
+            expansions[token] = 1.0
+        for term in self._prefix_matches(token):
+            expansions.setdefault(term, PREFIX_WEIGHT)
+        if not expansions and len(token) >= MIN_FUZZY_LENGTH:
+            for term in self._fuzzy_matches(token):
+                expansions.setdefault(term, FUZZY_WEIGHT)
+        return expansions
+
+    def _prefix_matches(self, prefix: str):
+        if self._delta_vocabulary is None:
+            self._delta_vocabulary = sorted(self._delta_postings)
+        matches = []
+        vocabularies = [self._delta_vocabulary] + ([self._segment.terms] if self._segment else [])
+        for vocabulary in vocabularies:
+            i = bisect.bisect_right(vocabulary, prefix)
+            while i < len(vocabulary) and vocabulary[i].startswith(prefix) and len(matches) < MAX_PREFIX_EXPANSIONS:
+                matches.append(vocabulary[i])
+                i += 1
+        return matches
+
+    def _fuzzy_matches(self, token: str):
+        if self._deletes is None:
+            # Built on the first typo lookup: maps every term and its one-character deletions to the term
+            self._deletes = defaultdict(list)
+            for term in self._segment.terms if self._segment else ():
+                self._index_deletions(term)
+            for term in self._delta_postings:
+                self._index_deletions(term)
+        candidates = set()
+        for variant in deletions(token) | {token}:
+            for term in self._deletes.get(variant, ()):
+                if term not in candidates and within_one_edit(token, term):
+                    candidates.add(term)
+        return candidates
+
+    def _index_deletions(self, term: str):
+        if len(term) < MIN_FUZZY_LENGTH - 1:
+            return
+        self._deletes[term].append(term)
+        for variant in deletions(term):
+            self._deletes[variant].append(term)
+
+    def save(self, path: Path = None, watermark: str = None):
+        """Merges the delta into a new memory-mapped segment and swaps it in.
+
+        `watermark` is stored with the segment, e.g. the newest change of the
+        data source known to be indexed, and read back through `watermark`.
+        """
+        path = Path(path or self.path)
+        with self._lock:
+            postings = defaultdict(list)
+            # (doc_id, length) of every document kept
+            docs = []
+            if self._segment is not None:
+                segment = self._segment
+                for term in segment.terms:
+                    for doc_id, tf, length in segment.postings(term):
+                        if doc_id not in self._tombstones:
+                            postings[term].append((doc_id, tf, length))
+                docs.extend(
+                    (doc_id, length) for doc_id, length in zip(segment.doc_ids, segment.doc_lengths)
+                    if doc_id not in self._tombstones
+                )
+            for doc_id, (length, terms) in self._delta_docs.items():
+                for term in terms:
+                    postings[term].append((doc_id, self._delta_postings[term][doc_id], length))
+                docs.append((doc_id, length))
+            docs.sort()
+
+            terms = sorted(postings)
+            offsets = array("Q", [0])
+            post_docs, post_tfs, post_lengths = array("I"), array("f"), array("f")
+            for term in terms:
+                for doc_id, tf, length in sorted(postings[term]):
+                    post_docs.append(doc_id)
+                    post_tfs.append(tf)
+                    post_lengths.append(length)
+                offsets.append(len(post_docs))
+            doc_ids = array("I", (doc_id for doc_id, _ in docs))
+            doc_lengths = array("f", (length for _, length in docs))
+
+            header = json.dumps({
+                "terms": terms,
+                "n_docs": len(doc_ids),
+                "n_postings": len(post_docs),
+                # Only the documents kept, tombstoned ones drop out with their postings
+                "total_length": sum(doc_lengths),
+                "watermark": watermark,
+            }, ensure_ascii=False).encode()
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+                for column in (offsets, doc_ids, doc_lengths, post_docs, post_tfs, post_lengths):
+                    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                    f.write(column.tobytes())
+            os.replace(tmp_path, path)
+
+            if self._segment is not None:
+                self._segment.close()
+            self._segment = _Segment(path)
+            self._reset_delta()
+
+
+class SearchIndexSaver:
+    """Saves the index every `interval` seconds when it changed, the first save is one interval after start.
+
+    `watermark` is called before each save, on the threadpool, and its value
+    is stored with the segment.
+    """
+
+    def __init__(self, index: ProductSearchIndex, watermark, interval: float):
+        self.index = index
+        self.watermark = watermark
+        self.interval = interval
+        self.last_run = None
+        self.last_status = None
+        self._task = None
+
+    def save_now(self) -> bool:
+        if not self.index.dirty:
+            return False
+        # Read before the delta is merged, anything changed after it is re-indexed on the next start
+        self.index.save(watermark=self.watermark())
+        return True
+
+    async def save_once(self) -> bool:
+        saved = await run_in_threadpool(self.save_now)
+        self.last_run = datetime.now(timezone.utc)
+        self.last_status = f"saved {len(self.index)} products" if saved else "unchanged"
+        return saved
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save_once()
+            except Exception as e:
+                logger.exception("Saving the product search index failed")
+                self.last_status = f"failed: {e}"
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "last_run": self.last_run, "last_status": self.last_status}
@@ -0,0 +1,196 @@
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import Counter
+from services.prediction_cache import PredictionCache
+from utils import etag_matches
+
+response_cache_requests = Counter(
+    "khetai_response_cache_requests_total", "Cached read endpoint lookups by result.", ("result",),
+)
+
+
+class CacheBackend(ABC):
+    """Stores (etag, body) pairs by key for `ttl` seconds.
+
+    Every `delete` also bumps the key's generation. `set` is given the
+    generation read before the body was built and drops the body when the key
+    was deleted in the meantime, so a slow build cannot store stale data.
+    """
+
+    name = "base"
+    # Blocking backends are called from the threadpool
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[tuple]:
+        """The (etag, body) pair, or None on a miss."""
+
+    @abstractmethod
+    def generation(self, key: str) -> int:
+        """How many times the key was deleted, 0 if never."""
+
+    @abstractmethod
+    def set(self, key: str, etag: str, body: bytes, generation: int):
+        """Stores the pair unless the key's generation moved past `generation`."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Drops the pair and bumps the key's generation."""
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU, also the stand-in for the shared backend in tests and local runs."""
+
+    name = "memory"
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.entries = PredictionCache(max_entries, ttl_seconds=ttl)
+        # Only keys that were ever invalidated, one small int per written row
+        self.generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[tuple]:
+        return self.entries.get(key)
+
+    def generation(self, key: str) -> int:
+        return self.generations.get(key, 0)
+
+    def set(self, key: str, etag: str, body: bytes, generation: int):
+        with self._lock:
+            if self.generations.get(key, 0) == generation:
+                self.entries.put(key, (etag, body))
+
+    def delete(self, key: str):
+        with self._lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self.entries.invalidate(key)
+
+
+class RedisBackend(CacheBackend):
+    """Shared between workers, so an invalidation in one worker is seen by all of them."""
+
+    name = "redis"
+    blocking = True
+
+    # Stores the body only while the generation key still holds the value read before the build
+    SET_IF_GENERATION = """
+    if (redis.call('get', KEYS[2]) or '0') == ARGV[1] then
+        redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    end
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "khetai:response:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = max(int(ttl), 1)
+        self.prefix = prefix
+        self._set_if_generation = self.client.register_script(self.SET_IF_GENERATION)
+
+    def get(self, key: str) -> Optional[tuple]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b"\n")
+        return etag.decode(), body
+
+    def generation(self, key: str) -> int:
+        return int(self.client.get(self.prefix + "gen:" + key) or 0)
+
+    def set(self, key: str, etag: str, body: bytes, generation: int):
+        # An expired generation key reads as 0 and fails the check, which only skips one store
+        self._set_if_generation(keys=[self.prefix + key, self.prefix + "gen:" + key],
+                                args=[generation, etag.encode() + b"\n" + body, self.ttl])
+
+    def delete(self, key: str):
+        generation_key = self.prefix + "gen:" + key
+        with self.client.pipeline() as pipe:
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, self.ttl)
+            pipe.delete(self.prefix + key)
+            pipe.execute()
+
+
+def create_backend(name: str, ttl: float, max_entries: int = 10000, url: str = None) -> CacheBackend:
+    if name == "memory":
+        return MemoryBackend(ttl, max_entries)
+    if name == "redis":
+        return RedisBackend(url, ttl)
+    raise ValueError(f"Unknown response cache backend '{name}'")
+
+
+def cache_key(route: str, **params) -> str:
+    return f"{route}?{urlencode(sorted(params.items()))}" if params else route
+
+
+def version_etag(*parts) -> str:
+    """Weak ETag from a version, e.g. the id and updated_at of a row."""
+    version = ":".join(part.isoformat() if isinstance(part, datetime) else str(part) for part in parts)
+    return f'W/"{hashlib.sha1(version.encode()).hexdigest()[:20]}"'
+
+
+def body_etag(body: bytes) -> str:
+    return f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+
+class ResponseCache:
+    """Serialized JSON responses of read endpoints, answered with 304 when the client's ETag matches.
+
+    `build` runs on a miss and returns (body, etag) with the body already
+    encoded, so hits skip both the database and serialization. Writers call
+    `invalidate` with the same key after changing the underlying rows.
+    """
+
+    def __init__(self, backend: CacheBackend, cache_control: str = "no-cache"):
+        self.backend = backend
+        self.cache_control = cache_control
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def respond(self, request: Request, key: str, build) -> Response:
+        entry = await self._call(self.backend.get, key)
+        if entry is None:
+            self.misses += 1
+            response_cache_requests.inc(1, "miss")
+            generation = await self._call(self.backend.generation, key)
+            body, etag = await run_in_threadpool(build)
+            await self._call(self.backend.set, key, etag, body, generation)
+        else:
+            self.hits += 1
+            response_cache_requests.inc(1, "hit")
+            etag, body = entry
+        return self.conditional(request, body, etag)
+
+    def conditional(self, request: Request, body: bytes, etag: str, cache_control: str = None) -> Response:
+        headers = {"ETag": etag, "Cache-Control": cache_control or self.cache_control}
+        if etag_matches(request, etag):
+            self.not_modified += 1
+            response_cache_requests.inc(1, "not_modified")
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def invalidate(self, key: str):
+        # Callers are sync handlers already running on the threadpool
+        self.backend.delete(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def _call(self, fn, *args):
+        return await run_in_threadpool(fn, *args) if self.backend.blocking else fn(*args)
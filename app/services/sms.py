@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+import httpx
+
+from metrics import time_external_call
+
+logger = logging.getLogger(__name__)
+
+
+class SmsBackend(ABC):
+    """Delivers one text to one or more numbers."""
+
+    name = "base"
+
+    @abstractmethod
+    async def send(self, recipients: list, text: str):
+        """Raises httpx.HTTPError or OSError when the provider cannot be reached or rejects the request."""
+
+    async def close(self):
+        pass
+
+
+class SparrowBackend(SmsBackend):
+    """Sparrow SMS over one pooled client. Sparrow takes a comma-separated `to` list."""
+
+    name = "sparrow"
+
+    def __init__(self, api_url: str, token: str, sender: str = "MVIC Tech Titans", timeout: float = 10,
+                 max_connections: int = 8):
+        self.api_url = api_url
+        self.token = token
+        self.sender = sender
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def send(self, recipients: list, text: str):
+        response = await self.client.post(self.api_url, json={
+            "token": self.token,
+            "from": self.sender,
+            "to": ",".join(recipients),
+            "text": text,
+        })
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class LogBackend(SmsBackend):
+    """Offline backend for development, logs the texts instead of sending them."""
+
+    name = "log"
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, recipients: list, text: str):
+        self.sent += len(recipients)
+        logger.info("SMS to %s: %s", ",".join(recipients), text)
+
+
+def create_backend(name: str, **options) -> SmsBackend:
+    if name == "sparrow":
+        return SparrowBackend(options["api_url"], options["token"])
+    if name == "log":
+        return LogBackend()
+    raise ValueError(f"Unknown SMS backend '{name}'")
+
+
+class SmsQueueFull(Exception):
+    pass
+
+
+class SmsGateway:
+    """Bounded outbox drained by a few sender tasks.
+
+    Callers enqueue and return immediately. Each sender takes whatever is
+    queued (up to `batch_size` messages), sends identical texts as one call
+    and retries failed calls with exponential backoff. A full outbox rejects
+    new messages instead of queueing without bound.
+    """
+
+    def __init__(self, backend: SmsBackend, senders: int = 2, max_queue: int = 1000, batch_size: int = 100,
+                 retries: int = 3):
+        self.backend = backend
+        self.senders = senders
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.retries = retries
+        self._queue = None
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.calls = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(self.max_queue)
+        self._tasks = [asyncio.create_task(self._send_loop()) for _ in range(self.senders)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.backend.close()
+
+    async def enqueue(self, phone: str, text: str):
+        if not self._tasks:
+            await self.start()
+        try:
+            self._queue.put_nowait((phone, text))
+        except asyncio.QueueFull:
+            raise SmsQueueFull("SMS outbox is full")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "calls": self.calls,
+        }
+
+    async def _send_loop(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            by_text = defaultdict(list)
+            for phone, text in batch:
+                by_text[text].append(phone)
+            try:
+                for text, recipients in by_text.items():
+                    await self._send(recipients, text)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _send(self, recipients: list, text: str):
+        for attempt in range(self.retries + 1):
+            self.calls += 1
+            try:
+                with time_external_call("sms", self.backend.name):
+                    await self.backend.send(recipients, text)
+                self.sent += len(recipients)
+                return
+            except (httpx.HTTPError, OSError) as e:
+                # Rejected requests (bad number, bad token) fail the same way on every retry
+                rejected = isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+                if rejected or attempt == self.retries:
+                    self.failed += len(recipients)
+                    logger.warning("Could not send SMS to %d recipients: %s", len(recipients), e)
+                    return
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            except Exception:
+                # A backend bug, not worth retrying, but it must not take the sender down with it
+                self.failed += len(recipients)
+                logger.exception("SMS backend %s failed for %d recipients", self.backend.name, len(recipients))
+                return
@@ -0,0 +1,512 @@
+"""Uploaded files, stored once per content in a pluggable backend.
+
+Every upload is hashed while it streams to a staging file and kept under its
+SHA-256: a second upload of the same bytes only extends the existing blob's
+expiry. The Blob table holds each file's content type, kind and the number of
+products whose image it is, kept current by the session flush events below
+(Core writes call `adjust_references` themselves, `recount` corrects the rest).
+
+A blob expires once `expires_at` has passed while no product references it:
+voice notes shortly after the upload, product images a while after the last
+product using them went away, user images never. BlobCollector deletes the
+expired blobs, and backend objects left without a row by a crash.
+"""
+import asyncio
+import logging
+import os
+import re
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, RedirectResponse
+from sqlalchemy import and_, bindparam, case, delete, event, func, insert, inspect, null, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import (
+    S3_ACCESS_KEY_ID, S3_BUCKET, S3_ENDPOINT_URL, S3_PREFIX, S3_REGION, S3_SECRET_ACCESS_KEY, STORAGE_ACCEL_REDIRECT,
+    STORAGE_BACKEND, STORAGE_DIR, STORAGE_URL_EXPIRY, UPLOAD_ORPHAN_TTL, VOICE_UPLOAD_TTL,
+)
+from metrics import blob_uploads
+from models import Blob, Products
+
+logger = logging.getLogger(__name__)
+
+BLOB_ID = re.compile(r"[0-9a-f]{64}")
+SESSION_KEY = "blob_references"
+# Backend objects and staged or cached files this old without a row are left over from a crash
+ORPHAN_GRACE = 60 * 60
+
+
+def blob_id(reference: Optional[str]) -> Optional[str]:
+    """The blob a stored reference such as Products.image points at, if any."""
+    match = BLOB_ID.search(reference or "")
+    return match.group(0) if match else None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@dataclass
+class StoredFile:
+    sha256: str
+    # From the client's filename, only kept in the URL
+    suffix: str
+    size: int
+    # False when the content was already stored
+    new: bool
+
+    @property
+    def url(self) -> str:
+        return f"/files/{self.sha256}{self.suffix}"
+
+
+class StorageBackend(ABC):
+    """Keeps file contents by key, the key being the content's SHA-256."""
+
+    name = "base"
+
+    @abstractmethod
+    def put(self, key: str, source: Path, content_type: str):
+        """Stores `source` under `key`, the source file is moved or removed."""
+
+    @abstractmethod
+    def fetch(self, key: str, target: Path):
+        """Copies the content stored under `key` to `target`."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Removes `key`, a missing key is not an error."""
+
+    @abstractmethod
+    def keys(self, modified_before: datetime) -> Iterator[str]:
+        """The stored keys last written before `modified_before`."""
+
+    def path(self, key: str) -> Optional[Path]:
+        """The file to serve directly, None when the backend is not on this disk."""
+        return None
+
+    def url(self, key: str, content_type: str, expires: int) -> Optional[str]:
+        """A URL the client downloads from instead of the API, None to serve through the API."""
+        return None
+
+
+class LocalBackend(StorageBackend):
+    """Files under `root`, in one directory per first two hex digits of the key."""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def put(self, key: str, source: Path, content_type: str):
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Staged on the same filesystem, so the file appears whole or not at all
+        os.replace(source, path)
+
+    def fetch(self, key: str, target: Path):
+        shutil.copyfile(self.path(key), target)
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def keys(self, modified_before: datetime) -> Iterator[str]:
+        cutoff = modified_before.timestamp()
+        for shard in self.root.iterdir():
+            if not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                if BLOB_ID.fullmatch(path.name) and path.stat().st_mtime < cutoff:
+                    yield path.name
+
+
+class S3Backend(StorageBackend):
+    """Objects under `prefix` in an S3 bucket, or in any S3-compatible service through `endpoint_url`."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", endpoint_url: str = None, region: str = None,
+                 access_key_id: str = None, secret_access_key: str = None):
+        import boto3
+
+        if not bucket:
+            raise ValueError("The s3 storage backend needs S3_BUCKET")
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        )
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, key: str, source: Path, content_type: str):
+        self.client.upload_file(str(source), self.bucket, self.prefix + key, ExtraArgs={"ContentType": content_type})
+        source.unlink(missing_ok=True)
+
+    def fetch(self, key: str, target: Path):
+        self.client.download_file(self.bucket, self.prefix + key, str(target))
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def keys(self, modified_before: datetime) -> Iterator[str]:
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                if BLOB_ID.fullmatch(key) and item["LastModified"] < modified_before:
+                    yield key
+
+    def url(self, key: str, content_type: str, expires: int) -> str:
+        # Range requests and the download itself go to S3
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.prefix + key, "ResponseContentType": content_type},
+            ExpiresIn=expires,
+        )
+
+
+def create_backend(name: str, root: Path = None, **s3) -> StorageBackend:
+    if name == "local":
+        return LocalBackend(root)
+    if name == "s3":
+        return S3Backend(**s3)
+    raise ValueError(f"Unknown storage backend '{name}'")
+
+
+def _blob_update(refcount, condition):
+    """Refcount update run with executemany, a blob left unreferenced gets b_expires unless it never expires."""
+    blob = Blob.__table__
+    expires = bindparam("b_expires", type_=blob.c.expires_at.type)
+    # MySQL evaluates SET left to right, so expires_at is set while refcount still holds the old count
+    return update(blob).where(blob.c.sha256 == bindparam("b_sha"), *condition).ordered_values(
+        (blob.c.expires_at, case((and_(blob.c.expires_at.is_not(None), refcount <= 0), expires), else_=blob.c.expires_at)),
+        (blob.c.refcount, refcount),
+    )
+
+
+_ADJUST = _blob_update(Blob.__table__.c.refcount + bindparam("b_change"), [])
+# Only rows still holding the count that was read, a concurrent adjustment is left for the next run
+_RECOUNT = _blob_update(bindparam("b_count"), [Blob.__table__.c.refcount == bindparam("b_old")])
+
+
+def adjust_references(connection: Connection, changes: Counter):
+    """Adds `changes`, counts by blob id, to the refcounts in the transaction that wrote the products."""
+    rows = [
+        {"b_sha": sha, "b_change": change, "b_expires": _now() + timedelta(seconds=UPLOAD_ORPHAN_TTL)}
+        for sha, change in changes.items() if sha and change
+    ]
+    if rows:
+        connection.execute(_ADJUST, rows)
+
+
+def _committed_image(session: Session, product: Products) -> Optional[str]:
+    history = inspect(product).attrs.image.history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        # Set while it was not loaded, e.g. after a commit, the row still holds the old value
+        return session.connection().scalar(select(Products.image).where(Products.id == product.id))
+    return product.image
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_image_references(session: Session, flush_context, instances):
+    changes = Counter()
+    for product in session.new:
+        if isinstance(product, Products):
+            changes[blob_id(product.image)] += 1
+    for product in session.deleted:
+        if isinstance(product, Products):
+            changes[blob_id(_committed_image(session, product))] -= 1
+    for product in session.dirty:
+        if isinstance(product, Products) and inspect(product).attrs.image.history.has_changes():
+            changes[blob_id(_committed_image(session, product))] -= 1
+            changes[blob_id(product.image)] += 1
+    # Replaces what a failed flush left behind
+    session.info[SESSION_KEY] = changes
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_image_references(session: Session, flush_context):
+    changes = session.info.pop(SESSION_KEY, None)
+    if changes:
+        adjust_references(session.connection(), changes)
+
+
+class BlobStore:
+    """Stores uploads in `backend` and tracks them in the Blob table.
+
+    `work_dir` holds the staged uploads, on the same filesystem as a local
+    backend, and the local copies of remote blobs. `ttls` maps each kind to
+    the seconds an unreferenced blob of that kind is kept, None for ever.
+    """
+
+    def __init__(self, backend: StorageBackend, engine: Engine, work_dir: Path, ttls: dict,
+                 url_expiry: int = 3600, accel_redirect: str = None):
+        self.backend = backend
+        self.engine = engine
+        self.staging_dir = Path(work_dir) / "tmp"
+        self.cache_dir = Path(work_dir) / "cache"
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttls = ttls
+        self.url_expiry = url_expiry
+        self.accel_redirect = accel_redirect.rstrip("/") if accel_redirect else None
+        # Called with the id of every deleted blob, e.g. to drop files derived from it
+        self.on_delete: List[Callable[[str], None]] = []
+
+    def staging_path(self) -> Path:
+        return self.staging_dir / f".{uuid.uuid4().hex}.part"
+
+    def _extend(self, connection: Connection, sha256: str, expires_at: Optional[datetime]) -> bool:
+        # The later expiry wins, and never expiring beats both
+        blob = Blob.__table__
+        if expires_at is None:
+            value = null()
+        else:
+            expires = bindparam("expires", expires_at, type_=blob.c.expires_at.type)
+            value = case(
+                (blob.c.expires_at.is_(None), null()),
+                (blob.c.expires_at > expires, blob.c.expires_at),
+                else_=expires,
+            )
+        return connection.execute(update(blob).where(blob.c.sha256 == sha256).values(expires_at=value)).rowcount > 0
+
+    def add(self, staged: Path, sha256: str, size: int, content_type: str, kind: str) -> bool:
+        """Stores the staged file unless its content already is, returns whether it was new.
+
+        Blocking, for the threadpool. The staged file is moved or removed either way.
+        """
+        ttl = self.ttls.get(kind)
+        expires_at = None if ttl is None else _now() + timedelta(seconds=ttl)
+        # The collector deletes a blob's object before its row deletion commits, so this either
+        # extends a blob that stays or finds none and stores the content again
+        with self.engine.begin() as connection:
+            if self._extend(connection, sha256, expires_at):
+                staged.unlink(missing_ok=True)
+                blob_uploads.inc(1, kind, "deduplicated")
+                return False
+        self.backend.put(sha256, staged, content_type)
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(Blob.__table__).values(
+                    sha256=sha256, size=size, content_type=content_type, kind=kind, refcount=0,
+                    created_at=_now(), expires_at=expires_at,
+                ))
+        except IntegrityError:
+            # The same content uploaded concurrently, the object written twice is identical
+            with self.engine.begin() as connection:
+                self._extend(connection, sha256, expires_at)
+            blob_uploads.inc(1, kind, "deduplicated")
+            return False
+        blob_uploads.inc(1, kind, "stored")
+        return True
+
+    def get(self, sha256: str):
+        with self.engine.connect() as connection:
+            return connection.execute(select(Blob.__table__).where(Blob.sha256 == sha256)).first()
+
+    def local_file(self, sha256: str) -> Path:
+        """A file on this disk with the blob's content, remote blobs are downloaded to the cache once."""
+        path = self.backend.path(sha256)
+        if path is not None:
+            return path
+        cached = self.cache_dir / sha256
+        if cached.exists():
+            # Kept from the cache pruning while it is used
+            os.utime(cached)
+            return cached
+        staged = self.staging_path()
+        try:
+            self.backend.fetch(sha256, staged)
+            os.replace(staged, cached)
+        finally:
+            staged.unlink(missing_ok=True)
+        return cached
+
+    def response(self, blob, headers: dict) -> Response:
+        """Serves a blob: a redirect to the backend's URL, a proxy's sendfile, or a FileResponse."""
+        url = self.backend.url(blob.sha256, blob.content_type, self.url_expiry)
+        if url is not None:
+            # Cached for less than the URL is valid
+            return RedirectResponse(url, status_code=302, headers={
+                **headers, "Cache-Control": f"private, max-age={self.url_expiry // 2}",
+            })
+        path = self.backend.path(blob.sha256)
+        if self.accel_redirect:
+            location = f"{self.accel_redirect}/{path.relative_to(self.backend.root).as_posix()}"
+            return Response(media_type=blob.content_type, headers={**headers, "X-Accel-Redirect": location})
+        # Answers Range and If-Range requests, and hands the file to the server where it supports pathsend
+        return FileResponse(path, media_type=blob.content_type, headers=headers)
+
+    def recount(self) -> int:
+        """Recomputes the refcounts from Products.image and corrects the ones that drifted, returns how many.
+
+        A blob corrected down to no references only expires UPLOAD_ORPHAN_TTL
+        later, so a product written while this runs is counted again in time.
+        """
+        blob = Blob.__table__
+        with self.engine.begin() as connection:
+            expected = Counter()
+            for image, count in connection.execute(
+                select(Products.image, func.count()).where(Products.image.is_not(None)).group_by(Products.image)
+            ):
+                sha = blob_id(image)
+                if sha:
+                    expected[sha] += count
+            expires = _now() + timedelta(seconds=UPLOAD_ORPHAN_TTL)
+            rows = [
+                {"b_sha": sha, "b_old": refcount, "b_count": expected.get(sha, 0), "b_expires": expires}
+                for sha, refcount in connection.execute(select(blob.c.sha256, blob.c.refcount))
+                if expected.get(sha, 0) != refcount
+            ]
+            if rows:
+                connection.execute(_RECOUNT, rows)
+        return len(rows)
+
+    def _delete_expired(self, sha256: str, now: datetime) -> bool:
+        blob = Blob.__table__
+        with self.engine.begin() as connection:
+            deleted = connection.execute(
+                delete(blob).where(blob.c.sha256 == sha256, blob.c.expires_at <= now, blob.c.refcount <= 0)
+            ).rowcount
+            if deleted:
+                # While the row deletion is uncommitted, an upload of the same content waits for it
+                self.backend.delete(sha256)
+        return bool(deleted)
+
+    def collect(self, batch_size: int = 500) -> int:
+        """Deletes the blobs that expired without references, returns how many."""
+        blob = Blob.__table__
+        now = _now()
+        deleted = 0
+        while True:
+            with self.engine.connect() as connection:
+                expired = connection.execute(
+                    select(blob.c.sha256).where(blob.c.expires_at <= now, blob.c.refcount <= 0).limit(batch_size)
+                ).scalars().all()
+            for sha in expired:
+                if not self._delete_expired(sha, now):
+                    continue
+                deleted += 1
+                (self.cache_dir / sha).unlink(missing_ok=True)
+                for callback in self.on_delete:
+                    try:
+                        callback(sha)
+                    except Exception:
+                        logger.exception("Cleaning up after blob %s failed", sha)
+            if len(expired) < batch_size:
+                return deleted
+
+    def sweep(self, grace: float = ORPHAN_GRACE) -> int:
+        """Deletes backend objects without a row and stale staged or cached files, returns how many objects."""
+        blob = Blob.__table__
+        cutoff = _now() - timedelta(seconds=grace)
+        keys = list(self.backend.keys(cutoff))
+        removed = 0
+        for offset in range(0, len(keys), 500):
+            chunk = keys[offset:offset + 500]
+            with self.engine.connect() as connection:
+                known = set(connection.execute(select(blob.c.sha256).where(blob.c.sha256.in_(chunk))).scalars())
+            for key in chunk:
+                if key not in known:
+                    self.backend.delete(key)
+                    removed += 1
+        for directory in (self.staging_dir, self.cache_dir):
+            for path in directory.iterdir():
+                if path.stat().st_mtime < cutoff.timestamp():
+                    path.unlink(missing_ok=True)
+        if removed:
+            logger.warning("Removed %d stored files without a blob row", removed)
+        return removed
+
+    def stats(self) -> dict:
+        blob = Blob.__table__
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(blob.c.kind, func.count(), func.sum(blob.c.size), func.sum(blob.c.refcount),
+                       func.count(blob.c.expires_at))
+                .group_by(blob.c.kind)
+            ).all()
+        return {
+            "backend": self.backend.name,
+            "kinds": {
+                kind: {"files": count, "bytes": size or 0, "references": references or 0, "expiring": expiring}
+                for kind, count, size, references, expiring in rows
+            },
+        }
+
+
+def create_store(engine: Engine) -> BlobStore:
+    """The store configured in config.py."""
+    backend = create_backend(
+        STORAGE_BACKEND, STORAGE_DIR / "blobs",
+        bucket=S3_BUCKET, prefix=S3_PREFIX, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+        access_key_id=S3_ACCESS_KEY_ID, secret_access_key=S3_SECRET_ACCESS_KEY,
+    )
+    return BlobStore(
+        backend, engine, STORAGE_DIR,
+        ttls={"product": UPLOAD_ORPHAN_TTL, "user": None, "voice": VOICE_UPLOAD_TTL},
+        url_expiry=STORAGE_URL_EXPIRY,
+        accel_redirect=STORAGE_ACCEL_REDIRECT,
+    )
+
+
+class BlobCollector:
+    """Recounts references and deletes expired and orphaned blobs every `interval` seconds."""
+
+    def __init__(self, store: BlobStore, interval: float):
+        self.store = store
+        self.interval = interval
+        self.last_run = None
+        self.last_status = None
+        self._task = None
+
+    def _collect(self) -> dict:
+        return {
+            "recounted": self.store.recount(),
+            "deleted": self.store.collect(),
+            "orphans_removed": self.store.sweep(),
+        }
+
+    async def collect_once(self) -> dict:
+        result = await run_in_threadpool(self._collect)
+        self.last_run = _now()
+        self.last_status = ", ".join(f"{name} {count}" for name, count in result.items())
+        return result
+
+    async def run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.collect_once()
+            except Exception as e:
+                logger.exception("Blob garbage collection failed")
+                self.last_status = f"failed: {e}"
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "last_run": self.last_run, "last_status": self.last_status}
@@ -0,0 +1,427 @@
+import asyncio
+import functools
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import (
+    Column, Float, Index, Integer, MetaData, String, Table, Text, case, create_engine, delete, event, func, insert,
+    select, update,
+)
+from sqlalchemy.engine import Engine, make_url
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# Kept out of the SQLModel metadata, the queue usually lives in its own local SQLite file
+metadata = MetaData()
+tasks = Table(
+    "tasks", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String(100), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("priority", Integer, nullable=False, default=0),
+    Column("status", String(16), nullable=False, default=QUEUED),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("max_attempts", Integer, nullable=False),
+    # Epoch seconds, like the OTP store
+    Column("run_at", Float, nullable=False),
+    Column("lease_until", Float),
+    Column("created_at", Float, nullable=False),
+    Column("finished_at", Float),
+    Column("error", Text),
+    Index("ix_tasks_status_finished_at", "status", "finished_at"),
+)
+# In claim order, so picking the next tasks reads a few index entries instead of sorting the backlog
+Index("ix_tasks_claim_order", tasks.c.status, tasks.c.priority.desc(), tasks.c.run_at, tasks.c.id)
+
+task_runs = Counter("khetai_task_runs_total", "Background task runs by task and outcome.", ("name", "outcome"))
+task_duration = Histogram("khetai_task_duration_seconds", "Time spent running one background task.", ("name",))
+task_wait = Histogram("khetai_task_wait_seconds", "Time from a task being due to it starting.", ("name",))
+
+
+def create_queue_engine(url: str) -> Engine:
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_pre_ping=True)
+    database = make_url(url).database
+    if database and database != ":memory:":
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+
+    # WAL lets the workers claim while handlers enqueue, NORMAL syncs on checkpoints instead of every commit
+    @event.listens_for(engine, "connect")
+    def set_pragmas(connection, _):
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
+
+
+class TaskStore:
+    """The tasks table. Every method is one short transaction and blocks, call it from the threadpool."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    def create(self):
+        metadata.create_all(self.engine)
+
+    def add(self, name: str, payload: str, priority: int, max_attempts: int, run_at: float) -> int:
+        with self.engine.begin() as connection:
+            result = connection.execute(insert(tasks).values(
+                name=name, payload=payload, priority=priority, status=QUEUED, attempts=0,
+                max_attempts=max_attempts, run_at=run_at, created_at=time.time(),
+            ))
+        return result.inserted_primary_key[0]
+
+    def claim(self, wanted: dict, now: float, lease_until: float, succeeded: list = ()) -> list:
+        """Marks due tasks as running, highest priority first, up to `limit` for each (names, limit) in `wanted`.
+
+        Tasks that finished since the last call are marked succeeded in the
+        same transaction, so a busy queue commits once per round, not per task.
+        """
+        claimed = []
+        with self.engine.begin() as connection:
+            if succeeded:
+                connection.execute(
+                    update(tasks)
+                    .where(tasks.c.id.in_(succeeded))
+                    .values(status=SUCCEEDED, error=None, lease_until=None, finished_at=time.time())
+                )
+            for names, limit in wanted:
+                rows = connection.execute(
+                    select(tasks.c.id, tasks.c.name, tasks.c.payload, tasks.c.attempts, tasks.c.max_attempts,
+                           tasks.c.run_at)
+                    .where(tasks.c.status == QUEUED, tasks.c.run_at <= now, tasks.c.name.in_(names))
+                    .order_by(tasks.c.priority.desc(), tasks.c.run_at, tasks.c.id)
+                    .limit(limit)
+                    # SKIP LOCKED on MySQL, SQLite serializes writers anyway
+                    .with_for_update(skip_locked=True)
+                ).mappings().all()
+                if not rows:
+                    continue
+                ids = [row["id"] for row in rows]
+                # The status check keeps two processes sharing the file from claiming the same task
+                result = connection.execute(
+                    update(tasks)
+                    .where(tasks.c.id.in_(ids), tasks.c.status == QUEUED)
+                    .values(status=RUNNING, attempts=tasks.c.attempts + 1, lease_until=lease_until)
+                )
+                if result.rowcount < len(ids):
+                    ids = set(connection.execute(
+                        select(tasks.c.id).where(tasks.c.id.in_(ids), tasks.c.lease_until == lease_until)
+                    ).scalars())
+                claimed.extend({**row, "attempts": row["attempts"] + 1} for row in rows if row["id"] in ids)
+        return claimed
+
+    def finish(self, task_id: int, status: str, error: str = None, run_at: float = None):
+        values = {"status": status, "error": error, "lease_until": None}
+        if status == QUEUED:
+            values["run_at"] = run_at
+        else:
+            values["finished_at"] = time.time()
+        with self.engine.begin() as connection:
+            connection.execute(update(tasks).where(tasks.c.id == task_id).values(**values))
+
+    def release(self, task_ids: list):
+        """Puts interrupted tasks back without counting the attempt."""
+        if not task_ids:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(tasks)
+                .where(tasks.c.id.in_(task_ids), tasks.c.status == RUNNING)
+                .values(status=QUEUED, attempts=tasks.c.attempts - 1, lease_until=None)
+            )
+
+    def extend(self, task_ids: list, lease_until: float):
+        """Renews the leases of tasks still running in this process."""
+        if not task_ids:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(tasks).where(tasks.c.id.in_(task_ids), tasks.c.status == RUNNING).values(lease_until=lease_until)
+            )
+
+    def recover(self, now: float) -> int:
+        """Requeues tasks whose worker died, failing those that used up their attempts."""
+        exhausted = tasks.c.attempts >= tasks.c.max_attempts
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(tasks)
+                .where(tasks.c.status == RUNNING, tasks.c.lease_until < now)
+                .values(
+                    status=case((exhausted, FAILED), else_=QUEUED),
+                    error="Lease expired",
+                    lease_until=None,
+                    # Failed tasks are purged by finished_at like any other finished task
+                    finished_at=case((exhausted, now), else_=tasks.c.finished_at),
+                )
+            )
+        return result.rowcount
+
+    def purge(self, before: float) -> int:
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                delete(tasks).where(tasks.c.status.in_((SUCCEEDED, FAILED)), tasks.c.finished_at < before)
+            )
+        return result.rowcount
+
+    def get(self, task_id: int):
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(tasks.c.id, tasks.c.name, tasks.c.priority, tasks.c.status, tasks.c.attempts,
+                       tasks.c.max_attempts, tasks.c.run_at, tasks.c.created_at, tasks.c.finished_at, tasks.c.error)
+                .where(tasks.c.id == task_id)
+            ).mappings().first()
+
+    def counts(self) -> dict:
+        with self.engine.connect() as connection:
+            rows = connection.execute(select(tasks.c.status, func.count()).group_by(tasks.c.status)).all()
+        return {status: count for status, count in rows}
+
+
+@dataclass
+class TaskHandler:
+    fn: Callable
+    # "async" handlers run on the event loop, "thread" handlers on the queue's thread pool
+    kind: str
+    max_attempts: int
+    priority: int
+
+
+class UnknownTask(Exception):
+    pass
+
+
+class PermanentError(Exception):
+    """Raised by a handler for a task that would fail the same way again, it is not retried."""
+
+
+class TaskQueue:
+    """Durable in-process task queue for work that should not hold up a response.
+
+    Handlers are registered by name with `task`, and `enqueue` stores a JSON
+    payload in the tasks table and returns the task id right away. A
+    dispatcher claims due tasks, highest priority first, for up to
+    `async_workers` coroutines and `thread_workers` threads. A failing task is
+    retried with exponential backoff until it has used `max_attempts`, unless
+    it raised `PermanentError`.
+
+    Tasks survive restarts: running tasks are released on shutdown, and the
+    ones left behind by a crashed process are requeued once their lease expires.
+    Leases of tasks still running are renewed while the process lives, so a
+    long handler is not started a second time next to itself. A task can still
+    run more than once after a crash, handlers must be idempotent.
+    """
+
+    def __init__(self, store: TaskStore, async_workers: int = 8, thread_workers: int = 2, max_attempts: int = 5,
+                 retry_backoff: float = 2.0, lease: float = 300, poll_interval: float = 1.0,
+                 retention: float = 7 * 24 * 60 * 60):
+        self.store = store
+        self.slots = {"async": async_workers, "thread": thread_workers}
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.handlers = {}
+        self._executor = None
+        self._dispatcher = None
+        self._wakeup = None
+        self._loop = None
+        self._running = {"async": {}, "thread": {}}
+        self._succeeded = []
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def task(self, name: str, kind: str = "async", max_attempts: int = None, priority: int = 0):
+        """Registers the decorated function as the handler for `name`, it is called with the payload's keys."""
+        if kind not in self.slots:
+            raise ValueError(f"Unknown task kind '{kind}'")
+
+        def register(fn):
+            self.handlers[name] = TaskHandler(fn, kind, max_attempts or self.max_attempts, priority)
+            return fn
+        return register
+
+    async def enqueue(self, name: str, payload: dict = None, priority: int = None, delay: float = 0) -> int:
+        return await run_in_threadpool(self.enqueue_sync, name, payload, priority, delay)
+
+    # For sync handlers, which already run on the threadpool
+    def enqueue_sync(self, name: str, payload: dict = None, priority: int = None, delay: float = 0) -> int:
+        handler = self.handlers.get(name)
+        if handler is None:
+            raise UnknownTask(f"No handler registered for task '{name}'")
+        task_id = self.store.add(
+            name, json.dumps(payload or {}), handler.priority if priority is None else priority,
+            handler.max_attempts, time.time() + delay,
+        )
+        if delay <= 0:
+            self._wake()
+        return task_id
+
+    def get(self, task_id: int) -> dict:
+        row = self.store.get(task_id)
+        return dict(row) if row else None
+
+    async def start(self):
+        if self._dispatcher is not None:
+            return
+        await run_in_threadpool(self.store.create)
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.slots["thread"], thread_name_prefix="tasks")
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = 10):
+        if self._dispatcher is None:
+            return
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        self._dispatcher = None
+
+        running = {**self._running["async"], **self._running["thread"]}
+        if running:
+            await asyncio.wait(running.values(), timeout=timeout)
+        unfinished = [task_id for task_id, runner in running.items() if not runner.done()]
+        for runner in running.values():
+            runner.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        # Whatever did not finish in time goes back to the queue for the next start
+        succeeded, self._succeeded = self._succeeded, []
+        await run_in_threadpool(self.store.claim, [], time.time(), 0, succeeded)
+        await run_in_threadpool(self.store.release, unfinished)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    async def stats(self) -> dict:
+        return {
+            "tasks": await run_in_threadpool(self.store.counts),
+            "running": {kind: len(running) for kind, running in self._running.items()},
+            "workers": self.slots,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    def _wake(self):
+        # Stored tasks are picked up on the next start
+        if self._dispatcher is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _dispatch(self):
+        last_maintenance = 0.0
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            # Often enough that the leases of running tasks are renewed well before they run out
+            if now - last_maintenance >= min(max(self.poll_interval * 30, 30), self.lease / 3):
+                last_maintenance = now
+                await self._maintain(now)
+
+            wanted = []
+            for kind, slots in self.slots.items():
+                free = slots - len(self._running[kind])
+                names = [name for name, handler in self.handlers.items() if handler.kind == kind]
+                if free > 0 and names:
+                    wanted.append((kind, names, free))
+            succeeded, self._succeeded = self._succeeded, []
+            claimed = []
+            try:
+                if wanted or succeeded:
+                    claimed = await run_in_threadpool(
+                        self.store.claim, [(names, limit) for _, names, limit in wanted], now, now + self.lease,
+                        succeeded,
+                    )
+            except Exception:
+                logger.exception("Could not claim tasks")
+                self._succeeded.extend(succeeded)
+            per_kind = dict.fromkeys(self.slots, 0)
+            for row in claimed:
+                kind = self.handlers[row["name"]].kind
+                per_kind[kind] += 1
+                self._running[kind][row["id"]] = asyncio.create_task(self._run(kind, row))
+            # A full batch means more tasks may be due right now
+            saturated = any(per_kind[kind] == limit for kind, _, limit in wanted)
+
+            if saturated:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _maintain(self, now: float):
+        try:
+            running = [task_id for runners in self._running.values() for task_id in runners]
+            await run_in_threadpool(self.store.extend, running, now + self.lease)
+            recovered = await run_in_threadpool(self.store.recover, now)
+            purged = await run_in_threadpool(self.store.purge, now - self.retention)
+            if recovered or purged:
+                logger.info("Requeued %d abandoned tasks, purged %d finished ones", recovered, purged)
+        except Exception:
+            logger.exception("Task queue maintenance failed")
+
+    async def _run(self, kind: str, row: dict):
+        name = row["name"]
+        handler = self.handlers[name]
+        task_wait.observe(max(0.0, time.time() - row["run_at"]), name)
+        started = time.perf_counter()
+        try:
+            payload = json.loads(row["payload"])
+            if kind == "thread":
+                await self._loop.run_in_executor(self._executor, functools.partial(handler.fn, **payload))
+            else:
+                await handler.fn(**payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            if row["attempts"] < row["max_attempts"] and not isinstance(e, PermanentError):
+                delay = self.retry_backoff * 2 ** (row["attempts"] - 1) * random.uniform(0.8, 1.2)
+                self.retried += 1
+                task_runs.inc(1, name, "retried")
+                logger.warning("Task %s #%d failed, retrying in %.1fs: %s", name, row["id"], delay, error)
+                await self._finish(row["id"], QUEUED, error, time.time() + delay)
+            else:
+                self.failed += 1
+                task_runs.inc(1, name, "failed")
+                logger.error("Task %s #%d failed after %d attempts: %s", name, row["id"], row["attempts"], error)
+                await self._finish(row["id"], FAILED, error)
+        else:
+            self.succeeded += 1
+            task_runs.inc(1, name, "succeeded")
+            # Written by the dispatcher's next claim
+            self._succeeded.append(row["id"])
+        finally:
+            task_duration.observe(time.perf_counter() - started, name)
+            self._running[kind].pop(row["id"], None)
+            self._wakeup.set()
+
+    async def _finish(self, task_id: int, status: str, error: str = None, run_at: float = None):
+        try:
+            await run_in_threadpool(self.store.finish, task_id, status, error, run_at)
+        except Exception:
+            # The lease runs out and the task is picked up again
+            logger.exception("Could not record the result of task #%d", task_id)
@@ -0,0 +1,200 @@
+import asyncio
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from metrics import time_external_call
+from services.prediction_cache import PredictionCache
+
+
+class TranscriptionBackend(ABC):
+    """Turns an audio file into text. Called on a worker thread, so it may block."""
+
+    name = "base"
+
+    @abstractmethod
+    def transcribe(self, audio_path: Path) -> str:
+        """The transcript, raises when the service reports an error."""
+
+
+class AssemblyAIBackend(TranscriptionBackend):
+    name = "assemblyai"
+
+    def __init__(self, api_key: str, language_code: str = "hi"):
+        import assemblyai as aai
+
+        aai.settings.api_key = api_key
+        self.transcriber = aai.Transcriber(config=aai.TranscriptionConfig(language_code=language_code))
+
+    def transcribe(self, audio_path: Path) -> str:
+        transcript = self.transcriber.transcribe(str(audio_path))
+        if transcript.error:
+            raise RuntimeError(transcript.error)
+        return transcript.text
+
+
+class StubBackend(TranscriptionBackend):
+    """Offline backend for tests and benchmarks, sleeps `delay` seconds per clip."""
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def transcribe(self, audio_path: Path) -> str:
+        time.sleep(self.delay)
+        return f"stub transcript of {Path(audio_path).name} ({Path(audio_path).stat().st_size} bytes)"
+
+
+def create_backend(name: str, **options) -> TranscriptionBackend:
+    if name == "assemblyai":
+        return AssemblyAIBackend(options["api_key"], options.get("language_code", "hi"))
+    if name == "stub":
+        return StubBackend(options.get("delay", 0.0))
+    raise ValueError(f"Unknown transcription backend '{name}'")
+
+
+class TranscriptionJob:
+    def __init__(self, content_hash: str, audio_path: Path):
+        self.id = uuid.uuid4().hex
+        self.content_hash = content_hash
+        self.audio_path = audio_path
+        self.status = "queued"
+        self.text = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def update(self, status: str, text: str = None, error: str = None):
+        self.status = status
+        self.text = text
+        self.error = error
+        if self.finished:
+            self.finished_at = time.time()
+        # Wake everyone waiting on this change and arm a fresh event for the next one
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float = None) -> bool:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.finished:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            await self.wait_for_change(remaining)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "text": self.text,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class TranscriptionJobs:
+    """Queue of transcription jobs served by a bounded pool of worker threads.
+
+    Submitting returns immediately. Transcripts are cached by audio content
+    hash, so a clip that was already transcribed, or is being transcribed right
+    now, never reaches the backend twice.
+    """
+
+    def __init__(self, backend: TranscriptionBackend, workers: int = 4, cache: PredictionCache = None,
+                 max_jobs: int = 10000):
+        self.backend = backend
+        self.workers = workers
+        self.cache = cache or PredictionCache()
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._executor = None
+        self._tasks = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transcription")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, audio_path: Path, content_hash: str) -> TranscriptionJob:
+        if not self._tasks:
+            await self.start()
+        job = TranscriptionJob(content_hash, audio_path)
+        self._remember(job)
+        cached = self.cache.get(content_hash)
+        if cached is not None:
+            job.update("done", text=cached)
+        else:
+            await self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> TranscriptionJob:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        statuses = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "backend": self.backend.name,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "jobs": statuses,
+            "cache": self.cache.stats(),
+        }
+
+    def _remember(self, job: TranscriptionJob):
+        self._jobs[job.id] = job
+        # Forget the oldest finished jobs once the table is full
+        while len(self._jobs) > self.max_jobs:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest.finished:
+                break
+            del self._jobs[oldest_id]
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.update("running")
+
+            async def compute():
+                with time_external_call("stt", self.backend.name):
+                    return await loop.run_in_executor(self._executor, self.backend.transcribe, job.audio_path)
+
+            try:
+                text = await self.cache.get_or_compute(job.content_hash, compute)
+            except Exception as e:
+                job.update("failed", error=str(e))
+            else:
+                job.update("done", text=text)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator
+
+import anyio
+
+from metrics import external_call_duration
+
+logger = logging.getLogger(__name__)
+
+# Prompts the app speaks most often, synthesized once at startup
+COMMON_PHRASES = [
+    "नमस्ते, म खेतीएआई हुँ। म तपाईंलाई कसरी सहयोग गर्न सक्छु?",
+    "कृपया पातको स्पष्ट फोटो खिच्नुहोस्।",
+    "तपाईंको बालीमा रोग देखिएको छ।",
+    "तपाईंको बाली स्वस्थ देखिन्छ।",
+    "सिँचाइ बिहान वा बेलुका गर्नुहोस्।",
+    "नजिकको कृषि प्राविधिकसँग सम्पर्क गर्नुहोस्।",
+    "आजको कालीमाटी बजार मूल्य यस प्रकार छ।",
+    "मल र बीउको लागत अनुमान तयार भयो।",
+]
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, lang: str, voice: str) -> str:
+    return hashlib.sha256(f"{lang}\0{voice}\0{normalize_text(text)}".encode()).hexdigest()
+
+
+class SpeechBackend(ABC):
+    """Synthesizes MP3 audio, yielding it chunk by chunk as it is produced. May block."""
+
+    name = "base"
+
+    @abstractmethod
+    def stream(self, text: str, lang: str, voice: str) -> Iterator[bytes]:
+        """A generator of MP3 chunks, closed early when the client goes away."""
+
+
+class GTTSBackend(SpeechBackend):
+    name = "gtts"
+
+    def stream(self, text: str, lang: str, voice: str):
+        from gtts import gTTS
+
+        # gTTS picks the accent through the Google Translate host (tld)
+        tts = gTTS(text=text, lang=lang, tld=voice or "com", slow=False)
+        yield from tts.stream()
+
+
+class StubBackend(SpeechBackend):
+    """Offline backend for tests, yields one fake MP3 frame per word."""
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def stream(self, text: str, lang: str, voice: str):
+        yield b"ID3\x04\x00\x00\x00\x00\x00\x00"
+        for word in text.split():
+            time.sleep(self.delay)
+            yield b"\xff\xfb" + word.encode()
+
+
+def create_backend(name: str) -> SpeechBackend:
+    backends = {"gtts": GTTSBackend, "stub": StubBackend}
+    if name not in backends:
+        raise ValueError(f"Unknown text-to-speech backend '{name}'")
+    return backends[name]()
+
+
+class SpeechCache:
+    """Content-addressed MP3 files on disk, least recently used ones evicted past `max_bytes`.
+
+    Commits come from several executor threads, `size` is only changed under the lock.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = sum(path.stat().st_size for path in self.cache_dir.glob("*.mp3"))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp3"
+
+    def lookup(self, key: str):
+        path = self.path(key)
+        try:
+            # mtime doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def open_writer(self):
+        tmp_path = self.cache_dir / f".{uuid.uuid4().hex}.part"
+        return tmp_path, open(tmp_path, "wb")
+
+    def commit(self, tmp_path: Path, key: str):
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, self.path(key))
+        with self._lock:
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*.mp3"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+
+    def stats(self) -> dict:
+        return {"bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+
+_DONE = object()
+
+
+class TextToSpeechService:
+    """Streams synthesized speech while teeing it into the cache, off the event loop."""
+
+    def __init__(self, backend: SpeechBackend, cache: SpeechCache, workers: int = 4, chunk_size: int = 64 * 1024):
+        self.backend = backend
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+
+    async def stream(self, text: str, lang: str = "hi", voice: str = None):
+        key = cache_key(text, lang, voice)
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(self._executor, self.cache.lookup, key)
+        if path is not None:
+            async for chunk in self._read(path):
+                yield chunk
+            return
+
+        chunks = self.backend.stream(normalize_text(text), lang, voice)
+        tmp_path, writer = await loop.run_in_executor(self._executor, self.cache.open_writer)
+        # Held by the thread advancing the generator, so cleanup waits for a step still running
+        lock = threading.Lock()
+        completed = False
+        started = time.perf_counter()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self._executor, self._step, chunks, writer, lock)
+                if chunk is _DONE:
+                    break
+                yield chunk
+            completed = True
+        finally:
+            external_call_duration.observe(
+                time.perf_counter() - started, "tts", self.backend.name, "ok" if completed else "error",
+            )
+            # A client disconnect cancels this generator, the cleanup must still run to the end
+            # so no partial file, open writer or gTTS request is left behind
+            with anyio.CancelScope(shield=True):
+                await loop.run_in_executor(self._executor, self._finish, chunks, writer, tmp_path, key, completed, lock)
+
+    @staticmethod
+    def _step(chunks, writer, lock: threading.Lock):
+        with lock:
+            chunk = next(chunks, _DONE)
+            if chunk is not _DONE:
+                writer.write(chunk)
+            return chunk
+
+    def _finish(self, chunks, writer, tmp_path: Path, key: str, completed: bool, lock: threading.Lock):
+        with lock:
+            chunks.close()
+            writer.close()
+        if completed:
+            self.cache.commit(tmp_path, key)
+        else:
+            tmp_path.unlink(missing_ok=True)
+
+    async def _read(self, path: Path):
+        loop = asyncio.get_running_loop()
+        with open(path, "rb") as f:
+            while chunk := await loop.run_in_executor(self._executor, f.read, self.chunk_size):
+                yield chunk
+
+    async def pregenerate(self, phrases, lang: str = "hi", voice: str = None):
+        for phrase in phrases:
+            try:
+                async for _ in self.stream(phrase, lang, voice):
+                    pass
+            except Exception as e:
+                logger.warning("Could not pre-generate speech for %r: %s", phrase, e)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,32 +1,156 @@
+import asyncio
+import hashlib
+import re
 from pathlib import Path
-from fastapi import UploadFile, HTTPException
+from fastapi import UploadFile, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, UnidentifiedImageError
 from typing import List
 
+from metrics import upload_bytes
+from services.storage import BlobStore, StoredFile
+from config import UPLOAD_CHUNK_SIZE, UPLOAD_MAX_FILE_SIZE, UPLOAD_MAX_REQUEST_SIZE, UPLOAD_CONCURRENCY
+
 UPLOAD_DIRECTORY = Path("uploads")
 UPLOAD_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
+SAFE_SUFFIX = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+def too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Upload exceeds the {limit // (1024 * 1024)} MB limit.",
+    )
+
+# Tracks the bytes of every file in one request against the per-request limit
+class ByteBudget:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def consume(self, size: int):
+        self.used += size
+        if self.used > self.limit:
+            raise too_large(self.limit)
+
+# Reads a whole upload into memory, giving up as soon as it passes max_size
+async def read_upload(file: UploadFile, max_size: int = UPLOAD_MAX_FILE_SIZE, chunk_size: int = UPLOAD_CHUNK_SIZE) -> bytes:
+    if file.size is not None and file.size > max_size:
+        raise too_large(max_size)
+    data = bytearray()
+    while chunk := await file.read(chunk_size):
+        data += chunk
+        if len(data) > max_size:
+            raise too_large(max_size)
+    upload_bytes.inc(len(data), "in_memory")
+    return bytes(data)
+
+def _write_chunk(buffer, digest, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so both run off the event loop
+    digest.update(chunk)
+    buffer.write(chunk)
+
 class FileUploader:
-    def __init__(self, upload_dir: Path):
-        self.upload_dir = upload_dir
-        self.upload_dir.mkdir(parents=True, exist_ok=True)
+    kind = "file"
+
+    # Files are stored in `store` as `blob_kind`, which decides how long they are kept unreferenced
+    def __init__(
+        self,
+        store: BlobStore,
+        blob_kind: str,
+        max_file_size: int = UPLOAD_MAX_FILE_SIZE,
+        max_request_size: int = UPLOAD_MAX_REQUEST_SIZE,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        concurrency: int = UPLOAD_CONCURRENCY,
+    ):
+        self.store = store
+        self.blob_kind = blob_kind
+        self.max_file_size = max_file_size
+        self.max_request_size = max_request_size
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def validate(self, file: UploadFile):
+        pass
+
+    # Checks the staged content before it is stored, runs in the threadpool
+    def check(self, path: Path):
+        pass
 
-    async def save_file(self, file: UploadFile) -> Path:
-        file_path = self.upload_dir / file.filename
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        return file_path
+    def suffix(self, file: UploadFile) -> str:
+        suffix = Path(file.filename or "").suffix.lower()
+        return suffix if SAFE_SUFFIX.match(suffix) else ""
 
-    async def save_files(self, files: List[UploadFile]) -> List[Path]:
-        return [await self.save_file(file) for file in files]
+    # Streams the upload to a staging file in chunks and stores it under its SHA-256
+    async def save_file(self, file: UploadFile, budget: ByteBudget = None) -> StoredFile:
+        self.validate(file)
+        if file.size is not None and file.size > self.max_file_size:
+            raise too_large(self.max_file_size)
+        budget = budget or ByteBudget(self.max_request_size)
+
+        digest = hashlib.sha256()
+        written = 0
+        tmp_path = self.store.staging_path()
+        buffer = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            while chunk := await file.read(self.chunk_size):
+                written += len(chunk)
+                if written > self.max_file_size:
+                    raise too_large(self.max_file_size)
+                budget.consume(len(chunk))
+                await run_in_threadpool(_write_chunk, buffer, digest, chunk)
+        except BaseException:
+            await run_in_threadpool(buffer.close)
+            await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+            raise
+        await run_in_threadpool(buffer.close)
+        upload_bytes.inc(written, self.kind)
+
+        sha256 = digest.hexdigest()
+        content_type = file.content_type or "application/octet-stream"
+        try:
+            await run_in_threadpool(self.check, tmp_path)
+            new = await run_in_threadpool(self.store.add, tmp_path, sha256, written, content_type, self.blob_kind)
+        except BaseException:
+            await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+            raise
+        return StoredFile(sha256, self.suffix(file), written, new)
+
+    async def save_files(self, files: List[UploadFile]) -> List[StoredFile]:
+        for file in files:
+            self.validate(file)
+        known_size = sum(file.size or 0 for file in files)
+        if known_size > self.max_request_size:
+            raise too_large(self.max_request_size)
+
+        budget = ByteBudget(self.max_request_size)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def save(file: UploadFile) -> StoredFile:
+            async with slots:
+                return await self.save_file(file, budget)
+
+        return list(await asyncio.gather(*(save(file) for file in files)))
 
 class ImageUploader(FileUploader):
-    async def save_file(self, file: UploadFile) -> Path:
+    kind = "image"
+
+    def validate(self, file: UploadFile):
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="Invalid image file type.")
-        return await super().save_file(file)
+
+    # The content type is the client's word, the bytes have to decode as well
+    def check(self, path: Path):
+        try:
+            with Image.open(path) as img:
+                img.verify()
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+            raise HTTPException(status_code=415, detail="Image format not supported")
 
 class AudioUploader(FileUploader):
-    async def save_file(self, file: UploadFile) -> Path:
+    kind = "audio"
+
+    def validate(self, file: UploadFile):
         # if file.content_type not in ["audio/wav", "audio/mpeg"]:
         #     raise HTTPException(status_code=400, detail="Invalid audio file type.")
-        return await super().save_file(file)
+        pass
@@ -1,65 +1,162 @@
 import os
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 from jose import jwt, JWTError
-import httpx
-from fastapi import HTTPException, Depends, status
+from fastapi import HTTPException, Depends, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from config import SPARROW_API, SPARROW_TOKEN
+from sqlmodel import Session, select
+from config import AUTH_CACHE_TTL, AUTH_CACHE_SIZE
+from database import engine
+from models import Farmer, Users
+from services.prediction_cache import PredictionCache
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 ALGORITHM = "HS256"
 JWT_SECRET_KEY = os.environ["JWT_SECRET_KEY"]
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# auto_error is off so a missing header can fall back to the access_token cookie
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def create_access_token(uid: str, phone: str, expires_delta: timedelta = None) -> str:
+def create_access_token(uid: int, phone: str, role: str = "farmer", expires_delta: timedelta = None) -> str:
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode = {"exp": expire, "sub": str(phone), "uid": uid}
+    to_encode = {"exp": expire, "sub": str(phone), "uid": uid, "role": role}
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
     return encoded_jwt
 
-def verify_access_token(token: str) -> str:
+def unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+# What the token itself says about the caller, available without touching the database
+@dataclass(frozen=True)
+class TokenClaims:
+    phone: str
+    uid: Optional[int]
+    role: str
+
+def decode_access_token(token: str) -> TokenClaims:
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        if "sub" not in payload:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return payload.get('sub')
-    
     except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-def get_current_user(token: str = Depends(oauth2_scheme)) -> str:
-    payload = verify_access_token(token)
-    return payload["sub"]
-
-def get_current_farmer_id(token: str = Depends(oauth2_scheme)) -> int:
-    payload = verify_access_token(token)
-    farmer_id: int = int(payload.get("uid"))
-    if farmer_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    return farmer_id
-
-
-async def send_otp_to_sparrow(phone: int, otp: str):
-    payload = {
-        'token': SPARROW_TOKEN,
-        'from':'MVIC Tech Titans',
-        'to': phone,
-        'text':f'Here is your otp: {otp}'
-    }
+        raise unauthorized("Invalid or expired token")
+    if "sub" not in payload:
+        raise unauthorized("Invalid token")
+    uid = payload.get("uid")
+    # Tokens issued before the role claim was added all belong to farmers
+    return TokenClaims(phone=payload["sub"], uid=int(uid) if uid is not None else None, role=payload.get("role", "farmer"))
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(SPARROW_API, json=payload)
+def verify_access_token(token: str) -> str:
+    return decode_access_token(token).phone
+
+# The account behind a token, as cached between requests
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    phone: str
+    role: str
+    name: str
+    location: str
+    verified: bool
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+class PrincipalCache:
+    """Resolves accounts by phone number, caching them for `ttl` seconds.
+
+    Entries are dropped with `invalidate` whenever the account changes in this
+    process, the TTL bounds how long other workers can serve a stale copy.
+    """
+
+    models = {"farmer": Farmer, "user": Users}
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.cache = PredictionCache(max_entries, ttl_seconds=ttl)
+
+    def cached(self, role: str, phone: str) -> Optional[Principal]:
+        return self.cache.get(f"{role}:{phone}")
+
+    # Blocking, looks the account up in the database on a cache miss
+    def resolve(self, role: str, phone: str) -> Optional[Principal]:
+        principal = self.cached(role, phone)
+        if principal is not None:
+            return principal
+        self.cache.record_miss()
+        model = self.models[role]
+        with Session(engine) as session:
+            account = session.exec(
+                select(model.id, model.phone, model.name, model.location, model.verified, model.latitude,
+                       model.longitude).where(model.phone == phone)
+            ).first()
+        if account is None:
+            return None
+        principal = Principal(id=account.id, phone=account.phone, role=role, name=account.name,
+                              location=account.location, verified=account.verified, latitude=account.latitude,
+                              longitude=account.longitude)
+        if self.ttl > 0:
+            self.cache.put(f"{role}:{phone}", principal)
+        return principal
+
+    def invalidate(self, role: str, phone: str):
+        self.cache.invalidate(f"{role}:{phone}")
+
+principals = PrincipalCache()
+
+# Cache hits are answered on the event loop, only misses go to the threadpool
+async def resolve_principal(role: str, phone: str) -> Optional[Principal]:
+    return principals.cached(role, phone) or await run_in_threadpool(principals.resolve, role, phone)
+
+# Bearer header first, then the cookie set at login. FastAPI caches dependencies per
+# request, so the token is decoded once however many dependencies build on it.
+async def get_token_claims(request: Request, bearer: Optional[str] = Depends(oauth2_scheme)) -> TokenClaims:
+    token = bearer or request.cookies.get("access_token")
+    if not token:
+        raise unauthorized("Access token missing")
+    return decode_access_token(token)
+
+# Farmers and users are separate tables that can share a phone number, so a token only
+# resolves to an account of the role it was issued for
+def require_role(claims: TokenClaims, role: str):
+    if claims.role != role:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"{role.capitalize()} account required")
+
+# For routes that only need the farmer's id, no database lookup
+async def get_current_farmer_id(claims: TokenClaims = Depends(get_token_claims)) -> int:
+    require_role(claims, "farmer")
+    if claims.uid is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Farmer account required")
+    return claims.uid
+
+async def get_current_farmer(claims: TokenClaims = Depends(get_token_claims)) -> Principal:
+    require_role(claims, "farmer")
+    farmer = await resolve_principal("farmer", claims.phone)
+    if not farmer:
+        raise HTTPException(status_code=404, detail="Farmer not found")
+    return farmer
 
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+async def get_current_user(claims: TokenClaims = Depends(get_token_claims)) -> Principal:
+    require_role(claims, "user")
+    user = await resolve_principal("user", claims.phone)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
 
-        return {"message": "Data sent successfully", "response": response.json()}
 
-    except httpx.HTTPError as e:
-        raise HTTPException(status_code=500, detail=f"Request failed: {str(e)}")
+# True when the client already holds the representation identified by etag
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, W/ prefixes are ignored
+    return etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in candidates)
@@ -0,0 +1,103 @@
+"""Helpers shared by the benchmark scripts."""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+
+def use_app_path():
+    if str(APP_DIR) not in sys.path:
+        sys.path.insert(0, str(APP_DIR))
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed: float, errors: int = 0) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run_load(client, make_request, concurrency: int, duration: float) -> dict:
+    """Calls `make_request(client, i)` from `concurrency` tasks for `duration` seconds."""
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        i = worker_id
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                if response.status_code >= 500:
+                    errors += 1
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            i += concurrency
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app_path: str, port: int, env: dict = None, workers: int = 1, cwd: Path = APP_DIR,
+                 factory: bool = False) -> subprocess.Popen:
+    """Starts uvicorn in a subprocess and waits until it accepts connections."""
+    command = [sys.executable, "-m", "uvicorn", app_path, "--port", str(port), "--workers", str(workers),
+               "--log-level", "warning", "--no-access-log"]
+    if factory:
+        command.append("--factory")
+    pythonpath = os.pathsep.join(filter(None, [str(APP_DIR), str(Path(__file__).resolve().parent),
+                                               os.environ.get("PYTHONPATH")]))
+    proc = subprocess.Popen(command, cwd=cwd, env={**os.environ, "PYTHONPATH": pythonpath, **(env or {})})
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{app_path} exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"{app_path} did not start within 60s")
+
+
+def build_dummy_model(path: Path, classes: int) -> bool:
+    """A tiny Keras model with the real input and output shapes, False without TensorFlow."""
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return False
+    inputs = tf.keras.Input(shape=(224, 224, 3))
+    x = tf.keras.layers.Conv2D(4, 3, strides=4, activation="relu")(inputs)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(classes, activation="softmax")(x)
+    tf.keras.Model(inputs, outputs).save(path)
+    return True
@@ -0,0 +1,402 @@
+"""Load test of the whole API under per-endpoint and mixed workloads, written to a JSON file to diff across commits.
+
+Boots main:app under uvicorn on a seeded SQLite stand-in (or DB_URL, e.g. a
+local MySQL) with every external service offline: stub transcription and TTS,
+the fake chat backend, SMS to the log and, when TensorFlow is installed, a tiny
+dummy Keras model. OTP throttles are lifted so the handlers are measured, not
+the limiter. Each scenario is driven by --concurrency async clients for
+--duration seconds, then all of them at once by weight. Reports req/s,
+p50/p95/p99, SQL statements per request (from /metrics) and the server's RSS:
+
+    python benchmarks/api_load.py --duration 10 --concurrency 32
+    python benchmarks/api_load.py --compare benchmarks/results/api_load-abc1234.json benchmarks/results/api_load-def5678.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+from _common import APP_DIR, build_dummy_model, free_port, run_load, start_server, use_app_path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+PRODUCE = ["apple", "mango", "rice", "maize", "tomato", "potato", "ginger", "cardamom", "milk", "goat",
+           "orange", "banana", "cauliflower", "cabbage", "lentil", "wheat", "honey", "tea", "coffee", "garlic"]
+PROMPTS = ["How much does it cost to grow {} on one ropani?", "When should I plant {} in the terai?",
+           "What fertilizer is best for {}?"]
+
+# Share of each scenario in the mixed workload
+MIX = {
+    "browse": 25, "product_read": 20, "search": 10, "nearby": 5, "farmer_me": 10, "product_crud": 6,
+    "image_upload": 6, "disease_detect": 6, "chat": 6, "auth_otp": 6,
+}
+
+
+class Fixture:
+    """Seeded accounts and products the scenarios pick from, by request number."""
+
+    def __init__(self, farmers: list, product_ids: list, images: list, places: list):
+        self.farmers = farmers
+        self.product_ids = product_ids
+        self.images = images
+        self.places = places
+
+    def auth(self, i: int) -> dict:
+        # Sent as the cookie the web client gets from /farmer/verify-otp, chat keys users by it
+        return {"Cookie": f"access_token={self.farmers[i % len(self.farmers)]['token']}"}
+
+    def product_id(self, i: int) -> int:
+        return self.product_ids[(i * 7919) % len(self.product_ids)]
+
+
+async def browse(client, fx, i):
+    params = {"limit": 20}
+    if i % 2:
+        params["category"] = CATEGORIES[i % len(CATEGORIES)]
+    if i % 3 == 0:
+        params["sort"] = "price"
+    return await client.get("/products", params=params)
+
+
+async def product_read(client, fx, i):
+    return await client.get(f"/products/{fx.product_id(i)}")
+
+
+async def search(client, fx, i):
+    return await client.get("/products/search", params={"q": PRODUCE[i % len(PRODUCE)]})
+
+
+async def nearby(client, fx, i):
+    params = {"location": fx.places[i % len(fx.places)], "k": 20}
+    if i % 2:
+        params["category"] = CATEGORIES[i % len(CATEGORIES)]
+    return await client.get("/products/nearby", params=params)
+
+
+async def farmer_me(client, fx, i):
+    return await client.get("/farmer/me", headers=fx.auth(i))
+
+
+async def product_crud(client, fx, i):
+    headers = fx.auth(i)
+    produce = PRODUCE[i % len(PRODUCE)]
+    response = await client.post("/products", headers=headers, json={
+        "title": f"Fresh {produce}", "description": f"Organic {produce} from the farm", "price": 100 + i % 500,
+        "category": CATEGORIES[i % len(CATEGORIES)], "image": "uploads/products/placeholder.jpg",
+    })
+    if response.status_code != 201:
+        return response
+    product_id = response.json()["id"]
+    for response in (
+        await client.put(f"/products/{product_id}", headers=headers, json={"price": 120 + i % 500}),
+        await client.get(f"/products/{product_id}"),
+        await client.delete(f"/products/{product_id}", headers=headers),
+    ):
+        if response.status_code >= 400:
+            return response
+    return response
+
+
+async def image_upload(client, fx, i):
+    return await client.post("/upload/product-image/",
+                             files={"file": (f"photo{i}.jpg", fx.images[i % len(fx.images)], "image/jpeg")})
+
+
+async def disease_detect(client, fx, i):
+    return await client.post("/diseases-detect",
+                             files={"file": (f"leaf{i}.jpg", fx.images[i % len(fx.images)], "image/jpeg")})
+
+
+async def chat(client, fx, i):
+    prompt = PROMPTS[i % len(PROMPTS)].format(PRODUCE[i % len(PRODUCE)])
+    return await client.post("/chat", headers=fx.auth(i), json={"message": prompt})
+
+
+async def auth_otp(client, fx, i):
+    phone = fx.farmers[i % len(fx.farmers)]["phone"]
+    response = await client.post("/farmer/request-otp", params={"phone": phone})
+    if response.status_code != 200:
+        return response
+    return await client.post("/farmer/verify-otp", json={"phone": phone, "otp_code": response.json()["otp"]})
+
+
+SCENARIOS = {
+    "browse": browse, "product_read": product_read, "search": search, "nearby": nearby, "farmer_me": farmer_me,
+    "product_crud": product_crud, "image_upload": image_upload, "disease_detect": disease_detect, "chat": chat,
+    "auth_otp": auth_otp,
+}
+
+
+def mixed(scenarios: dict):
+    names = [name for name in MIX if name in scenarios]
+    weights = [MIX[name] for name in names]
+    rng = random.Random(0)
+
+    async def request(client, fx, i):
+        return await scenarios[rng.choices(names, weights)[0]](client, fx, i)
+    return request
+
+
+def make_images(count: int, size=(640, 480)) -> list:
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 255, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize(size).save(buffer, "JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def seed(farmers: int, users: int, products: int) -> Fixture:
+    use_app_path()
+    from sqlalchemy import insert, select
+    from database import create_db_and_tables, engine
+    from models import Farmer, Products, Users
+    from services.geo import gazetteer, location_values
+    from utils import create_access_token
+
+    rng = random.Random(0)
+    places = sorted({place.name: place for place in gazetteer.places.values()}.values(), key=lambda p: p.name)
+    create_db_and_tables()
+    farmer_places = [rng.choice(places) for _ in range(farmers)]
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [
+            {"phone": f"98{i:08d}", "name": f"Farmer {i}", "location": place.name, "verified": True,
+             **location_values(place.latitude, place.longitude)}
+            for i, place in enumerate(farmer_places)
+        ])
+        conn.execute(insert(Users), [
+            {"phone": f"97{i:08d}", "name": f"User {i}", "location": place.name, "verified": True,
+             "latitude": place.latitude, "longitude": place.longitude}
+            for i, place in ((i, rng.choice(places)) for i in range(users))
+        ])
+        accounts = conn.execute(select(Farmer.id, Farmer.phone, Farmer.latitude, Farmer.longitude)).all()
+
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for offset in range(0, products, 10000):
+        values = []
+        for i in range(offset, min(products, offset + 10000)):
+            farmer = accounts[rng.randrange(len(accounts))]
+            produce = rng.choice(PRODUCE)
+            values.append({
+                "title": f"{rng.choice(['Fresh', 'Organic', 'Local'])} {produce} lot {i}",
+                "description": f"{produce.capitalize()} grown without chemicals, harvested this week",
+                "price": round(rng.uniform(10, 2000), 2),
+                "category": rng.choice(CATEGORIES),
+                "image": f"uploads/products/{i:06d}.jpg",
+                "created_at": start + timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                "farmer_id": farmer.id,
+                **location_values(farmer.latitude, farmer.longitude),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Products), values)
+    with engine.connect() as conn:
+        product_ids = conn.execute(select(Products.id)).scalars().all()
+
+    return Fixture(
+        [{"phone": row.phone, "token": create_access_token(row.id, row.phone)} for row in accounts],
+        product_ids,
+        images=[],
+        places=[place.name for place in places],
+    )
+
+
+def rss_mb(pid: int) -> dict:
+    values = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                values[line.split(":")[0]] = round(int(line.split()[1]) / 1024, 1)
+    return {"rss_mb": values.get("VmRSS", 0.0), "peak_rss_mb": values.get("VmHWM", 0.0)}
+
+
+def db_query_totals(metrics: str) -> dict:
+    totals = {}
+    for kind, route, value in re.findall(
+        r'^khetai_db_queries_per_request_(sum|count)\{route="([^"]*)"\} (\S+)$', metrics, re.M
+    ):
+        totals.setdefault(route, {"sum": 0.0, "count": 0.0})[kind] = float(value)
+    return totals
+
+
+def queries_per_request(before: dict, after: dict) -> dict:
+    result = {}
+    for route, totals in after.items():
+        if route == "/metrics":
+            continue
+        count = totals["count"] - before.get(route, {}).get("count", 0.0)
+        if count:
+            result[route] = round((totals["sum"] - before.get(route, {}).get("sum", 0.0)) / count, 2)
+    return dict(sorted(result.items()))
+
+
+async def wait_for_search_index(client, timeout: float = 120):
+    # The first start builds the search index in the background
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = await client.get("/products/search", params={"q": PRODUCE[0]})
+        if response.status_code == 200 and response.json()["items"]:
+            return
+        await asyncio.sleep(0.5)
+
+
+async def drive(port: int, pid: int, fx: Fixture, scenarios: dict, args) -> dict:
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        await wait_for_search_index(client)
+        runs = [(name, scenarios[name]) for name in args.scenarios if name in scenarios]
+        if "mixed" in args.scenarios:
+            runs.append(("mixed", mixed(scenarios)))
+        for name, scenario in runs:
+            # One short pass first, so caches, pools and the model are warm for every scenario alike
+            await run_load(client, lambda c, i: scenario(c, fx, i), args.concurrency, args.warmup)
+            statuses = Counter()
+
+            async def request(c, i, scenario=scenario):
+                response = await scenario(c, fx, i)
+                statuses[str(response.status_code)] += 1
+                return response
+
+            before = db_query_totals((await client.get("/metrics")).text)
+            summary = await run_load(client, request, args.concurrency, args.duration)
+            after = db_query_totals((await client.get("/metrics")).text)
+            results[name] = {**summary, "statuses": dict(sorted(statuses.items())),
+                             "db_queries_per_request": queries_per_request(before, after), **rss_mb(pid)}
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=APP_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="khetai-api-bench-"))
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{workdir / 'bench.db'}"),
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        "TRANSCRIPTION_BACKEND": "stub",
+        "TTS_BACKEND": "stub",
+        "TTS_PREGENERATE": "false",
+        "CHAT_BACKEND": "fake",
+        "SMS_BACKEND": "log",
+        "OTP_EXPOSE_CODE": "true",
+        "OTP_PHONE_BURST": "1000000",
+        "OTP_IP_BURST": "1000000",
+        "PRICE_INGEST_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "MODEL_WARMUP": "background",
+    }
+    os.environ.update(env)
+
+    started = time.perf_counter()
+    fx = seed(args.farmers, args.users, args.products)
+    fx.images = make_images(args.images)
+    seed_s = round(time.perf_counter() - started, 1)
+
+    scenarios = dict(SCENARIOS)
+    skipped = {}
+    with open(APP_DIR / "class_indices.json") as f:
+        classes = len(json.load(f))
+    if build_dummy_model(workdir / "model.keras", classes):
+        env["MODEL_PATH"] = str(workdir / "model.keras")
+    else:
+        del scenarios["disease_detect"]
+        skipped["disease_detect"] = "TensorFlow is not installed, no dummy model could be built"
+        env["MODEL_WARMUP"] = "lazy"
+
+    port = free_port()
+    # Uploads, the task queue and the search index are written under the working directory
+    server = start_server("main:app", port, env=env, cwd=workdir)
+    try:
+        results = asyncio.run(drive(port, server.pid, fx, scenarios, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "db": env["DB_URL"].split(":", 1)[0], "concurrency": args.concurrency, "duration_s": args.duration,
+            "farmers": args.farmers, "users": args.users, "products": args.products, "seed_s": seed_s,
+        },
+        "skipped": skipped,
+        "scenarios": results,
+    }
+
+
+def compare(old_path: str, new_path: str) -> dict:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def change(before, after):
+        return f"{(after - before) / before * 100:+.1f}%" if before else None
+
+    scenarios = {}
+    for name, after in new["scenarios"].items():
+        before = old["scenarios"].get(name)
+        if before is None:
+            continue
+        scenarios[name] = {
+            key: {"old": before[key], "new": after[key], "change": change(before[key], after[key])}
+            for key in ("req_per_s", "p50_ms", "p95_ms", "p99_ms", "rss_mb")
+        }
+        scenarios[name]["db_queries_per_request"] = {
+            route: {"old": before["db_queries_per_request"].get(route), "new": queries}
+            for route, queries in after["db_queries_per_request"].items()
+            if before["db_queries_per_request"].get(route) != queries
+        }
+    return {"old": old["commit"], "new": new["commit"], "scenarios": scenarios}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=[*SCENARIOS, "mixed"],
+                        choices=[*SCENARIOS, "mixed"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--farmers", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--output", help="defaults to benchmarks/results/api_load-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two result files instead")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    results = run(args)
+    output = Path(args.output) if args.output else RESULTS_DIR / f"api_load-{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(json.dumps(results, indent=2))
+    print(f"Written to {output}")
+
+
+if __name__ == "__main__":
+    main()
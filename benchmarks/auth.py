@@ -0,0 +1,123 @@
+"""Load test of GET /farmer/me with per-request lookups vs the cached principal.
+
+Serves the old handler (decode the cookie, then select the farmer by phone on
+every request) next to the shared auth dependency, signs in as seeded farmers
+and reports latency plus SQL statements per request from /metrics:
+
+    python benchmarks/auth.py --farmers 200 --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+
+import httpx
+
+from _common import free_port, run_load, start_server, use_app_path
+
+
+def create_app():
+    use_app_path()
+    from fastapi import Depends, FastAPI, HTTPException, Request
+    from fastapi.responses import Response
+    from sqlmodel import Session, select
+    from database import get_session
+    from metrics import MetricsMiddleware, render
+    from models import Farmer
+    from utils import Principal, get_current_farmer, verify_access_token
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/legacy/farmer/me")
+    def legacy_current_farmer(request: Request, session: Session = Depends(get_session)):
+        token = request.cookies.get("access_token")
+        if not token:
+            raise HTTPException(status_code=401, detail="Access token missing")
+        phone = verify_access_token(token)
+        farmer = session.exec(select(Farmer).where(Farmer.phone == phone)).first()
+        if not farmer:
+            raise HTTPException(status_code=404, detail="Farmer not found")
+        return {"id": farmer.id, "phone": farmer.phone, "name": farmer.name, "location": farmer.location,
+                "verified": farmer.verified}
+
+    @app.get("/farmer/me")
+    async def read_current_farmer(farmer: Principal = Depends(get_current_farmer)):
+        return farmer.to_dict()
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(render(), media_type="text/plain")
+
+    return app
+
+
+def seed(farmers: int) -> list:
+    use_app_path()
+    from sqlalchemy import insert, select
+    from database import create_db_and_tables, engine
+    from models import Farmer
+    from utils import create_access_token
+
+    create_db_and_tables()
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [
+            {"phone": f"98{i:08d}", "name": f"Farmer {i}", "location": "Chitwan", "verified": True}
+            for i in range(farmers)
+        ])
+        rows = conn.execute(select(Farmer.id, Farmer.phone)).all()
+    return [create_access_token(row.id, row.phone) for row in rows]
+
+
+def queries_per_request(metrics: str, route: str) -> float:
+    def sample(name):
+        match = re.search(rf'^khetai_db_queries_per_request_{name}{{route="{re.escape(route)}"}} (\S+)$', metrics, re.M)
+        return float(match.group(1)) if match else 0.0
+    count = sample("count")
+    return round(sample("sum") / count, 3) if count else 0.0
+
+
+async def drive(port: int, path: str, tokens: list, concurrency: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        async def request(client, i):
+            return await client.get(path, headers={"Cookie": f"access_token={tokens[i % len(tokens)]}"})
+        result = await run_load(client, request, concurrency, duration)
+        result["db_queries_per_request"] = queries_per_request((await client.get("/metrics")).text, path)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--farmers", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="khetai-auth-bench-")
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}"),
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        # Importing the services package sets up transcription, keep it offline
+        "TRANSCRIPTION_BACKEND": "stub",
+    }
+    os.environ.update(env)
+    tokens = seed(args.farmers)
+
+    port = free_port()
+    server = start_server("auth:create_app", port, env=env, factory=True)
+    try:
+        results = {}
+        for name, path in (("per_request_lookup", "/legacy/farmer/me"), ("cached_principal", "/farmer/me")):
+            results[name] = asyncio.run(drive(port, path, tokens, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Load test of product reads through the sync Session vs the AsyncSession engine.
+
+Seeds a local SQLite stand-in (or uses DB_URL / DB_ASYNC_URL for MySQL) and
+drives GET /products/{id} in both modes with concurrent clients:
+
+    python benchmarks/db_load.py --rows 10000 --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+
+import httpx
+
+from _common import free_port, run_load, start_server, use_app_path
+
+
+def create_app():
+    use_app_path()
+    from fastapi import Depends, FastAPI, HTTPException
+    from sqlmodel import Session
+    from database import get_session, get_async_session
+    from models import Products
+
+    app = FastAPI()
+
+    @app.get("/sync/products/{product_id}")
+    def read_product_sync(product_id: int, session: Session = Depends(get_session)):
+        product = session.get(Products, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product
+
+    @app.get("/async/products/{product_id}")
+    async def read_product_async(product_id: int, session=Depends(get_async_session)):
+        product = await session.get(Products, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product
+
+    return app
+
+
+def seed(rows: int):
+    use_app_path()
+    from sqlalchemy import insert
+    from database import create_db_and_tables, engine
+    from models import Farmer, Products
+
+    create_db_and_tables()
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [{"phone": "9800000000", "name": "Bench", "location": "Kathmandu", "verified": True}])
+        farmer_id = conn.execute(Farmer.__table__.select()).first().id
+        for start in range(0, rows, 5000):
+            conn.execute(insert(Products), [
+                {"title": f"Product {i}", "description": "Fresh produce", "price": random.uniform(10, 500),
+                 "category": "Vegetables", "image": "", "farmer_id": farmer_id}
+                for i in range(start, min(rows, start + 5000))
+            ])
+
+
+async def drive(port: int, mode: str, rows: int, concurrency: int, duration: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        async def request(client, i):
+            return await client.get(f"/{mode}/products/{i % rows + 1}")
+        return await run_load(client, request, concurrency, duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="khetai-db-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{db_path}"),
+        "DB_ASYNC_URL": os.environ.get("DB_ASYNC_URL", f"sqlite+aiosqlite:///{db_path}"),
+        "DB_ASYNC": "true",
+        "DB_ECHO": "false",
+    }
+    os.environ.update(env)
+    seed(args.rows)
+
+    port = free_port()
+    server = start_server("db_load:create_app", port, env=env, factory=True)
+    try:
+        results = {}
+        for mode in ("sync", "async"):
+            results[mode] = asyncio.run(drive(port, mode, args.rows, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Latency of nearby product searches over products spread across Nepal.
+
+Seeds --farmers farmers around the gazetteer's places (jittered by a few km)
+and --rows products among them on a SQLite stand-in, then times k-nearest and
+fixed-radius searches from random places, with and without a category, against
+a scan that orders every row by distance:
+
+    python benchmarks/geo_nearby.py --rows 1000000 --queries 200
+"""
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from _common import percentile, use_app_path
+
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+
+
+def seed(engine, places: list, farmers: int, rows: int, batch: int = 50000):
+    from sqlalchemy import insert
+    from models import Farmer, Products
+    from services.geo import location_values
+
+    rng = random.Random(0)
+    points = []
+    for _ in range(farmers):
+        place = rng.choice(places)
+        points.append((place.latitude + rng.gauss(0, 0.05), place.longitude + rng.gauss(0, 0.05)))
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [
+            {"phone": f"98{i:08d}", "name": f"Farmer {i}", "location": "seeded", "verified": True,
+             **location_values(lat, lon)}
+            for i, (lat, lon) in enumerate(points)
+        ])
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for offset in range(0, rows, batch):
+        values = []
+        for i in range(offset, min(rows, offset + batch)):
+            farmer = rng.randrange(farmers)
+            values.append({
+                "title": f"Lot {i}",
+                "price": round(rng.uniform(10, 2000), 2),
+                "category": rng.choice(CATEGORIES),
+                "image": "",
+                "created_at": start + timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                "farmer_id": farmer + 1,
+                **location_values(*points[farmer]),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Products), values)
+
+
+def timed(queries: list, fn) -> dict:
+    latencies, found = [], 0
+    for lat, lon, category in queries:
+        started = time.perf_counter()
+        found += len(fn(lat, lon, category))
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "avg_results": round(found / len(queries), 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--farmers", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--radius-km", type=float, default=25)
+    parser.add_argument("--scan-queries", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='khetai-geo-bench-'), 'bench.db')}"
+    os.environ.setdefault("DB_ECHO", "false")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+    # Importing the services package sets up transcription, keep it offline
+    os.environ.setdefault("TRANSCRIPTION_BACKEND", "stub")
+    use_app_path()
+    from sqlalchemy import select
+    from sqlmodel import Session
+    from config import NEARBY_MAX_RADIUS_KM
+    from database import create_db_and_tables, engine
+    from models import Products
+    from services.geo import gazetteer, nearest
+    from services.product_listing import SUMMARY_COLUMNS
+
+    places = sorted(set(gazetteer.places.values()), key=lambda place: place.name)
+    create_db_and_tables()
+    started = time.perf_counter()
+    seed(engine, places, args.farmers, args.rows)
+    results = {"rows": args.rows, "farmers": args.farmers, "seed_s": round(time.perf_counter() - started, 1)}
+
+    rng = random.Random(1)
+    origins = [(place.latitude + rng.gauss(0, 0.1), place.longitude + rng.gauss(0, 0.1))
+               for place in (rng.choice(places) for _ in range(args.queries))]
+    plain = [(lat, lon, None) for lat, lon in origins]
+    by_category = [(lat, lon, rng.choice(CATEGORIES)) for lat, lon in origins]
+
+    with Session(engine) as session:
+        def filters(category):
+            return [Products.category == category] if category else []
+
+        def k_nearest(lat, lon, category):
+            return nearest(session, Products, SUMMARY_COLUMNS, lat, lon, args.k, NEARBY_MAX_RADIUS_KM,
+                           filters(category))
+
+        def radius(lat, lon, category):
+            return nearest(session, Products, SUMMARY_COLUMNS, lat, lon, args.k, args.radius_km, filters(category))
+
+        def scan(lat, lon, category):
+            # What the query costs without the grid: every row is ordered by distance
+            coslat = math.cos(math.radians(lat))
+            d2 = ((Products.latitude - lat) * (Products.latitude - lat)
+                  + (Products.longitude - lon) * coslat * (Products.longitude - lon) * coslat)
+            return session.exec(
+                select(*SUMMARY_COLUMNS).where(*filters(category)).order_by(d2).limit(args.k)
+            ).all()
+
+        results["k_nearest"] = timed(plain, k_nearest)
+        results["k_nearest_category"] = timed(by_category, k_nearest)
+        results[f"radius_{args.radius_km:g}km"] = timed(plain, radius)
+        results[f"radius_{args.radius_km:g}km_category"] = timed(by_category, radius)
+        results["full_scan"] = timed(plain[:args.scan_queries], scan)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Total memory and /diseases-detect throughput of gunicorn deployments with 1, 4 and 8 API workers.
+
+Every worker count is run twice through app/gunicorn.conf.py: INFERENCE_MODE=local,
+where each worker loads its own copy of the model, and INFERENCE_MODE=remote,
+where the workers send decoded images to one inference server process. RSS and
+PSS (shared pages split between the processes sharing them) are summed over
+the master, the workers and the inference servers once the load has run. Uses
+--model, or a tiny dummy Keras model when none is given (so RSS is mostly the
+TensorFlow runtime), and needs TensorFlow either way:
+
+    python benchmarks/inference_workers.py --workers 1 4 8 --duration 15 --concurrency 32
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from _common import APP_DIR, build_dummy_model, free_port, run_load, use_app_path
+
+
+def make_image() -> bytes:
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.random.default_rng(0).integers(0, 255, (60, 80, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize((640, 480)).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def process_tree(root: int) -> list:
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def memory_mb(pids: list) -> dict:
+    totals = {"Rss": 0, "Pss": 0}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    key = line.split(":")[0]
+                    if key in totals:
+                        totals[key] += int(line.split()[1])
+        except OSError:
+            continue
+    return {"processes": len(pids), "rss_mb": round(totals["Rss"] / 1024, 1), "pss_mb": round(totals["Pss"] / 1024, 1)}
+
+
+def start_gunicorn(port: int, workers: int, env: dict, cwd: Path) -> subprocess.Popen:
+    command = [sys.executable, "-m", "gunicorn", "-c", str(APP_DIR / "gunicorn.conf.py"), "main:app",
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning"]
+    pythonpath = os.pathsep.join(filter(None, [str(APP_DIR), os.environ.get("PYTHONPATH")]))
+    proc = subprocess.Popen(command, cwd=cwd, env={**os.environ, **env, "PYTHONPATH": pythonpath})
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {proc.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code < 500:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("gunicorn did not start within 300s")
+
+
+async def drive(port: int, image: bytes, args) -> tuple:
+    async def detect(client, i):
+        # Bytes after the JPEG end marker are ignored by the decoder but change the cache key
+        data = image + i.to_bytes(8, "big") + os.urandom(4)
+        return await client.post("/diseases-detect", files={"file": ("leaf.jpg", data, "image/jpeg")})
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        # Long enough for every local-mode worker to load its model
+        await run_load(client, detect, args.concurrency, args.warmup)
+        return await run_load(client, detect, args.concurrency, args.duration)
+
+
+def measure(mode: str, workers: int, model: Path, image: bytes, args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="khetai-inference-bench-"))
+    env = {
+        "DB_URL": f"sqlite:///{workdir / 'bench.db'}",
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        "TRANSCRIPTION_BACKEND": "stub",
+        "TTS_BACKEND": "stub",
+        "TTS_PREGENERATE": "false",
+        "CHAT_BACKEND": "fake",
+        "SMS_BACKEND": "log",
+        "PRICE_INGEST_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "MODEL_PATH": str(model),
+        "MODEL_WARMUP": "background",
+        "INFERENCE_MODE": mode,
+        "INFERENCE_SOCKETS": str(workdir / "inference.sock"),
+        "GUNICORN_PRELOAD": "true" if args.preload else "false",
+    }
+    port = free_port()
+    server = start_gunicorn(port, workers, env, workdir)
+    try:
+        load = asyncio.run(drive(port, image, args))
+        memory = memory_mb(process_tree(server.pid))
+    finally:
+        tree = process_tree(server.pid)
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        # The next run only starts once this one's workers and inference servers are gone
+        deadline = time.time() + 60
+        while any(os.path.exists(f"/proc/{pid}") for pid in tree) and time.time() < deadline:
+            time.sleep(0.2)
+    return {"mode": mode, "workers": workers, **load, **memory}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--modes", nargs="+", default=["local", "remote"], choices=["local", "remote"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--preload", action="store_true", help="import the app in the gunicorn master")
+    parser.add_argument("--model", type=Path, help="Keras model to serve, a tiny dummy model by default")
+    args = parser.parse_args()
+
+    use_app_path()
+    model = args.model
+    if model is None:
+        model = Path(tempfile.mkdtemp(prefix="khetai-dummy-model-")) / "model.keras"
+        with open(APP_DIR / "class_indices.json") as f:
+            if not build_dummy_model(model, len(json.load(f))):
+                sys.exit("TensorFlow is required to build the dummy model")
+    image = make_image()
+
+    results = {"cpus": os.cpu_count(), "preload": args.preload, "model": str(args.model or "dummy"), "runs": []}
+    for workers in args.workers:
+        for mode in args.modes:
+            results["runs"].append(measure(mode, workers, model, image, args))
+            print(json.dumps(results["runs"][-1]), file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
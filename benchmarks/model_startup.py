@@ -0,0 +1,88 @@
+"""Compare cold start, RSS and per-image latency of the model backends.
+
+Every backend is measured in a fresh interpreter so import and load costs are
+not shared between runs:
+
+    python benchmarks/model_startup.py --backends keras tflite --iterations 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def measure(backend_name: str, iterations: int) -> dict:
+    sys.path.insert(0, str(APP_DIR))
+    baseline_rss = rss_mb()
+    started = time.perf_counter()
+
+    import numpy as np
+    from services.model_runtime import ModelRuntime, INPUT_SHAPE
+
+    runtime = ModelRuntime(backend_name)
+    runtime.get()
+    loaded = time.perf_counter()
+    runtime.warm_up()
+    first_prediction = time.perf_counter()
+
+    image = np.random.rand(1, *INPUT_SHAPE).astype(np.float32)
+    latencies = []
+    for _ in range(iterations):
+        t = time.perf_counter()
+        runtime.predict(image)
+        latencies.append((time.perf_counter() - t) * 1000)
+    latencies.sort()
+
+    return {
+        "backend": backend_name,
+        "load_s": round(loaded - started, 3),
+        "cold_start_s": round(first_prediction - started, 3),
+        "rss_mb": round(rss_mb() - baseline_rss, 1),
+        "latency_p50_ms": round(latencies[len(latencies) // 2], 2),
+        "latency_p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["keras", "tflite"])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.iterations)))
+        return
+
+    results = []
+    for backend in args.backends:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", backend, "--iterations", str(args.iterations)],
+            capture_output=True, text=True, env={**os.environ, "TF_CPP_MIN_LOG_LEVEL": "3"},
+        )
+        if proc.returncode != 0:
+            print(f"{backend}: failed\n{proc.stderr.strip()}", file=sys.stderr)
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    columns = ["backend", "load_s", "cold_start_s", "rss_mb", "latency_p50_ms", "latency_p95_ms"]
+    print("  ".join(f"{c:>15}" for c in columns))
+    for row in results:
+        print("  ".join(f"{row[c]:>15}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Micro-benchmark of image preprocessing for typical phone-camera JPEGs.
+
+Compares the original open/resize/astype pipeline against the decode-once
+pipeline in services.image_preprocessing:
+
+    python benchmarks/preprocessing.py --iterations 20
+"""
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from services.image_preprocessing import BatchBuffer, decode_image  # noqa: E402
+
+PHONE_SIZES = {
+    "vga_640x480": (640, 480),
+    "1080p_1920x1080": (1920, 1080),
+    "8mp_3264x2448": (3264, 2448),
+    "12mp_4032x3024": (4032, 3024),
+}
+
+
+def make_jpeg(size, quality=90) -> bytes:
+    width, height = size
+    # Smooth gradients plus noise compress roughly like a leaf photo does
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rng = np.random.default_rng(0)
+    pixels = np.stack([(x + y) / 2, np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width))], axis=-1)
+    pixels = np.clip(pixels + rng.normal(0, 12, pixels.shape), 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def legacy_pipeline(data: bytes, target_size=(224, 224)):
+    img = Image.open(io.BytesIO(data))
+    img = img.resize(target_size)
+    img_array = np.array(img)
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array.astype('float32') / 255.
+
+
+def make_decode_once_pipeline():
+    buffer = BatchBuffer(1)
+
+    def pipeline(data: bytes):
+        return buffer.fill([decode_image(data)])
+    return pipeline
+
+
+def bench(fn, data, iterations) -> float:
+    fn(data)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(data)
+    return (time.perf_counter() - started) / iterations * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    decode_once = make_decode_once_pipeline()
+    print(f"{'image':>18} {'jpeg_kb':>8} {'legacy_ms':>10} {'decode_once_ms':>15} {'speedup':>8}")
+    for name, size in PHONE_SIZES.items():
+        data = make_jpeg(size)
+        legacy_ms = bench(legacy_pipeline, data, args.iterations)
+        new_ms = bench(decode_once, data, args.iterations)
+        print(f"{name:>18} {len(data) / 1024:>8.0f} {legacy_ms:>10.2f} {new_ms:>15.2f} {legacy_ms / new_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
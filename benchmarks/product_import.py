@@ -0,0 +1,160 @@
+"""Rows/sec of the bulk product import vs one POST /products per row.
+
+Serves the per-request handler (insert, commit, refresh) next to the chunked
+import, creates --per-request-rows products one request at a time from
+--concurrency clients, then uploads --rows products as one CSV and one NDJSON
+file:
+
+    python benchmarks/product_import.py --rows 100000 --per-request-rows 5000
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+import httpx
+
+from _common import free_port, start_server, use_app_path
+
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+
+
+def create_app():
+    use_app_path()
+    from fastapi import Depends, FastAPI, File, UploadFile
+    from sqlmodel import Session
+    from database import engine, get_session
+    from models import Products
+    from schemas import ProductCreate
+    from services.product_bulk import detect_format, import_products
+    from utils import get_current_farmer_id
+
+    app = FastAPI()
+
+    @app.post("/products", status_code=201)
+    def create_product(product: ProductCreate, session: Session = Depends(get_session),
+                       farmer_id: int = Depends(get_current_farmer_id)):
+        new_product = Products(title=product.title, description=product.description, price=product.price,
+                               category=product.category, image=product.image or "", farmer_id=farmer_id)
+        session.add(new_product)
+        session.commit()
+        session.refresh(new_product)
+        return new_product
+
+    @app.post("/products/import")
+    def import_products_file(file: UploadFile = File(...), farmer_id: int = Depends(get_current_farmer_id)):
+        return import_products(engine, farmer_id, file.file, detect_format(file.filename), max_rows=10 ** 7).to_dict()
+
+    return app
+
+
+def seed_farmer() -> str:
+    use_app_path()
+    from sqlmodel import Session
+    from database import create_db_and_tables, engine
+    from models import Farmer
+    from utils import create_access_token
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        farmer = Farmer(phone="9800000000", name="Cooperative", location="Chitwan", verified=True)
+        session.add(farmer)
+        session.commit()
+        return create_access_token(farmer.id, farmer.phone, expires_delta=timedelta(hours=1))
+
+
+def products(count: int):
+    rng = random.Random(0)
+    for i in range(count):
+        yield {
+            "title": f"Product {i}",
+            "description": "Fresh produce from the cooperative",
+            "price": round(rng.uniform(10, 2000), 2),
+            "category": rng.choice(CATEGORIES),
+            "image": f"uploads/products/{i}.jpg",
+        }
+
+
+def as_csv(count: int) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=["title", "description", "price", "category", "image"])
+    writer.writeheader()
+    writer.writerows(products(count))
+    return buffer.getvalue().encode()
+
+
+def as_ndjson(count: int) -> bytes:
+    return "".join(json.dumps(row) + "\n" for row in products(count)).encode()
+
+
+async def per_request(port: int, headers: dict, rows: int, concurrency: int) -> dict:
+    queue = asyncio.Queue()
+    for row in products(rows):
+        queue.put_nowait(row)
+    errors = 0
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers=headers, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                response = await client.post("/products", json=queue.get_nowait())
+                errors += response.status_code != 201
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"rows": rows, "errors": errors, "seconds": round(elapsed, 2), "rows_per_s": round(rows / elapsed, 1)}
+
+
+def bulk(port: int, headers: dict, filename: str, body: bytes, rows: int) -> dict:
+    started = time.perf_counter()
+    response = httpx.post(f"http://127.0.0.1:{port}/products/import", headers=headers, timeout=600,
+                          files={"file": (filename, body)})
+    elapsed = time.perf_counter() - started
+    report = response.json()
+    return {"rows": rows, "imported": report["imported"], "failed": report["failed"], "seconds": round(elapsed, 2),
+            "rows_per_s": round(report["imported"] / elapsed, 1), "upload_mb": round(len(body) / 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--per-request-rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="khetai-import-bench-")
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}"),
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        # Importing the services package sets up transcription, keep it offline
+        "TRANSCRIPTION_BACKEND": "stub",
+    }
+    os.environ.update(env)
+    headers = {"Authorization": f"Bearer {seed_farmer()}"}
+
+    port = free_port()
+    server = start_server("product_import:create_app", port, env=env, factory=True)
+    try:
+        results = {
+            "per_request": asyncio.run(per_request(port, headers, args.per_request_rows, args.concurrency)),
+            "bulk_csv": bulk(port, headers, "products.csv", as_csv(args.rows), args.rows),
+            "bulk_ndjson": bulk(port, headers, "products.ndjson", as_ndjson(args.rows), args.rows),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+    results["speedup_csv"] = round(results["bulk_csv"]["rows_per_s"] / results["per_request"]["rows_per_s"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
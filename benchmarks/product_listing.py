@@ -0,0 +1,106 @@
+"""Keyset vs OFFSET pagination of the product listing on a large seeded table.
+
+Seeds a SQLite stand-in (or DB_URL) with --rows products, applies the listing
+indexes and times fetching one page at increasing depths both ways:
+
+    python benchmarks/product_listing.py --rows 1000000 --page-size 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from _common import use_app_path
+
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+DEPTHS = [1, 10, 100, 1000, 10000, 40000]
+
+
+def seed(engine, rows: int):
+    from sqlalchemy import func, insert, select
+    from models import Farmer, Products
+
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(Products)).scalar() >= rows:
+            return
+        conn.execute(insert(Farmer), [
+            {"phone": f"98{i:08d}", "name": f"Farmer {i}", "location": "Chitwan", "verified": True}
+            for i in range(1000)
+        ])
+        start = datetime(2025, 1, 1)
+        rng = random.Random(0)
+        for offset in range(0, rows, 20000):
+            conn.execute(insert(Products), [
+                {
+                    "title": f"Product {i}",
+                    "description": "Fresh produce " * 8,
+                    "price": round(rng.uniform(10, 2000), 2),
+                    "category": rng.choice(CATEGORIES),
+                    "image": f"uploads/products/{i}.jpg",
+                    "created_at": start + timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                    "farmer_id": rng.randrange(1000) + 1,
+                }
+                for i in range(offset, min(rows, offset + 20000))
+            ])
+
+
+def offset_page(session, page: int, page_size: int, category=None):
+    from sqlmodel import select
+    from models import Products
+    from services.product_listing import SUMMARY_COLUMNS
+
+    statement = select(*SUMMARY_COLUMNS)
+    if category:
+        statement = statement.where(Products.category == category)
+    statement = statement.order_by(Products.created_at.desc(), Products.id.desc())
+    return session.exec(statement.offset((page - 1) * page_size).limit(page_size)).all()
+
+
+def timed(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--category", default=None)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'khetai-listing-bench.db')}")
+    use_app_path()
+    from sqlmodel import Session
+    from database import create_db_and_tables, engine
+    from migrations import run_migrations
+    from services.product_listing import encode_cursor, list_products
+
+    create_db_and_tables()
+    run_migrations(engine)
+    started = time.perf_counter()
+    seed(engine, args.rows)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'page':>8} {'offset_ms':>10} {'keyset_ms':>10}")
+    with Session(engine) as session:
+        for page in DEPTHS:
+            if (page - 1) * args.page_size >= args.rows:
+                break
+            offset_ms = timed(lambda: offset_page(session, page, args.page_size, args.category))
+            cursor = None
+            if page > 1:
+                # The cursor a client would hold after reading page - 1
+                boundary = offset_page(session, page - 1, args.page_size, args.category)[-1]
+                cursor = encode_cursor("-created_at", boundary.created_at, boundary.id)
+            keyset_ms = timed(lambda: list_products(session, category=args.category, limit=args.page_size, cursor=cursor))
+            print(f"{page:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
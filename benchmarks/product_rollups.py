@@ -0,0 +1,146 @@
+"""Dashboard and category stats read from the product rollups against GROUP BY queries over products.
+
+Seeds --rows products among --farmers farmers on a SQLite stand-in, builds the
+rollups with `reconcile` (the cost of one reconciliation run), then times the
+farmer dashboard and market-wide category stats both ways, and single product
+writes with and without the session events that keep the rollups current:
+
+    python benchmarks/product_rollups.py --rows 1000000 --queries 200
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from _common import percentile, use_app_path
+
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+
+
+def seed(engine, farmers: int, rows: int, batch: int = 50000):
+    from sqlalchemy import insert
+    from models import Farmer, Products
+
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [
+            {"phone": f"98{i:08d}", "name": f"Farmer {i}", "location": "seeded", "verified": True}
+            for i in range(farmers)
+        ])
+    now = datetime.now(timezone.utc)
+    for offset in range(0, rows, batch):
+        with engine.begin() as conn:
+            conn.execute(insert(Products), [
+                {
+                    "title": f"Lot {i}",
+                    "price": round(rng.uniform(10, 2000), 2),
+                    "category": rng.choice(CATEGORIES),
+                    "image": "",
+                    "created_at": now - timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                    "farmer_id": rng.randrange(farmers) + 1,
+                }
+                for i in range(offset, min(rows, offset + batch))
+            ])
+
+
+def timed(calls: list, fn) -> dict:
+    latencies = []
+    for args in calls:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        "calls": len(calls),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--farmers", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--scan-queries", type=int, default=5)
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='khetai-rollup-bench-'), 'bench.db')}"
+    os.environ.setdefault("DB_ECHO", "false")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+    # Importing the services package sets up transcription, keep it offline
+    os.environ.setdefault("TRANSCRIPTION_BACKEND", "stub")
+    use_app_path()
+    from sqlalchemy import event, func, select
+    from sqlalchemy.orm import Session as OrmSession
+    from sqlmodel import Session
+    from database import create_db_and_tables, engine
+    from models import Products
+    from services import product_rollups
+
+    create_db_and_tables()
+    started = time.perf_counter()
+    seed(engine, args.farmers, args.rows)
+    results = {"rows": args.rows, "farmers": args.farmers, "seed_s": round(time.perf_counter() - started, 1)}
+    started = time.perf_counter()
+    results["reconcile_rows_written"] = product_rollups.reconcile(engine)
+    results["reconcile_s"] = round(time.perf_counter() - started, 2)
+    started = time.perf_counter()
+    results["reconcile_again_rows_written"] = product_rollups.reconcile(engine)
+    results["reconcile_again_s"] = round(time.perf_counter() - started, 2)
+
+    rng = random.Random(1)
+    farmers = [(rng.randrange(args.farmers) + 1,) for _ in range(args.queries)]
+    aggregates = (func.count(), func.avg(Products.price), func.min(Products.price), func.max(Products.price))
+
+    with engine.connect() as connection:
+        def rollup_dashboard(farmer_id):
+            product_rollups.category_stats(connection, farmer_id)
+            product_rollups.listings_per_day(connection, farmer_id, args.days)
+
+        def group_by_dashboard(farmer_id):
+            # What the dashboard costs without the rollups
+            connection.execute(
+                select(Products.category, *aggregates).where(Products.farmer_id == farmer_id)
+                .group_by(Products.category)
+            ).all()
+            day = product_rollups._listing_day_sql(engine.dialect.name)
+            since = datetime.now(timezone.utc) - timedelta(days=args.days)
+            connection.execute(
+                select(day, func.count()).where(Products.farmer_id == farmer_id, Products.created_at >= since)
+                .group_by(day)
+            ).all()
+
+        def rollup_market():
+            product_rollups.category_stats(connection)
+
+        def group_by_market():
+            connection.execute(select(Products.category, *aggregates).group_by(Products.category)).all()
+
+        results["dashboard_rollups"] = timed(farmers, rollup_dashboard)
+        results["dashboard_group_by"] = timed(farmers, group_by_dashboard)
+        results["category_stats_rollups"] = timed([()] * args.queries, rollup_market)
+        results["category_stats_group_by"] = timed([()] * args.scan_queries, group_by_market)
+
+    def create_product(farmer_id):
+        with Session(engine) as session:
+            session.add(Products(title="Lot", price=rng.uniform(10, 2000), category=rng.choice(CATEGORIES),
+                                 image="", farmer_id=farmer_id))
+            session.commit()
+
+    writes = [(rng.randrange(args.farmers) + 1,) for _ in range(args.writes)]
+    results["create_with_rollups"] = timed(writes, create_product)
+    event.remove(OrmSession, "before_flush", product_rollups._collect_product_writes)
+    event.remove(OrmSession, "after_flush", product_rollups._apply_product_writes)
+    results["create_without_rollups"] = timed(writes, create_product)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
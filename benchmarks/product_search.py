@@ -0,0 +1,76 @@
+"""Query latency of the in-process product search index at catalogue scale.
+
+Builds a synthetic English/Nepali catalogue, saves it as a memory-mapped
+segment, reloads it and times exact, prefix and typo queries:
+
+    python benchmarks/product_search.py --sizes 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from _common import percentile, use_app_path
+
+use_app_path()
+from services.product_search import ProductSearchIndex  # noqa: E402
+
+PRODUCE = [
+    "tomato", "potato", "onion", "cauliflower", "cabbage", "spinach", "cucumber", "pumpkin", "garlic",
+    "ginger", "apple", "orange", "banana", "mango", "rice", "maize", "millet", "lentil", "chili", "radish",
+    "गोलभेंडा", "आलु", "प्याज", "काउली", "बन्दा", "पालुंगो", "काक्रो", "फर्सी", "लसुन", "अदुवा",
+    "स्याउ", "सुन्तला", "केरा", "आँप", "चामल", "मकै", "कोदो", "दाल", "खुर्सानी", "मुला",
+]
+ADJECTIVES = ["fresh", "organic", "local", "ताजा", "अर्गानिक", "स्थानीय", "premium", "dried", "seasonal"]
+PLACES = ["chitwan", "kathmandu", "jhapa", "mustang", "ilam", "kaski", "चितवन", "झापा", "इलाम", "मुस्ताङ"]
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices"]
+QUERIES = {
+    "exact": ["tomato", "आलु", "organic apple", "ताजा काउली chitwan"],
+    "prefix": ["tom", "cauli", "काउ", "mus"],
+    "typo": ["tomatp", "potatoe", "cabagge", "spinch"],
+}
+
+
+def catalogue(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    for doc_id in range(1, size + 1):
+        item = rng.choice(PRODUCE)
+        title = f"{rng.choice(ADJECTIVES)} {item} {rng.randrange(1, 50)}kg"
+        description = f"{rng.choice(ADJECTIVES)} {item} from {rng.choice(PLACES)} {rng.choice(PRODUCE)}"
+        yield doc_id, title, description, rng.choice(CATEGORIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="khetai-search-bench-")
+    for size in args.sizes:
+        path = os.path.join(workdir, f"products-{size}.idx")
+        started = time.perf_counter()
+        ProductSearchIndex(path).rebuild(catalogue(size))
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = ProductSearchIndex(path)
+        load_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{size} products: build {build_s:.1f}s, index {os.path.getsize(path) / 1e6:.1f} MB, mmap load {load_ms:.0f} ms")
+
+        for kind, queries in QUERIES.items():
+            latencies = []
+            for _ in range(args.repeat):
+                for query in queries:
+                    t = time.perf_counter()
+                    index.search(query, 20)
+                    latencies.append((time.perf_counter() - t) * 1000)
+            latencies.sort()
+            print(f"  {kind:>6}: mean {statistics.mean(latencies):7.2f} ms  p50 {percentile(latencies, 50):7.2f} ms"
+                  f"  p99 {percentile(latencies, 99):7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Load test of GET /products/{id} uncached vs through the response cache.
+
+Serves the old handler (session per request, select, serialize) next to the
+cached one, reads a small hot set of product ids the way the app's product
+pages do, once with plain GETs and once revalidating with If-None-Match:
+
+    python benchmarks/response_cache.py --products 1000 --hot 50 --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+
+import httpx
+
+from _common import free_port, run_load, start_server, use_app_path
+
+
+def create_app():
+    use_app_path()
+    from fastapi import Depends, FastAPI, HTTPException, Request
+    from sqlmodel import Session
+    from database import engine, get_session
+    from models import Products
+    from services.response_cache import ResponseCache, cache_key, create_backend, version_etag
+
+    app = FastAPI()
+    cache = ResponseCache(create_backend(os.environ.get("RESPONSE_CACHE_BACKEND", "memory"), ttl=60,
+                                         url=os.environ.get("RESPONSE_CACHE_URL")))
+
+    @app.get("/uncached/products/{product_id}")
+    def read_product_uncached(product_id: int, session: Session = Depends(get_session)):
+        product = session.get(Products, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product
+
+    @app.get("/products/{product_id}")
+    async def read_product(product_id: int, request: Request):
+        def build():
+            with Session(engine) as session:
+                product = session.get(Products, product_id)
+                if not product:
+                    raise HTTPException(status_code=404, detail="Product not found")
+                return product.model_dump_json().encode(), version_etag(product.id, product.created_at)
+
+        return await cache.respond(request, cache_key("product", id=product_id), build)
+
+    @app.get("/cache/stats")
+    async def stats():
+        return cache.stats()
+
+    return app
+
+
+def seed(products: int):
+    use_app_path()
+    from sqlalchemy import insert
+    from database import create_db_and_tables, engine
+    from models import Farmer, Products
+
+    create_db_and_tables()
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [{"phone": "9800000000", "name": "Cooperative", "location": "Chitwan",
+                                       "verified": True}])
+        conn.execute(insert(Products), [
+            {"title": f"Product {i}", "description": "Fresh produce from the cooperative " * 8, "price": 100 + i,
+             "category": "Vegetables", "image": f"uploads/products/{i}.jpg", "farmer_id": 1}
+            for i in range(products)
+        ])
+
+
+async def drive(port: int, prefix: str, hot: int, concurrency: int, duration: float, revalidate: bool) -> dict:
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+        etags = {}
+
+        async def request(client, i):
+            product_id = i % hot + 1
+            headers = {"If-None-Match": etags[product_id]} if revalidate and product_id in etags else {}
+            response = await client.get(f"{prefix}/{product_id}", headers=headers)
+            if "etag" in response.headers:
+                etags[product_id] = response.headers["etag"]
+            return response
+
+        return await run_load(client, request, concurrency, duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--hot", type=int, default=50, help="Distinct product ids the clients read")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="khetai-response-cache-bench-")
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}"),
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        # Importing the services package sets up transcription, keep it offline
+        "TRANSCRIPTION_BACKEND": "stub",
+    }
+    os.environ.update(env)
+    seed(args.products)
+
+    port = free_port()
+    server = start_server("response_cache:create_app", port, env=env, factory=True)
+    try:
+        results = {}
+        for name, prefix, revalidate in (("uncached", "/uncached/products", False),
+                                         ("cached", "/products", False),
+                                         ("cached_304", "/products", True)):
+            results[name] = asyncio.run(drive(port, prefix, args.hot, args.concurrency, args.duration, revalidate))
+        results["cache"] = httpx.get(f"http://127.0.0.1:{port}/cache/stats").json()
+    finally:
+        server.terminate()
+        server.wait()
+    results["speedup"] = round(results["cached"]["req_per_s"] / results["uncached"]["req_per_s"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
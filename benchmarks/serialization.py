@@ -0,0 +1,105 @@
+"""Serialization time and bytes on the wire of product listing pages.
+
+Builds pages of --sizes products through list_products on a seeded SQLite
+stand-in, then times the ways a page can be turned into a body: validating
+into ProductPage first (json.dumps of jsonable_encoder as older FastAPI does,
+or pydantic's dump_json) vs sending the projected rows through the app's JSON
+encoder. Body sizes are reported raw, gzipped and, with brotli installed, br:
+
+    python benchmarks/serialization.py --sizes 100 1000
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from _common import use_app_path
+
+CATEGORIES = ["Fruits", "Vegetables", "Grains", "Spices", "Dairy", "Livestock"]
+
+
+def seed(engine, rows: int):
+    from sqlalchemy import insert
+    from models import Farmer, Products
+
+    rng = random.Random(0)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(insert(Farmer), [{"phone": "9800000000", "name": "Cooperative", "location": "Chitwan",
+                                       "verified": True}])
+        conn.execute(insert(Products), [
+            {
+                "title": f"Organic {rng.choice(CATEGORIES).lower()} lot {i}",
+                "description": "Fresh produce " * 8,
+                "price": round(rng.uniform(10, 2000), 2),
+                "category": rng.choice(CATEGORIES),
+                "image": f"uploads/products/{i:06d}.jpg",
+                "created_at": start + timedelta(seconds=rng.randrange(365 * 24 * 3600)),
+                "farmer_id": 1,
+            }
+            for i in range(rows)
+        ])
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='khetai-serialization-bench-'), 'bench.db')}"
+    os.environ.setdefault("DB_ECHO", "false")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret")
+    # Importing the services package sets up transcription, keep it offline
+    os.environ.setdefault("TRANSCRIPTION_BACKEND", "stub")
+    use_app_path()
+    from fastapi.encoders import jsonable_encoder
+    from sqlmodel import Session
+    from database import create_db_and_tables, engine
+    from responses import brotli, dumps, orjson
+    from schemas import ProductPage
+    from services.product_listing import list_products
+
+    create_db_and_tables()
+    seed(engine, max(args.sizes) + 1)
+
+    results = {"encoder": "orjson" if orjson else "json", "brotli": brotli is not None}
+    for size in args.sizes:
+        with Session(engine) as session:
+            page = list_products(session, limit=size)
+
+        body = dumps(page)
+        sizes = {"raw": len(body), "gzip": len(gzip.compress(body, 6))}
+        if brotli is not None:
+            sizes["br"] = len(brotli.compress(body, quality=4))
+        results[f"items_{size}"] = {
+            "ms": {
+                "validate_jsonable_encoder": timed(
+                    lambda: json.dumps(jsonable_encoder(ProductPage.model_validate(page))).encode(), args.repeat),
+                "validate_dump_json": timed(
+                    lambda: ProductPage.model_validate(page).model_dump_json().encode(), args.repeat),
+                "projection": timed(lambda: dumps(page), args.repeat),
+                "gzip": timed(lambda: gzip.compress(body, 6), args.repeat),
+                **({"br": timed(lambda: brotli.compress(body, quality=4), args.repeat)} if brotli else {}),
+            },
+            "bytes": sizes,
+            "gzip_ratio": round(sizes["raw"] / sizes["gzip"], 1),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Load test of uploads into the blob store and of serving the stored files.
+
+Uploads --size byte images with unique contents, then the same image over and
+over (deduplicated, only the row's expiry is updated), and reads one stored
+file whole, as 64 KiB ranges and revalidated with If-None-Match. Uses the
+local backend unless STORAGE_BACKEND and the S3_* variables say otherwise:
+
+    python benchmarks/storage.py --size 1048576 --concurrency 16 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import httpx
+
+from _common import free_port, run_load, start_server, use_app_path
+
+RANGE = 64 * 1024
+
+
+def create_app():
+    use_app_path()
+    from fastapi import FastAPI, File, HTTPException, Request, UploadFile, status
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.responses import Response
+    from database import create_db_and_tables, engine
+    from services.storage import create_store
+    from uploader import ImageUploader
+    from utils import etag_matches
+
+    create_db_and_tables()
+    store = create_store(engine)
+    uploader = ImageUploader(store, "product")
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        stored = await uploader.save_file(file)
+        return {"file_id": stored.sha256, "new": stored.new}
+
+    @app.get("/files/{sha256}")
+    async def stored_file(sha256: str, request: Request):
+        blob = await run_in_threadpool(store.get, sha256)
+        if blob is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        headers = {"ETag": f'"{sha256}"', "Cache-Control": "public, max-age=31536000, immutable"}
+        if etag_matches(request, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return store.response(blob, headers)
+
+    @app.get("/stats")
+    async def stats():
+        return await run_in_threadpool(store.stats)
+
+    return app
+
+
+async def drive(port: int, make_request, args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60,
+                                 follow_redirects=True) as client:
+        return await run_load(client, make_request, args.concurrency, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024 * 1024)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="khetai-storage-bench-"))
+    env = {
+        "DB_URL": os.environ.get("DB_URL", f"sqlite:///{workdir / 'bench.db'}"),
+        "DB_ECHO": "false",
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "benchmark-secret"),
+        # Importing the services package sets up transcription, keep it offline
+        "TRANSCRIPTION_BACKEND": "stub",
+        "STORAGE_DIR": os.environ.get("STORAGE_DIR", str(workdir / "storage")),
+    }
+    image = os.urandom(args.size)
+
+    async def upload_unique(client, i):
+        data = image[:-16] + os.urandom(16)
+        return await client.post("/upload", files={"file": (f"photo{i}.jpg", data, "image/jpeg")})
+
+    async def upload_duplicate(client, i):
+        return await client.post("/upload", files={"file": (f"photo{i}.jpg", image, "image/jpeg")})
+
+    port = free_port()
+    server = start_server("storage:create_app", port, env=env, factory=True)
+    try:
+        results = {"size": args.size, "backend": os.environ.get("STORAGE_BACKEND", "local")}
+        results["upload_unique"] = asyncio.run(drive(port, upload_unique, args))
+        results["upload_duplicate"] = asyncio.run(drive(port, upload_duplicate, args))
+        sha256 = httpx.post(f"http://127.0.0.1:{port}/upload",
+                            files={"file": ("photo.jpg", image, "image/jpeg")}).json()["file_id"]
+
+        async def get_full(client, i):
+            return await client.get(f"/files/{sha256}")
+
+        async def get_range(client, i):
+            start = i * RANGE % max(args.size - RANGE, 1)
+            return await client.get(f"/files/{sha256}", headers={"Range": f"bytes={start}-{start + RANGE - 1}"})
+
+        async def revalidate(client, i):
+            return await client.get(f"/files/{sha256}", headers={"If-None-Match": f'"{sha256}"'})
+
+        for name, request in (("get_full", get_full), ("get_range", get_range), ("get_304", revalidate)):
+            results[name] = asyncio.run(drive(port, request, args))
+        results["store"] = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    finally:
+        server.terminate()
+        server.wait()
+    for name in ("upload_unique", "upload_duplicate", "get_full", "get_range"):
+        results[name]["mb_per_s"] = round(results[name]["req_per_s"] * (RANGE if name == "get_range" else args.size)
+                                          / (1024 * 1024), 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
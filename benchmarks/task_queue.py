@@ -0,0 +1,102 @@
+"""Enqueue overhead and drain throughput of the SQLite-backed task queue.
+
+Times --tasks enqueues from a sync caller and from --concurrency coroutines
+(the way handlers hand work off), then starts the workers and measures how
+fast they drain the backlog with no-op async and thread handlers:
+
+    python benchmarks/task_queue.py --tasks 5000 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from _common import percentile, use_app_path
+
+
+async def enqueue_concurrently(queue, name: str, tasks: int, concurrency: int) -> list:
+    latencies = []
+
+    async def worker(offset: int):
+        for i in range(offset, tasks, concurrency):
+            started = time.perf_counter()
+            await queue.enqueue(name, {"n": i})
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return latencies
+
+
+def latency_summary(latencies: list, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "tasks": len(latencies),
+        "per_s": round(len(latencies) / elapsed, 1),
+        "p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "p99_us": round(percentile(latencies, 99) * 1e6, 1),
+    }
+
+
+async def run(args) -> dict:
+    use_app_path()
+    from services.task_queue import TaskQueue, TaskStore, create_queue_engine
+
+    url = os.environ.get("TASK_QUEUE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tasks.db')}")
+    queue = TaskQueue(TaskStore(create_queue_engine(url)), async_workers=args.async_workers,
+                      thread_workers=args.thread_workers)
+    done = {"async": 0, "thread": 0}
+
+    @queue.task("bench.async")
+    async def noop_async(n: int):
+        done["async"] += 1
+
+    @queue.task("bench.thread", kind="thread")
+    def noop_thread(n: int):
+        done["thread"] += 1
+
+    await asyncio.to_thread(queue.store.create)
+    results = {}
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(args.tasks):
+        t = time.perf_counter()
+        queue.enqueue_sync("bench.async", {"n": i})
+        latencies.append(time.perf_counter() - t)
+    results["enqueue_sync"] = latency_summary(latencies, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    latencies = await enqueue_concurrently(queue, "bench.thread", args.tasks, args.concurrency)
+    results["enqueue_async"] = latency_summary(latencies, time.perf_counter() - started)
+
+    # Both backlogs are drained at once, each kind by its own workers
+    started = time.perf_counter()
+    await queue.start()
+    drained = {}
+    while len(drained) < 2:
+        for kind in ("async", "thread"):
+            if kind not in drained and done[kind] >= args.tasks:
+                drained[kind] = time.perf_counter() - started
+        await asyncio.sleep(0.01)
+    await queue.stop()
+    for kind, elapsed in drained.items():
+        results[f"drain_{kind}"] = {"tasks": args.tasks, "seconds": round(elapsed, 2),
+                                    "per_s": round(args.tasks / elapsed, 1)}
+    results["counts"] = queue.store.counts()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--async-workers", type=int, default=8)
+    parser.add_argument("--thread-workers", type=int, default=2)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""Runs the tests against the app package with offline backends and a throwaway SQLite database.
+
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+
+# Read by config.py on import, so set before anything from the app is imported
+os.environ.setdefault("DB_URL", f"sqlite:///{Path(tempfile.mkdtemp(prefix='khetai-tests-')) / 'test.db'}")
+os.environ.setdefault("DB_ECHO", "false")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("TRANSCRIPTION_BACKEND", "stub")
+os.environ.setdefault("TTS_BACKEND", "stub")
+os.environ.setdefault("CHAT_BACKEND", "fake")
+os.environ.setdefault("SMS_BACKEND", "log")
+
+if str(APP_DIR) not in sys.path:
+    sys.path.insert(0, str(APP_DIR))
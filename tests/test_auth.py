@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session
+
+from database import create_db_and_tables, engine
+from models import Farmer, Users
+from utils import (
+    create_access_token, decode_access_token, get_current_farmer, get_current_farmer_id, get_current_user, principals,
+)
+
+PHONE = "9811111111"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def accounts():
+    create_db_and_tables()
+    with Session(engine) as session:
+        farmer = Farmer(phone=PHONE, name="Ram", location="Dhading", verified=True)
+        user = Users(phone=PHONE, name="Sita", location="Kathmandu")
+        session.add(farmer)
+        session.add(user)
+        session.commit()
+        ids = farmer.id, user.id
+    yield ids
+    principals.invalidate("farmer", PHONE)
+    principals.invalidate("user", PHONE)
+
+
+def claims(uid: int, role: str):
+    return decode_access_token(create_access_token(uid, PHONE, role=role))
+
+
+def test_farmer_token_resolves_the_farmer(accounts):
+    farmer_id, _ = accounts
+    farmer = asyncio.run(get_current_farmer(claims(farmer_id, "farmer")))
+    assert (farmer.id, farmer.role, farmer.name) == (farmer_id, "farmer", "Ram")
+    assert asyncio.run(get_current_farmer_id(claims(farmer_id, "farmer"))) == farmer_id
+
+
+def test_farmer_token_cannot_act_as_the_user_with_the_same_phone(accounts):
+    farmer_id, _ = accounts
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_current_user(claims(farmer_id, "farmer")))
+    assert e.value.status_code == 403
+
+
+def test_user_token_cannot_act_as_the_farmer(accounts):
+    _, user_id = accounts
+    for dependency in (get_current_farmer, get_current_farmer_id):
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(dependency(claims(user_id, "user")))
+        assert e.value.status_code == 403
+    user = asyncio.run(get_current_user(claims(user_id, "user")))
+    assert (user.id, user.name) == (user_id, "Sita")
+
+
+def test_invalid_token_is_unauthorized():
+    with pytest.raises(HTTPException) as e:
+        decode_access_token("not-a-token")
+    assert e.value.status_code == 401
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from services.chatbot import ChatBackend, ChatGateway, FakeBackend, GatewayBusy, create_backend, normalize_prompt
+from services.prediction_cache import PredictionCache
+
+
+class FlakyBackend(ChatBackend):
+    """Fails before the first delta `failures` times, then answers."""
+
+    name = "flaky"
+
+    def __init__(self, failures: int, error: Exception = ConnectionError("reset by peer")):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    async def stream(self, messages: list):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        yield "ok"
+
+
+class StalledBackend(ChatBackend):
+    """Sends one delta, then hangs until closed."""
+
+    name = "stalled"
+
+    def __init__(self):
+        self.closed = False
+
+    async def stream(self, messages: list):
+        try:
+            yield "partial "
+            await asyncio.sleep(60)
+        finally:
+            self.closed = True
+
+
+def make_gateway(backend, **options):
+    return ChatGateway(backend, PredictionCache(), **options)
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        ChatBackend()
+
+
+def test_create_backend():
+    assert isinstance(create_backend("fake"), FakeBackend)
+    with pytest.raises(ValueError, match="Unknown chat backend 'llama'"):
+        create_backend("llama")
+
+
+def test_fake_reply_is_cached_by_normalized_prompt():
+    gateway = make_gateway(FakeBackend())
+    first = asyncio.run(gateway.complete("Rice, 2 bigha?", "farmer-1"))
+    second = asyncio.run(gateway.complete("rice 2 BIGHA", "farmer-2"))
+    assert first == second == "Estimated costs for: Rice, 2 bigha? "
+    assert gateway.stats()["cache"]["hits"] == 1
+    assert normalize_prompt("धान २ बिघा!") == "धान 2 बिघा"
+
+
+def test_gateway_retries_before_the_first_delta():
+    backend = FlakyBackend(failures=2)
+    gateway = make_gateway(backend, retries=2)
+    assert asyncio.run(gateway.complete("wheat", "farmer-1")) == "ok"
+    assert backend.calls == 3
+
+    backend = FlakyBackend(failures=3)
+    with pytest.raises(ConnectionError):
+        asyncio.run(make_gateway(backend, retries=2).complete("maize", "farmer-1"))
+    assert backend.calls == 3
+
+
+def test_gateway_does_not_retry_permanent_errors():
+    backend = FlakyBackend(failures=1, error=ValueError("prompt too long"))
+    with pytest.raises(ValueError):
+        asyncio.run(make_gateway(backend, retries=2).complete("rice", "farmer-1"))
+    assert backend.calls == 1
+
+
+def test_backend_stream_is_closed_when_the_client_stops_reading():
+    backend = StalledBackend()
+
+    async def run():
+        stream = make_gateway(backend).stream("rice", "farmer-1")
+        assert await stream.__anext__() == "partial "
+        await stream.aclose()
+        # Closed right away, not only when the event loop finalizes leftover generators
+        return backend.closed
+
+    assert asyncio.run(run())
+
+
+def test_busy_user_is_rejected():
+    gateway = make_gateway(FakeBackend(delay=0.05), per_user_concurrency=1, queue_timeout=0.01)
+
+    async def run():
+        return await asyncio.gather(gateway.complete("a b c", "farmer-1"), gateway.complete("d e f", "farmer-1"),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert any(isinstance(result, GatewayBusy) for result in results)
+    assert gateway.stats()["rejected"] == 1
@@ -0,0 +1,53 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.inference_batcher import InferenceBatcher
+
+
+def double(items):
+    return [item * 2 for item in items]
+
+
+def test_concurrent_submissions_share_a_batch():
+    batcher = InferenceBatcher(double, max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit(np.full(2, i)) for i in range(5)))
+        await batcher.stop()
+        return results
+
+    results = asyncio.run(run())
+    assert [result.tolist() for result in results] == [[2 * i, 2 * i] for i in range(5)]
+    assert batcher.stats_snapshot()["batches"] == 1
+
+
+def test_prediction_errors_reach_every_caller():
+    def broken(items):
+        raise ValueError("bad input shape")
+
+    batcher = InferenceBatcher(broken, max_wait_ms=1)
+
+    async def run():
+        results = await asyncio.gather(batcher.submit(np.zeros(1)), batcher.submit(np.zeros(1)),
+                                       return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_stop_fails_items_still_being_collected():
+    batcher = InferenceBatcher(double, max_batch_size=8, max_wait_ms=10_000)
+
+    async def run():
+        submitted = asyncio.create_task(batcher.submit(np.zeros(1)))
+        # Let the collector take the item off the queue and wait for more
+        await asyncio.sleep(0.05)
+        assert batcher._queue.empty()
+        await batcher.stop()
+        return await asyncio.wait_for(submitted, 1)
+
+    with pytest.raises(RuntimeError, match="Inference batcher stopped"):
+        asyncio.run(run())
@@ -0,0 +1,61 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from services.image_preprocessing import TARGET_SIZE
+from services.inference_batcher import InferenceBatcher
+from services.inference_client import REQUEST, RESPONSE, STATUS_ERROR, InferenceClient, InferenceUnavailable
+from services.inference_server import InferenceServer
+
+
+def mean_color(items):
+    return [item.reshape(-1, 3).mean(axis=0) for item in items]
+
+
+async def serving(path):
+    server = InferenceServer(path, InferenceBatcher(mean_color, max_wait_ms=5))
+    await server.start()
+    return server
+
+
+def test_client_round_trip(tmp_path):
+    path = tmp_path / "inference.sock"
+
+    async def run():
+        server = await serving(path)
+        client = InferenceClient([str(path)], timeout=5)
+        images = [np.full((*TARGET_SIZE, 3), value, np.uint8) for value in (10, 20, 30)]
+        results = await asyncio.gather(*(client.submit(image) for image in images))
+        await client.stop()
+        await server.stop()
+        return results
+
+    assert [result.tolist() for result in asyncio.run(run())] == [[10] * 3, [20] * 3, [30] * 3]
+
+
+def test_wrong_size_is_rejected_before_reading_the_pixels(tmp_path):
+    path = tmp_path / "inference.sock"
+
+    async def run():
+        server = await serving(path)
+        reader, writer = await asyncio.open_unix_connection(str(path))
+        # Promises about 10 GB of pixels and sends none of them
+        writer.write(REQUEST.pack(7, 60000, 60000))
+        await writer.drain()
+        request_id, status, length = RESPONSE.unpack(await asyncio.wait_for(reader.readexactly(RESPONSE.size), 5))
+        message = await reader.readexactly(length)
+        closed = await asyncio.wait_for(reader.read(), 5) == b""
+        writer.close()
+        await server.stop()
+        return request_id, status, message, closed
+
+    request_id, status, message, closed = asyncio.run(run())
+    assert (request_id, status, closed) == (7, STATUS_ERROR, True)
+    assert b"(60000, 60000)" in message
+
+
+def test_unreachable_server(tmp_path):
+    client = InferenceClient([str(tmp_path / "missing.sock")], timeout=5)
+    with pytest.raises(InferenceUnavailable):
+        asyncio.run(client.submit(np.zeros((*TARGET_SIZE, 3), np.uint8)))
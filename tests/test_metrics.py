@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+from metrics import SlowRequestProfiler
+
+
+def test_profile_header_needs_the_secret(tmp_path):
+    open_profiler = SlowRequestProfiler(tmp_path)
+    assert not open_profiler.requested([(b"x-profile", b"1")])
+
+    profiler = SlowRequestProfiler(tmp_path, header_secret="s3cret")
+    assert profiler.requested([(b"accept", b"*/*"), (b"x-profile", b"s3cret")])
+    assert not profiler.requested([(b"x-profile", b"1")])
+    assert not profiler.requested([])
+
+
+def test_slow_profiles_are_written_and_capped(tmp_path):
+    profiler = SlowRequestProfiler(tmp_path, threshold_ms=0, max_files=2)
+    for number in range(3):
+        old = tmp_path / f"old-{number}.speedscope.json"
+        old.write_text("{}")
+        os.utime(old, (number, number))
+
+    async def run():
+        running = profiler.start(force=True)
+        await asyncio.sleep(0.01)
+        await profiler.finish(running, "/products/{id}", 0.01)
+
+    asyncio.run(run())
+    kept = sorted(path.name for path in tmp_path.glob("*.speedscope.json"))
+    assert len(kept) == 2
+    assert "old-2.speedscope.json" in kept
+    assert any(name.endswith("ms-products_{id}.speedscope.json") for name in kept)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from services import model_runtime
+from services.model_runtime import INPUT_SHAPE, ModelBackend, ModelRuntime, create_backend
+
+
+class ConstantBackend(ModelBackend):
+    """Predicts the same class for every image, counts the loads."""
+
+    name = "constant"
+    loads = 0
+
+    def load(self):
+        type(self).loads += 1
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        probabilities = np.zeros((batch.shape[0], 3), dtype=np.float32)
+        probabilities[:, 1] = 1.0
+        return probabilities
+
+
+@pytest.fixture
+def model_file(tmp_path, monkeypatch):
+    path = tmp_path / "model.bin"
+    path.write_bytes(b"weights")
+    ConstantBackend.loads = 0
+    monkeypatch.setitem(model_runtime.BACKENDS, "constant", (ConstantBackend, path))
+    return path
+
+
+def test_interface_cannot_be_instantiated(tmp_path):
+    with pytest.raises(TypeError):
+        ModelBackend(tmp_path / "model.bin")
+
+    class NoPredict(ModelBackend):
+        def load(self):
+            pass
+
+    with pytest.raises(TypeError):
+        NoPredict(tmp_path / "model.bin")
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="Unknown model backend 'onnx'"):
+        create_backend("onnx")
+
+
+def test_runtime_loads_on_first_prediction(model_file):
+    runtime = ModelRuntime("constant")
+    assert runtime.version.startswith("constant:model.bin:7:")
+    assert not runtime.loaded and ConstantBackend.loads == 0
+
+    runtime.warm_up()
+    predictions = runtime.predict(np.zeros((2, *INPUT_SHAPE), dtype=np.float32))
+    assert runtime.loaded and ConstantBackend.loads == 1
+    assert predictions.argmax(axis=1).tolist() == [1, 1]
+
+
+def test_builtin_backends_implement_the_interface(tmp_path):
+    for name in model_runtime.BACKENDS:
+        backend = create_backend(name, tmp_path / "model")
+        assert isinstance(backend, ModelBackend) and backend.name == name
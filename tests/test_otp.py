@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+from models import VerifyOtp
+from services.otp import (
+    DatabaseOtpStore, MemoryOtpStore, OtpInvalid, OtpLocked, OtpRateLimited, OtpService, OtpStore, TokenBuckets,
+    create_store,
+)
+from services.sms import LogBackend, SmsGateway
+
+
+@pytest.fixture(params=["memory", "database"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryOtpStore()
+    engine = create_engine(f"sqlite:///{tmp_path / 'otp.db'}")
+    VerifyOtp.__table__.create(engine)
+    return DatabaseOtpStore(engine)
+
+
+def make_service(store, **options):
+    return OtpService(store, SmsGateway(LogBackend()), TokenBuckets(3, 60), TokenBuckets(10, 60), **options)
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        OtpStore()
+
+
+def test_create_store():
+    assert isinstance(create_store("memory"), MemoryOtpStore)
+    with pytest.raises(ValueError, match="Unknown OTP store 'redis'"):
+        create_store("redis")
+
+
+def test_issue_replaces_code_and_resets_attempts(store):
+    expires_at = time.time() + 300
+    store.issue("9801", "111111", expires_at)
+    store.record_failure("9801", 5, expires_at + 900)
+    store.issue("9801", "222222", expires_at)
+    entry = store.get("9801")
+    assert (entry.code, entry.attempts, entry.locked_until) == ("222222", 0, None)
+    assert entry.expires_at == pytest.approx(expires_at, abs=1e-3)
+
+
+def test_failures_lock_the_phone(store):
+    now = time.time()
+    store.issue("9801", "111111", now + 300)
+    for _ in range(3):
+        store.record_failure("9801", 3, now + 900)
+    entry = store.get("9801")
+    assert entry.attempts == 3
+    assert entry.locked_until == pytest.approx(now + 900, abs=1e-3)
+    # A new code keeps the lock
+    store.issue("9801", "222222", now + 300)
+    assert store.get("9801").locked_until == pytest.approx(now + 900, abs=1e-3)
+
+
+def test_purge_keeps_live_and_locked_entries(store):
+    now = time.time()
+    store.issue("expired", "111111", now - 10)
+    store.issue("live", "222222", now + 300)
+    store.issue("locked", "333333", now - 10)
+    store.record_failure("locked", 1, now + 900)
+    assert store.purge(now) == 1
+    assert store.get("expired") is None
+    assert store.get("live") is not None and store.get("locked") is not None
+    store.delete("live")
+    assert store.get("live") is None
+
+
+def test_service_verifies_once(store):
+    service = make_service(store)
+
+    async def request():
+        code = await service.request_code("9801", "10.0.0.1")
+        await service.sms.stop()
+        return code
+
+    code = asyncio.run(request())
+    service.verify("9801", code)
+    with pytest.raises(OtpInvalid):
+        service.verify("9801", code)
+    assert service.stats()["verified"] == 1
+
+
+def test_service_locks_after_wrong_codes(store):
+    service = make_service(store, max_attempts=2)
+    store.issue("9801", "123456", time.time() + 300)
+    with pytest.raises(OtpInvalid):
+        service.verify("9801", "000000")
+    with pytest.raises(OtpLocked):
+        service.verify("9801", "000001")
+    with pytest.raises(OtpLocked):
+        service.verify("9801", "123456")
+
+
+def test_requests_are_throttled_per_phone():
+    service = make_service(MemoryOtpStore())
+
+    async def request_four():
+        try:
+            for _ in range(4):
+                await service.request_code("9801", "10.0.0.1")
+        finally:
+            await service.sms.stop()
+
+    with pytest.raises(OtpRateLimited):
+        asyncio.run(request_four())
+    assert service.stats()["issued"] == 3
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+from services.prediction_cache import PredictionCache
+
+
+def test_lru_evicts_oldest():
+    cache = PredictionCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_misses():
+    cache = PredictionCache(ttl_seconds=-1)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_record_miss_counts_in_stats():
+    cache = PredictionCache()
+    assert cache.get("a") is None
+    cache.record_miss()
+    cache.put("a", 1)
+    cache.get("a")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_get_or_compute_coalesces_concurrent_lookups():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"label": "healthy"}
+
+    async def lookups():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+    assert asyncio.run(lookups()) == [{"label": "healthy"}] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_concurrent_threads_keep_the_lru_consistent():
+    cache = PredictionCache(max_entries=50, ttl_seconds=60)
+
+    def hammer(offset):
+        for i in range(2000):
+            key = f"k{(i + offset) % 120}"
+            cache.put(key, i)
+            cache.get(key)
+            if i % 7 == 0:
+                cache.invalidate(key)
+
+    threads = [threading.Thread(target=hammer, args=(n * 13,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache._entries) <= 50
+
+
+def test_cancelled_leader_does_not_fail_coalesced_callers():
+    cache = PredictionCache()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "transcript"
+
+    async def run():
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_compute("k", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        # The leader's client disconnects while the value is being computed
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        return leader, results
+
+    leader, results = asyncio.run(run())
+    assert leader.cancelled()
+    assert results == ["transcript", "transcript"]
+    assert cache.get("k") == "transcript"
+    assert cache.stats()["misses"] == 1
+
+
+def test_compute_errors_reach_every_caller_and_are_not_cached():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("service unavailable")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len(calls) == 1
+    assert cache.get("k") is None
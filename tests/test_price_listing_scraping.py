@@ -0,0 +1,95 @@
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+from sqlmodel import SQLModel, create_engine
+
+from models import CommodityPrice
+from scrappers.price_listing_scraping import PriceRow, PriceTable, normalize_unit, parse_price, parse_prices
+from services.market_prices import PriceSnapshot, market_day, nepal_today, upsert_prices
+
+FIXTURE = Path(__file__).resolve().parent.parent / "app" / "scrappers" / "fixtures" / "kalimati_daily.html"
+
+
+@pytest.fixture(scope="module")
+def table():
+    return parse_prices(FIXTURE.read_bytes())
+
+
+def prices(table):
+    return {row.commodity: row for row in table.rows}
+
+
+def test_parses_every_row_of_the_daily_table(table):
+    assert len(table.rows) == 10
+    assert table.headings == ["कृषि उपज", "ईकाइ", "न्यूनतम", "अधिकतम", "औसत"]
+    assert table.title.startswith("दैनिक मूल्य")
+
+
+def test_devanagari_numerals_and_thousands_separators(table):
+    tomato = prices(table)["गोलभेडा ठूलो (भारतीय)"]
+    assert (tomato.min_price, tomato.max_price, tomato.avg_price) == (60.0, 70.0, 65.0)
+    mushroom = prices(table)["च्याउ (कन्य)"]
+    assert (mushroom.min_price, mushroom.max_price, mushroom.avg_price) == (1200.0, 1400.0, 1300.0)
+
+
+def test_latin_numerals_and_commodity_whitespace(table):
+    potato = prices(table)["आलु रातो"]
+    assert (potato.unit, potato.avg_price) == ("kg", 57.5)
+
+
+def test_units_are_normalized(table):
+    units = {commodity: row.unit for commodity, row in prices(table).items()}
+    assert units["गोलभेडा सानो (लोकल)"] == "kg"
+    assert units["केरा"] == "dozen"
+    assert units["कागती"] == "piece"
+    assert set(units.values()) == {"kg", "dozen", "piece"}
+
+
+def test_missing_prices_are_none(table):
+    chilli = prices(table)["खुर्सानी हरियो"]
+    assert (chilli.min_price, chilli.max_price, chilli.avg_price) == (None, None, None)
+
+
+@pytest.mark.parametrize("text, expected", [("रू १,२००.५०", 1200.5), ("Rs 55", 55.0), ("-", None), ("", None)])
+def test_parse_price(text, expected):
+    assert parse_price(text) == expected
+
+
+@pytest.mark.parametrize("unit, expected", [("के.जी.", "kg"), (" KG ", "kg"), ("प्रति मुठा", "bundle"), ("box", "box")])
+def test_normalize_unit(unit, expected):
+    assert normalize_unit(unit) == expected
+
+
+def test_missing_table_is_an_error():
+    with pytest.raises(ValueError):
+        parse_prices(b"<html><body><p>maintenance</p></body></html>")
+
+
+def test_market_day_is_the_titles_weekday(table):
+    # The fixture's table is for a Sunday (आइतबार)
+    assert table.weekday == 6
+    sunday = date(2024, 10, 6)
+    assert market_day(table, sunday) == sunday
+    # Still showing Sunday's table after midnight, or after a restart on Tuesday
+    assert market_day(table, date(2024, 10, 7)) == sunday
+    assert market_day(table, date(2024, 10, 8)) == sunday
+
+
+def test_market_day_without_a_weekday_is_unknown():
+    assert market_day(PriceTable(title="दैनिक मूल्य", headings=[]), date(2024, 10, 6)) is None
+
+
+def test_snapshot_keeps_units_apart(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'prices.db'}")
+    SQLModel.metadata.create_all(engine, tables=[CommodityPrice.__table__])
+    today = nepal_today()
+    upsert_prices(engine, [PriceRow("कागती", "kg", 200, 240, 220), PriceRow("कागती", "piece", 8, 12, 10)],
+                  today - timedelta(days=1))
+    upsert_prices(engine, [PriceRow("कागती", "kg", 180, 220, 200)], today)
+
+    snapshot = PriceSnapshot.load(engine, days=30)
+    assert sorted(snapshot.units("कागती")) == ["kg", "piece"]
+    assert snapshot.latest[("कागती", "kg")]["avg_price"] == 200
+    assert snapshot.latest[("कागती", "piece")]["avg_price"] == 10
+    assert snapshot.rolling[7] == {("कागती", "kg"): 210, ("कागती", "piece"): 10}
@@ -0,0 +1,70 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlmodel import Session, SQLModel, select
+
+from models import Farmer, Products
+from services.product_bulk import INVALID_UTF8, import_products
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'products.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(Farmer(id=1, name="Ram", phone="9800000000", location="Kathmandu"))
+        session.commit()
+    return engine
+
+
+def run_import(engine, data: bytes, fmt="csv", **options):
+    return import_products(engine, 1, io.BytesIO(data), fmt, **options)
+
+
+def titles(engine):
+    with Session(engine) as session:
+        return sorted(session.exec(select(Products.title)))
+
+
+def test_rows_are_imported_in_chunks(engine):
+    data = "title,price,category\n" + "".join(f"Apple {n},{n},Fruits\n" for n in range(5))
+    report = run_import(engine, data.encode(), chunk_size=2)
+    assert report.to_dict() == {"imported": 5, "failed": 0, "errors": [], "errors_truncated": False}
+    assert len(titles(engine)) == 5
+
+
+def test_invalid_utf8_fails_only_its_row(engine):
+    report = run_import(engine, b"title,price\nApple,10\nBad \xff title,20\nPear,30\n")
+    assert report.imported == 2
+    assert report.errors == [{"line": 3, "errors": [INVALID_UTF8]}]
+    assert titles(engine) == ["Apple", "Pear"]
+
+
+def test_malformed_csv_fails_only_its_row(engine):
+    report = run_import(engine, b"title,price\nApple,10\n" + b"x" * 200000 + b",20\nPear,30\n")
+    assert report.imported == 2
+    assert report.errors == [{"line": 3, "errors": ["Invalid CSV: field larger than field limit (131072)"]}]
+
+
+def test_validation_errors_are_reported_per_row(engine):
+    report = run_import(engine, b'{"title": "Apple", "price": 10}\n{"title": "Pear", "price": "cheap"}\n[1]\n',
+                        fmt="ndjson")
+    assert report.imported == 1
+    assert report.errors == [
+        {"line": 2, "errors": ["price: Input should be a valid number, unable to parse string as a number"]},
+        {"line": 3, "errors": ["Expected a JSON object"]},
+    ]
+
+
+def test_a_rejected_row_does_not_fail_its_chunk(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TRIGGER reject_bad BEFORE INSERT ON products WHEN NEW.title = 'Bad' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        ))
+    data = "title,price\n" + "".join(f"{'Bad' if n == 3 else f'Apple {n}'},{n}\n" for n in range(8))
+    report = run_import(engine, data.encode(), chunk_size=8)
+    assert report.imported == 7
+    assert report.errors == [{"line": 5, "errors": ["Database error: IntegrityError"]}]
+    assert len(titles(engine)) == 7
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from services.product_search import ProductSearchIndex, SearchIndexSaver, tokenize
+
+PRODUCTS = [
+    (1, "Fresh tomato", "Organic tomatoes from Dhading", "vegetable"),
+    (2, "गोलभेडा", "ताजा गोलभेडा", "vegetable"),
+    (3, "Basmati rice", "Aromatic long grain rice", "grain"),
+    (4, "Potato", "Red potatoes, 50 kg sacks", "vegetable"),
+]
+
+
+def ids(results):
+    return [doc_id for doc_id, _ in results]
+
+
+def build(path=None):
+    index = ProductSearchIndex(path)
+    for row in PRODUCTS:
+        index.add(*row)
+    return index
+
+
+def test_tokenize_normalizes_scripts():
+    assert tokenize("Tomato, ५० KG") == ["tomato", "50", "kg"]
+
+
+def test_search_ranks_title_matches_first():
+    index = build()
+    assert ids(index.search("tomato"))[0] == 1
+    assert ids(index.search("गोलभेडा")) == [2]
+    assert ids(index.search("tomaot")) == [1]
+    assert ids(index.search("pota")) == [4]
+    assert index.search("   ") == []
+
+
+def test_add_replaces_and_remove_deletes():
+    index = build()
+    index.add(1, "Cauliflower", "White cauliflower", "vegetable")
+    assert index.search("tomato") == []
+    assert ids(index.search("cauliflower")) == [1]
+    index.remove(3)
+    assert index.search("rice") == []
+    assert len(index) == 3
+    assert index.doc_ids() == {1, 2, 4}
+
+
+def test_save_and_reload(tmp_path):
+    path = tmp_path / "search.idx"
+    index = build(path)
+    index.save(watermark="2026-10-01T08:00:00")
+    assert not index.dirty
+
+    reloaded = ProductSearchIndex(path)
+    assert reloaded.loaded and reloaded.watermark == "2026-10-01T08:00:00"
+    assert len(reloaded) == 4
+    assert reloaded.search("rice") == index.search("rice")
+
+
+def test_tombstones_hide_segment_entries_until_the_next_save(tmp_path):
+    path = tmp_path / "search.idx"
+    index = build(path)
+    index.save()
+    index.remove(3)
+    index.add(4, "Sweet potato", "Orange sweet potatoes", "vegetable")
+    assert index.dirty
+    assert index.search("rice") == []
+    assert ids(index.search("sweet")) == [4]
+
+    # The merged segment scores exactly like an index built from scratch
+    index.save()
+    fresh = ProductSearchIndex()
+    for row in PRODUCTS[:2]:
+        fresh.add(*row)
+    fresh.add(4, "Sweet potato", "Orange sweet potatoes", "vegetable")
+    for query in ("potato", "tomato", "vegetable"):
+        assert index.search(query) == pytest.approx(fresh.search(query))
+    assert ProductSearchIndex(path).doc_ids() == {1, 2, 4}
+
+
+def test_unreadable_file_is_left_unloaded(tmp_path):
+    path = tmp_path / "search.idx"
+    path.write_bytes(b"not an index")
+    index = ProductSearchIndex(path)
+    assert not index.loaded and index.watermark is None
+
+
+def test_rebuild_keeps_changes_made_while_it_runs(tmp_path):
+    path = tmp_path / "search.idx"
+    index = build(path)
+    index.save()
+
+    def rows():
+        yield PRODUCTS[0]
+        # A product is created and another deleted while the catalogue is being read
+        index.add(5, "Cabbage", "Green cabbage", "vegetable")
+        index.remove(1)
+        assert ids(index.search("rice")) == [3]
+        yield PRODUCTS[2]
+
+    index.rebuild(rows(), watermark="w2")
+    assert index.doc_ids() == {3, 5}
+    assert index.watermark == "w2"
+    assert ids(index.search("cabbage")) == [5]
+    assert index.search("tomato") == []
+
+
+def test_saver_only_saves_a_changed_index(tmp_path):
+    index = build(tmp_path / "search.idx")
+    saver = SearchIndexSaver(index, lambda: "2026-10-01T08:00:00", interval=0)
+    assert asyncio.run(saver.save_once())
+    assert index.watermark == "2026-10-01T08:00:00"
+    assert not asyncio.run(saver.save_once())
+    assert saver.stats()["last_status"] == "unchanged"
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from services.response_cache import (
+    CacheBackend, MemoryBackend, ResponseCache, body_etag, cache_key, create_backend, version_etag,
+)
+
+
+def make_request(headers=()):
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": list(headers)})
+
+
+def respond(cache, key, build, headers=()):
+    return asyncio.run(cache.respond(make_request(headers), key, build))
+
+
+def test_miss_then_hit():
+    cache = ResponseCache(MemoryBackend(ttl=60))
+    builds = []
+
+    def build():
+        builds.append(1)
+        return b'{"id": 1}', body_etag(b'{"id": 1}')
+
+    first = respond(cache, cache_key("product", id=1), build)
+    second = respond(cache, cache_key("product", id=1), build)
+    assert first.body == second.body == b'{"id": 1}'
+    assert len(builds) == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_matching_etag_is_not_modified():
+    cache = ResponseCache(MemoryBackend(ttl=60))
+    etag = body_etag(b"{}")
+    response = respond(cache, "k", lambda: (b"{}", etag), headers=[(b"if-none-match", etag.encode())])
+    assert response.status_code == 304
+    assert cache.not_modified == 1
+
+
+def test_invalidate_during_build_does_not_store_stale_body():
+    cache = ResponseCache(MemoryBackend(ttl=60))
+
+    def build():
+        # A writer commits and invalidates while this read is still building
+        cache.invalidate("k")
+        return b"old", body_etag(b"old")
+
+    assert respond(cache, "k", build).body == b"old"
+    assert cache.backend.get("k") is None
+    assert respond(cache, "k", lambda: (b"new", body_etag(b"new"))).body == b"new"
+    assert cache.backend.get("k")[1] == b"new"
+
+
+def test_invalidate_drops_entry():
+    backend = MemoryBackend(ttl=60)
+    backend.set("k", "etag", b"body", backend.generation("k"))
+    assert backend.get("k") == ("etag", b"body")
+    backend.delete("k")
+    assert backend.get("k") is None
+    assert backend.generation("k") == 1
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_create_backend():
+    assert isinstance(create_backend("memory", ttl=60), MemoryBackend)
+    with pytest.raises(ValueError, match="Unknown response cache backend 'memcached'"):
+        create_backend("memcached", ttl=60)
+
+
+def test_memory_backend_expires_entries():
+    backend = MemoryBackend(ttl=-1)
+    backend.set("k", "etag", b"body", 0)
+    assert backend.get("k") is None
+
+
+def test_keys_and_etags_are_stable():
+    assert cache_key("product", id=7) == "product?id=7"
+    assert cache_key("products", page=2, category="veg") == "products?category=veg&page=2"
+    assert version_etag(7, "2026-01-01") == version_etag(7, "2026-01-01") != version_etag(7, "2026-01-02")
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+import httpx
+import pytest
+
+from services.sms import LogBackend, SmsBackend, SmsGateway, SmsQueueFull, create_backend
+
+
+class RecordingBackend(SmsBackend):
+    """Records each call, raising the queued errors first."""
+
+    name = "recording"
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def send(self, recipients: list, text: str):
+        self.calls.append((sorted(recipients), text))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def rejected(status_code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://sms.example/send")
+    return httpx.HTTPStatusError("rejected", request=request, response=httpx.Response(status_code, request=request))
+
+
+async def deliver(gateway, messages):
+    for phone, text in messages:
+        await gateway.enqueue(phone, text)
+    await asyncio.wait_for(gateway._queue.join(), 5)
+    await gateway.stop()
+    return gateway.stats()
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        SmsBackend()
+
+
+def test_create_backend():
+    assert isinstance(create_backend("log"), LogBackend)
+    with pytest.raises(ValueError, match="Unknown SMS backend 'twilio'"):
+        create_backend("twilio")
+
+
+def test_log_backend_counts_recipients(caplog):
+    backend = LogBackend()
+    with caplog.at_level(logging.INFO, logger="services.sms"):
+        asyncio.run(backend.send(["9800000001", "9800000002"], "Here is your otp: 123456"))
+    assert backend.sent == 2
+    assert "9800000001,9800000002" in caplog.text
+
+
+def test_identical_texts_share_one_call():
+    backend = RecordingBackend()
+    gateway = SmsGateway(backend, senders=1)
+    stats = asyncio.run(deliver(gateway, [("9801", "market closed"), ("9802", "market closed"), ("9803", "otp 1")]))
+    assert stats["sent"] == 3
+    assert sorted(backend.calls) == [(["9801", "9802"], "market closed"), (["9803"], "otp 1")]
+
+
+def test_rejected_requests_are_not_retried():
+    backend = RecordingBackend(errors=[rejected(401)])
+    stats = asyncio.run(deliver(SmsGateway(backend, senders=1), [("9801", "otp 1")]))
+    assert (stats["failed"], stats["calls"]) == (1, 1)
+
+
+def test_unexpected_errors_do_not_stop_the_sender():
+    backend = RecordingBackend(errors=[KeyError("token")])
+    gateway = SmsGateway(backend, senders=1)
+
+    async def run():
+        await gateway.enqueue("9801", "otp 1")
+        await asyncio.wait_for(gateway._queue.join(), 5)
+        return await deliver(gateway, [("9802", "otp 2")])
+
+    stats = asyncio.run(run())
+    assert (stats["sent"], stats["failed"]) == (1, 1)
+
+
+def test_full_outbox_rejects():
+    async def run():
+        gateway = SmsGateway(RecordingBackend(), senders=1, max_queue=1)
+        await gateway.enqueue("9801", "otp 1")
+        try:
+            with pytest.raises(SmsQueueFull):
+                await gateway.enqueue("9802", "otp 2")
+        finally:
+            await gateway.stop()
+
+    asyncio.run(run())
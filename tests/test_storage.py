@@ -0,0 +1,84 @@
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlmodel import Session, SQLModel
+
+from models import Products
+from services.storage import BlobStore, LocalBackend, StorageBackend, blob_id, create_backend
+
+SHA = "ab" + "0" * 62
+
+
+def stage(store: BlobStore, data: bytes):
+    path = store.staging_path()
+    path.write_bytes(data)
+    return path, hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'blobs.db'}")
+    SQLModel.metadata.create_all(engine)
+    return BlobStore(LocalBackend(tmp_path / "blobs"), engine, tmp_path / "work",
+                     ttls={"product": 0, "user": None, "voice": 0})
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_create_backend(tmp_path):
+    assert isinstance(create_backend("local", tmp_path), LocalBackend)
+    with pytest.raises(ValueError, match="Unknown storage backend 'ftp'"):
+        create_backend("ftp", tmp_path)
+
+
+def test_local_backend_round_trip(tmp_path):
+    backend = LocalBackend(tmp_path / "blobs")
+    source = tmp_path / "upload.part"
+    source.write_bytes(b"leaf photo")
+    backend.put(SHA, source, "image/jpeg")
+    assert not source.exists()
+    assert backend.path(SHA) == tmp_path / "blobs" / "ab" / SHA
+
+    backend.fetch(SHA, tmp_path / "copy")
+    assert (tmp_path / "copy").read_bytes() == b"leaf photo"
+    old = time.time() - 3600
+    os.utime(backend.path(SHA), (old, old))
+    assert list(backend.keys(datetime.now(timezone.utc) - timedelta(minutes=1))) == [SHA]
+    backend.delete(SHA)
+    backend.delete(SHA)
+    assert list(backend.keys(datetime.now(timezone.utc))) == []
+
+
+def test_same_content_is_stored_once(store):
+    staged, sha = stage(store, b"tomato")
+    assert store.add(staged, sha, 6, "image/jpeg", "product")
+    staged, _ = stage(store, b"tomato")
+    assert not store.add(staged, sha, 6, "image/jpeg", "product")
+    assert not staged.exists()
+    assert store.get(sha).size == 6
+    assert store.stats()["kinds"]["product"]["files"] == 1
+
+
+def test_referenced_blobs_survive_collection(store):
+    kept, kept_sha = stage(store, b"kept")
+    dropped, dropped_sha = stage(store, b"dropped")
+    store.add(kept, kept_sha, 4, "image/jpeg", "product")
+    store.add(dropped, dropped_sha, 7, "image/jpeg", "product")
+    with Session(store.engine) as session:
+        session.add(Products(title="t", description="d", price=1, category="veg", farmer_id=1,
+                             image=f"/files/{kept_sha}.jpg"))
+        session.commit()
+    assert store.get(kept_sha).refcount == 1
+    assert blob_id(f"/files/{kept_sha}.jpg") == kept_sha
+
+    assert store.collect() == 1
+    assert store.get(dropped_sha) is None and not store.backend.path(dropped_sha).exists()
+    assert store.get(kept_sha) is not None and store.backend.path(kept_sha).exists()
+    assert store.recount() == 0
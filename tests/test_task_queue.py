@@ -0,0 +1,175 @@
+import asyncio
+import time
+
+import pytest
+
+from services.task_queue import (
+    FAILED, QUEUED, RUNNING, SUCCEEDED, PermanentError, TaskQueue, TaskStore, UnknownTask, create_queue_engine,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TaskStore(create_queue_engine(f"sqlite:///{tmp_path / 'tasks.db'}"))
+    store.create()
+    return store
+
+
+def claim(store, now, names=("a",), limit=10, lease=60):
+    return store.claim([(list(names), limit)], now, now + lease)
+
+
+def test_claim_takes_due_tasks_by_priority(store):
+    now = time.time()
+    low = store.add("a", "{}", 0, 3, now)
+    high = store.add("a", "{}", 5, 3, now)
+    store.add("a", "{}", 9, 3, now + 60)
+    store.add("b", "{}", 9, 3, now)
+    claimed = claim(store, now)
+    assert [row["id"] for row in claimed] == [high, low]
+    assert all(row["attempts"] == 1 for row in claimed)
+    assert claim(store, now) == []
+    assert store.get(high)["status"] == RUNNING
+
+
+def test_finish_retries_and_succeeds(store):
+    now = time.time()
+    task_id = store.add("a", "{}", 0, 3, now)
+    claim(store, now)
+    store.finish(task_id, QUEUED, "boom", now + 5)
+    assert claim(store, now) == []
+    [row] = claim(store, now + 5)
+    assert row["attempts"] == 2
+    store.claim([], now + 6, 0, [task_id])
+    task = store.get(task_id)
+    assert (task["status"], task["error"]) == (SUCCEEDED, None)
+    assert task["finished_at"] is not None
+
+
+def test_release_does_not_count_the_attempt(store):
+    now = time.time()
+    task_id = store.add("a", "{}", 0, 3, now)
+    claim(store, now)
+    store.release([task_id])
+    task = store.get(task_id)
+    assert (task["status"], task["attempts"]) == (QUEUED, 0)
+
+
+def test_recover_requeues_or_fails_expired_leases(store):
+    now = time.time()
+    retried = store.add("a", "{}", 0, 2, now)
+    exhausted = store.add("a", "{}", 0, 1, now)
+    claim(store, now, lease=10)
+    assert store.recover(now + 5) == 0
+    assert store.recover(now + 11) == 2
+    assert store.get(retried)["status"] == QUEUED
+    failed = store.get(exhausted)
+    assert (failed["status"], failed["error"], failed["finished_at"]) == (FAILED, "Lease expired", now + 11)
+    # Failed by recovery, still purged once old enough
+    assert store.purge(now + 1e9) == 1
+    assert store.get(exhausted) is None
+    assert store.get(retried) is not None
+
+
+def test_extend_keeps_running_tasks_from_recovery(store):
+    now = time.time()
+    task_id = store.add("a", "{}", 0, 1, now)
+    claim(store, now, lease=10)
+    store.extend([task_id], now + 100)
+    assert store.recover(now + 50) == 0
+    assert store.get(task_id)["status"] == RUNNING
+
+
+def make_queue(store, **options):
+    options = {"poll_interval": 0.01, "retry_backoff": 0.01, **options}
+    return TaskQueue(store, **options)
+
+
+async def run_until(queue, condition, timeout=5):
+    await queue.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+
+def test_handlers_run_and_failures_are_retried(store):
+    queue = make_queue(store, max_attempts=3)
+    calls = {"flaky": 0, "thread": 0}
+
+    @queue.task("flaky")
+    async def flaky(fail_times: int):
+        calls["flaky"] += 1
+        if calls["flaky"] <= fail_times:
+            raise ConnectionError("unreachable")
+
+    @queue.task("thread", kind="thread")
+    def in_thread(value: int):
+        calls["thread"] += value
+
+    async def run():
+        flaky_id = await queue.enqueue("flaky", {"fail_times": 2})
+        thread_id = await queue.enqueue("thread", {"value": 7})
+        await run_until(queue, lambda: queue.succeeded == 2)
+        return flaky_id, thread_id
+
+    flaky_id, thread_id = asyncio.run(run())
+    assert calls == {"flaky": 3, "thread": 7}
+    assert queue.retried == 2
+    assert queue.get(flaky_id)["status"] == SUCCEEDED
+    assert queue.get(thread_id)["status"] == SUCCEEDED
+
+
+def test_exhausted_tasks_fail(store):
+    queue = make_queue(store, max_attempts=2)
+
+    @queue.task("broken")
+    async def broken():
+        raise ValueError("bad payload")
+
+    async def run():
+        task_id = await queue.enqueue("broken")
+        await run_until(queue, lambda: queue.failed == 1)
+        return task_id
+
+    task = queue.get(asyncio.run(run()))
+    assert (task["status"], task["attempts"], task["error"]) == (FAILED, 2, "ValueError: bad payload")
+
+
+def test_permanent_errors_are_not_retried(store):
+    queue = make_queue(store, max_attempts=3)
+
+    @queue.task("undecodable")
+    async def undecodable():
+        raise PermanentError("not an image")
+
+    async def run():
+        task_id = await queue.enqueue("undecodable")
+        await run_until(queue, lambda: queue.failed == 1)
+        return task_id
+
+    task = queue.get(asyncio.run(run()))
+    assert (task["status"], task["attempts"]) == (FAILED, 1)
+    assert queue.retried == 0
+
+
+def test_long_task_keeps_its_lease(store):
+    queue = make_queue(store, lease=0.3)
+    runs = []
+
+    @queue.task("slow")
+    async def slow():
+        runs.append(time.monotonic())
+        await asyncio.sleep(1)
+
+    async def run():
+        await queue.enqueue("slow")
+        await run_until(queue, lambda: queue.succeeded == 1)
+
+    asyncio.run(run())
+    assert len(runs) == 1
+
+
+def test_unknown_task_is_rejected(store):
+    with pytest.raises(UnknownTask):
+        make_queue(store).enqueue_sync("missing")
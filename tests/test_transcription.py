@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from services.prediction_cache import PredictionCache
+from services.transcription import StubBackend, TranscriptionBackend, TranscriptionJobs, create_backend
+
+
+class FailingBackend(TranscriptionBackend):
+    name = "failing"
+
+    def transcribe(self, audio_path):
+        raise RuntimeError("service unavailable")
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        TranscriptionBackend()
+
+
+def test_create_backend():
+    assert isinstance(create_backend("stub"), StubBackend)
+    with pytest.raises(ValueError, match="Unknown transcription backend 'whisper'"):
+        create_backend("whisper")
+
+
+def test_stub_transcribes_offline(tmp_path):
+    clip = tmp_path / "clip.webm"
+    clip.write_bytes(b"\x1aE\xdf\xa3" * 4)
+    assert create_backend("stub").transcribe(clip) == "stub transcript of clip.webm (16 bytes)"
+
+
+def test_jobs_cache_transcripts_by_content(tmp_path):
+    clip = tmp_path / "clip.webm"
+    clip.write_bytes(b"audio")
+
+    async def run():
+        jobs = TranscriptionJobs(StubBackend(), workers=2, cache=PredictionCache())
+        first = await (await jobs.submit(clip, "hash-1")).wait(timeout=5)
+        second = await jobs.submit(clip, "hash-1")
+        await jobs.stop()
+        return jobs, first, second
+
+    jobs, first, second = asyncio.run(run())
+    assert first.status == second.status == "done"
+    assert second.text == first.text
+    assert jobs.get(first.id) is first
+    assert jobs.stats()["cache"]["misses"] == 1
+
+
+def test_backend_errors_fail_the_job(tmp_path):
+    clip = tmp_path / "clip.webm"
+    clip.write_bytes(b"audio")
+
+    async def run():
+        jobs = TranscriptionJobs(FailingBackend(), workers=1)
+        job = await (await jobs.submit(clip, "hash-2")).wait(timeout=5)
+        await jobs.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job.status == "failed"
+    assert job.error == "service unavailable"
@@ -0,0 +1,64 @@
+import anyio
+import pytest
+
+from services.tts import SpeechBackend, SpeechCache, StubBackend, TextToSpeechService, cache_key, create_backend
+
+
+def make_service(tmp_path, delay=0.0, max_bytes=1024 * 1024):
+    return TextToSpeechService(StubBackend(delay), SpeechCache(tmp_path, max_bytes))
+
+
+async def collect(service, text):
+    return b"".join([chunk async for chunk in service.stream(text)])
+
+
+def test_stream_is_cached(tmp_path):
+    service = make_service(tmp_path)
+    first = anyio.run(collect, service, "नमस्ते किसान")
+    second = anyio.run(collect, service, "नमस्ते  किसान")
+    assert first == second and first.startswith(b"ID3")
+    assert service.cache.path(cache_key("नमस्ते किसान", "hi", None)).exists()
+    assert (service.cache.hits, service.cache.misses) == (1, 1)
+    assert service.cache.size == len(first)
+    service.shutdown()
+
+
+def test_cancelled_stream_leaves_no_partial_file(tmp_path):
+    service = make_service(tmp_path, delay=0.05)
+
+    async def disconnect():
+        # The server cancels the response task when the client goes away mid-stream
+        with anyio.move_on_after(0.12):
+            await collect(service, "one two three four five six seven eight")
+
+    anyio.run(disconnect)
+    assert not list(tmp_path.glob("*.part"))
+    assert not list(tmp_path.glob("*.mp3"))
+    assert service.cache.size == 0
+    service.shutdown()
+
+
+def test_evict_keeps_size_under_limit(tmp_path):
+    service = make_service(tmp_path, max_bytes=100)
+    for i in range(10):
+        anyio.run(collect, service, f"phrase number {i}")
+    assert service.cache.size <= 100
+    assert service.cache.size == sum(path.stat().st_size for path in tmp_path.glob("*.mp3"))
+    service.shutdown()
+
+
+def test_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        SpeechBackend()
+
+
+def test_create_backend():
+    assert isinstance(create_backend("stub"), StubBackend)
+    with pytest.raises(ValueError, match="Unknown text-to-speech backend 'polly'"):
+        create_backend("polly")
+
+
+def test_stub_yields_a_frame_per_word():
+    chunks = list(StubBackend().stream("धान गहुँ", "hi", None))
+    assert chunks[0].startswith(b"ID3")
+    assert chunks[1:] == [b"\xff\xfb" + "धान".encode(), b"\xff\xfb" + "गहुँ".encode()]
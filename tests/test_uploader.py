@@ -0,0 +1,50 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlmodel import SQLModel
+from starlette.datastructures import Headers
+
+from services.storage import BlobStore, LocalBackend
+from uploader import ImageUploader
+
+
+@pytest.fixture
+def uploader(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'blobs.db'}")
+    SQLModel.metadata.create_all(engine)
+    store = BlobStore(LocalBackend(tmp_path / "blobs"), engine, tmp_path / "work", ttls={"product": 0})
+    return ImageUploader(store, "product")
+
+
+def upload(data: bytes, content_type: str = "image/png") -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename="leaf.png", headers=Headers({"content-type": content_type}))
+
+
+def png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "green").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_decodable_image_is_stored(uploader):
+    stored = asyncio.run(uploader.save_file(upload(png())))
+    assert stored.new and stored.size == len(png())
+
+
+@pytest.mark.parametrize("data", [b"not an image at all", png()[:40]], ids=["garbage", "truncated"])
+def test_undecodable_image_is_rejected(uploader, data):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(uploader.save_file(upload(data)))
+    assert error.value.status_code == 415
+    # Nothing is left behind in staging
+    assert not any(uploader.store.staging_path().parent.iterdir())
+
+
+def test_content_type_is_still_checked(uploader):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(uploader.save_file(upload(png(), "text/plain")))
+    assert error.value.status_code == 400